@@ -4,7 +4,120 @@
 
 import csv
 import sys
+import getopt
+import hashlib
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import estimator
+import profiler
+
+# Version of analysis results.  Increment when a change alters highlights,
+# so that results cached by other programs are recomputed
+analysisVersion = 2
+
+# Estimate derivative of values with respect to times at every sample.
+# Fits polynomial of given degree over window of samples by least squares, and evaluates its slope.
+# Handles irregular timestamps.
+# With centered, window is centered on each sample, and slope is evaluated at center.
+# Otherwise, window trails each sample, so that estimate is causal and can be used on live data.
+# Samples without a full window get the value from the nearest full window.
+def localDerivative(times, values, window = 21, degree = 2, centered = False):
+    t = np.asarray(times, dtype=float)
+    v = np.asarray(values, dtype=float)
+    n = len(t)
+    window = min(window, n)
+    # Centered window must be odd to have center sample
+    if centered and window % 2 == 0:
+        window -= 1
+    if window <= degree:
+        return np.zeros(n)
+    pos = window // 2 if centered else window - 1
+    tw = sliding_window_view(t, window)
+    vw = sliding_window_view(v, window)
+    # Express times relative to sample at which slope is evaluated
+    dt = tw - tw[:,pos:pos+1]
+    powers = dt[:,:,None] ** np.arange(2*degree+1)
+    moments = powers.sum(axis=1)
+    idx = np.arange(degree+1)
+    # Normal equations, one system per window
+    lhs = moments[:,idx[:,None] + idx[None,:]]
+    rhs = (powers[:,:,:degree+1] * vw[:,:,None]).sum(axis=1)
+    coeffs = np.matmul(np.linalg.pinv(lhs), rhs[:,:,None])[:,:,0]
+    deriv = coeffs[:,1]
+    return np.concatenate((np.full(pos, deriv[0]), deriv, np.full(window-1-pos, deriv[-1])))
+
+# Centered moving average over window of samples.  Ends average over the part of the window inside the data
+def smooth(values, window):
+    v = np.asarray(values, dtype=float)
+    if window <= 1 or len(v) == 0:
+        return v
+    kernel = np.ones(window)
+    return np.convolve(v, kernel, mode='same') / np.convolve(np.ones(len(v)), kernel, mode='same')
+
+# Map sampled columns onto new time grid.
+# times: Sample times (nondecreasing).  columns: List of value arrays, one entry per sample
+# Mode is "linear" (interpolate), "nearest" (closest sample), or "hold" (most recent sample).
+# Values outside the range of times are clamped to the first or last sample.
+# Returns list of arrays, one per column
+def resample(times, columns, grid, mode = "linear"):
+    times = np.asarray(times, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    columns = [np.asarray(c, dtype=float) for c in columns]
+    n = len(times)
+    if n == 1:
+        return [np.full(len(grid), c[0]) for c in columns]
+    after = np.clip(np.searchsorted(times, grid, side='right'), 1, n-1)
+    before = after-1
+    if mode == "hold":
+        index = np.where(grid >= times[after], after, before)
+        return [c[index] for c in columns]
+    tbefore = times[before]
+    tspan = times[after] - tbefore
+    wt = np.divide(grid - tbefore, tspan, out=np.full(len(grid), 0.5), where=tspan > 0)
+    wt = np.clip(wt, 0.0, 1.0)
+    if mode == "nearest":
+        index = np.where(wt >= 0.5, after, before)
+        return [c[index] for c in columns]
+    if mode != "linear":
+        raise ValueError("Unknown resampling mode '%s'" % mode)
+    return [c[before] + wt * (c[after] - c[before]) for c in columns]
+
+# Times for sequence of count frames starting at tstart.
+# Computed from frame index to avoid accumulating error
+def frameTimes(tstart, count, tdelta):
+    return tstart + np.arange(count) * tdelta
+
+# Select indices of at most about budget samples that preserve shape of series.
+# Splits samples into equal buckets and keeps minimum and maximum of each,
+# along with first and last samples and any indices listed in keep.
+# Returns sorted array of indices.  Budget of None or 0 keeps all samples
+def decimate(values, budget = None, keep = []):
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    keep = np.asarray([k for k in keep if 0 <= k < n], dtype=int)
+    if not budget or n <= budget:
+        return np.arange(n)
+    buckets = max(1, (budget - len(keep) - 2) // 2)
+    size = -(-n // buckets)
+    # Pad with last value so that samples divide evenly into buckets
+    padded = np.concatenate((values, np.full(size * buckets - n, values[-1])))
+    blocks = padded.reshape(buckets, size)
+    starts = np.arange(buckets) * size
+    lows = starts + np.argmin(blocks, axis=1)
+    highs = starts + np.argmax(blocks, axis=1)
+    index = np.concatenate(([0, n-1], np.minimum(lows, n-1), np.minimum(highs, n-1), keep))
+    return np.unique(index)
+
+# Compute hash of file contents.  Used as key for caching results from log files
+def contentHash(fname, blockSize = 1 << 20):
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        block = f.read(blockSize)
+        while len(block) > 0:
+            h.update(block)
+            block = f.read(blockSize)
+    return h.hexdigest()
 
 class Evaluator:
 #    Array of dictionaries built from CSV reader.  One entry per sample
@@ -18,8 +131,23 @@ class Evaluator:
     vheading = "velocity"
     formats = ["%d", "%.3f", "%.3f", "%.3f", "%.3f"]
     vformat = "%.3f"
-
-    def __init__(self, root):
+#    Numeric columns, cached as NumPy arrays.  Indexed by CSV field or derived column name
+    columns = {}
+#    Derived columns and the methods that compute them
+    derivedColumns = { "velocity" : "computeVelocities",
+                       "kalman-altitude" : "computeKalmanAltitudes",
+                       "kalman-velocity" : "computeKalmanVelocities",
+                       "kalman-bias" : "computeKalmanBiases" }
+#    Array of Kalman filter states, one row [altitude, velocity, bias] per sample
+    states = None
+#    Parameters for velocity estimation
+    velocityWindow = 21
+    velocityDegree = 2
+#    Samples averaged when finding peak velocity
+    velocitySmoothing = 5
+
+    # Optional rows = (first, last) limits evaluation to that range of data rows (inclusive)
+    def __init__(self, root, rows = None):
         self.root = root
         csvName = root + ".csv"
         try:
@@ -29,10 +157,21 @@ class Evaluator:
             print("Couldn't open file '%s'" % csvName)
             return
         self.entries = []
-        creader = csv.DictReader(cfile)
-        for row in creader:
-            self.entries.append(row)
-        cfile.close()
+        self.columns = {}
+        self.states = None
+        with profiler.stage("load"):
+            creader = csv.DictReader(cfile)
+            if rows is None:
+                for row in creader:
+                    self.entries.append(row)
+            else:
+                first, last = rows
+                for r, row in enumerate(creader):
+                    if r > last:
+                        break
+                    if r >= first:
+                        self.entries.append(row)
+            cfile.close()
         self.rstart = self.findLaunch()
         self.tstart = self.getFloatField(self.rstart, "time")
         self.astart = self.getFloatField(self.rstart, "altitude")
@@ -53,30 +192,63 @@ class Evaluator:
     def getFloatField(self, row, kw):
         if row < 0 or row >= self.count():
             return 0.0
+        if kw in self.derivedColumns:
+            return float(self.getColumn(kw)[row])
         return float(self.getField(row, kw))
 
+    def getColumn(self, kw):
+        if kw not in self.columns:
+            if kw in self.derivedColumns:
+                self.columns[kw] = getattr(self, self.derivedColumns[kw])()
+            else:
+                self.columns[kw] = np.array([float(entry[kw]) for entry in self.entries])
+        return self.columns[kw]
+
     def getTimes(self):
-        return [self.getFloatField(r, "time") for r in range(self.count())]
+        return self.getColumn("time").tolist()
 
     def getFinalTime(self):
         return self.getFloatField(self.count()-1, "time")
 
     def getAltitudes(self):
-        return [self.getFloatField(r, "altitude") for r in range(self.count())]
+        return self.getColumn("altitude").tolist()
 
     def getAccelerations(self):
-        return [self.getFloatField(r, "acceleration") for r in range(self.count())]
+        return self.getColumn("acceleration").tolist()
 
     def getAccelerationXs(self):
-        return [self.getFloatField(r, "acceleration-X") for r in range(self.count())]
+        return self.getColumn("acceleration-X").tolist()
+
+    def getVelocities(self):
+        return self.getColumn("velocity").tolist()
+
+    # Vertical velocity at each sample, from local fit over window of altitudes.
+    # Logs are analyzed after the flight, so window is centered, which avoids the noise of the slope at the end of a trailing fit
+    def computeVelocities(self):
+        return localDerivative(self.getColumn("time"), self.getColumn("altitude"), self.velocityWindow, self.velocityDegree, True)
+
+    # Altitude, velocity, and accelerometer bias from fusing acceleration with altitude
+    def getStates(self):
+        if self.states is None:
+            sequence = self.getColumn("sid") if "sid" in self.entries[0] else None
+            self.states = estimator.estimateStates(self.getColumn("time"), self.getColumn("altitude"),
+                                                   self.getColumn("acceleration-X"), sequence)
+        return self.states
+
+    def computeKalmanAltitudes(self):
+        return self.getStates()[:,0]
+
+    def computeKalmanVelocities(self):
+        return self.getStates()[:,1]
+
+    def computeKalmanBiases(self):
+        return self.getStates()[:,2]
 
     def getNormTimes(self, rstart, rend):
-        times = self.getTimes()
-        return [times[r]-self.tstart for r in range(rstart, rend+1)]
+        return self.getColumn("time")[rstart:rend+1] - self.tstart
 
     def getNormAltitudes(self, rstart, rend):
-        altitudes = self.getAltitudes()
-        return [max(0, altitudes[r]-self.astart) for r in range(rstart, rend+1)]
+        return np.maximum(0.0, self.getColumn("altitude")[rstart:rend+1] - self.astart)
 
     def findLaunch(self):
         accelerations = self.getAccelerations()
@@ -147,10 +319,18 @@ class Evaluator:
                 return r
         return -1
 
-    def plotData(self, outfile):
+    # Times and altitudes of flight, relative to launch, as arrays.
+    # Optionally limit to about budget points, always including rows listed in keepRows
+    def plotPoints(self, budget = None, keepRows = []):
         rend = self.findLand()
         times = self.getNormTimes(self.rstart, rend)
         altitudes = self.getNormAltitudes(self.rstart, rend)
+        index = decimate(altitudes, budget, [r - self.rstart for r in keepRows])
+        return (times[index], altitudes[index])
+
+    # Write flight altitudes as pgfplots coordinates
+    def plotData(self, outfile, budget = None, keepRows = []):
+        times, altitudes = self.plotPoints(budget, keepRows)
         outfile.write("coordinates {");
         count = 0
         for (t, a) in zip(times, altitudes):
@@ -217,61 +397,67 @@ class Evaluator:
             if es is not None:
                 print("\t".join(es))
             
-    def tabularizeHighlights(self, h, outfile):
-        outfile.write("\\begin{tabular}{lrrrr}\n")
-        outfile.write("\\multicolumn{5}{l}{\\textbf{%s}} \\\\ \n" % self.root)
-        outfile.write("\\toprule\n")
-        outfile.write("Event & \\makebox[25mm]{Time} & \\makebox[25mm]{Altitude} & \\makebox[25mm]{Acceleration} & \\makebox[25mm]{Velocity}\\\\ \n")
-        outfile.write(" &      \\makebox[25mm]{(seconds)} & \\makebox[25mm]{(meters)} & \\makebox[25mm]{(g)} & \\makebox[25mm]{(m/s)} \\\\ \n")
-        outfile.write("\\midrule\n")
+    # Rows of highlights table.  Each row is list [label, time, altitude, acceleration, velocity],
+    # with times and altitudes relative to launch, and None for empty entries
+    def highlightRows(self, h):
+        rows = []
 
         # Launch
         accel = h['launch']['accel']
-        outfile.write("Launch & 0.000 & 0.000 & %.3f &  \\\\ \n" % (accel))
+        rows.append(["Launch", 0.0, 0.0, accel, None])
 
         # Second stage
         if 'second' in h:
             alt = max(0.0, h['second']['alt']-self.astart)
             time = h['second']['time'] - self.tstart
-            outfile.write("Second Stage & %.3f & %.3f &  &  \\\\ \n" % (time, alt))
+            rows.append(["Second Stage", time, alt, None, None])
 
         # Max Thrust
         accel = h['thr-max']['accel']
         alt = max(0.0,  h['thr-max']['alt']-self.astart)
         time = h['thr-max']['time'] - self.tstart
-        outfile.write("Max Thrust & %.3f & %.3f & %.3f &  \\\\ \n" % (time, alt, accel))
+        rows.append(["Max Thrust", time, alt, accel, None])
 
-        
         # End Thrust
         alt = h['thr-end']['alt']-self.astart
         time = h['thr-end']['time'] - self.tstart
-        outfile.write("End Thrust & %.3f & %.3f &  &  \\\\ \n" % (time, alt))
+        rows.append(["End Thrust", time, alt, None, None])
 
         # Max velocity
         alt = h['v-max']['alt']-self.astart
         time = h['v-max']['time'] - self.tstart
         accel = -h['v-max']['accel']
         vel = h['v-max']['velocity']
-        outfile.write("Max Velocity & %.3f & %.3f & %.3f & %.3f \\\\ \n" % (time, alt, accel, vel))
-        
+        rows.append(["Max Velocity", time, alt, accel, vel])
+
         # Apogee
         alt = h['apogee']['alt']-self.astart
         time = h['apogee']['time'] - self.tstart
         accel = -h['apogee']['accel']
-        outfile.write("Apogee & %.3f & %.3f & %.3f &  \\\\ \n" % (time, alt, accel))
+        rows.append(["Apogee", time, alt, accel, None])
 
         # Deploy
         alt = h['deploy']['alt']-self.astart
         time = h['deploy']['time'] - self.tstart
         accel = -h['deploy']['accel']
-        outfile.write("Parachute & %.3f & %.3f & %.3f &  \\\\ \n" % (time, alt, accel))
-
+        rows.append(["Parachute", time, alt, accel, None])
 
         # Landing
         time = h['land']['time'] - self.tstart
         vel = h['land']['velocity']
-        outfile.write("Landing & %.3f & 0.000 &  & %.3f \\\\ \n" % (time, vel))
+        rows.append(["Landing", time, 0.0, None, vel])
+        return rows
 
+    def tabularizeHighlights(self, h, outfile):
+        outfile.write("\\begin{tabular}{lrrrr}\n")
+        outfile.write("\\multicolumn{5}{l}{\\textbf{%s}} \\\\ \n" % self.root)
+        outfile.write("\\toprule\n")
+        outfile.write("Event & \\makebox[25mm]{Time} & \\makebox[25mm]{Altitude} & \\makebox[25mm]{Acceleration} & \\makebox[25mm]{Velocity}\\\\ \n")
+        outfile.write(" &      \\makebox[25mm]{(seconds)} & \\makebox[25mm]{(meters)} & \\makebox[25mm]{(g)} & \\makebox[25mm]{(m/s)} \\\\ \n")
+        outfile.write("\\midrule\n")
+        for row in self.highlightRows(h):
+            cells = [row[0]] + ["" if v is None else "%.3f" % v for v in row[1:]]
+            outfile.write(" & ".join(cells) + " \\\\ \n")
         outfile.write("\\bottomrule\n")
         outfile.write("\\end{tabular}\n")
 
@@ -303,16 +489,12 @@ class Evaluator:
     def findMaxVelocity(self):
         rstart = self.findLaunch()
         rend = self.findApogee()
-        coeffs = self.velocityCurve(rstart, rend)
-        rbest = -1
-        vbest = -1.0
-        for r in range(rstart, rend):
-            t = self.getFloatField(r, 'time')
-            velo = self.ceval(coeffs, t)
-            if velo > vbest:
-                vbest = velo
-                rbest = r
-        return (rbest, vbest)
+        if rstart < 0 or rend <= rstart:
+            return (-1, -1.0)
+        # Peak of smoothed velocities, so that noise in single estimates doesn't pull it up
+        velocities = smooth(self.getColumn("velocity"), self.velocitySmoothing)[rstart:rend]
+        rbest = rstart + int(np.argmax(velocities))
+        return (rbest, float(velocities[rbest-rstart]))
 
     def findLandVelocity(self):
         rapogee = self.findApogee()
@@ -329,33 +511,24 @@ class Evaluator:
             tstart = times[rstart]
             if tstart <= tprev-2.0:
                 break
-        coeffs = self.velocityCurve(rstart, rprev+1)
-        tavg = (tstart + tprev)//2
-        velo = self.ceval(coeffs, tavg)
-        return velo
+        # Average descent rate over interval
+        velocities = self.getColumn("velocity")[rstart:rprev+1]
+        return float(np.mean(velocities))
 
     def interpolateValue(self, t, tbefore, tafter, vbefore, vafter):
         if tbefore == tafter:
             return (vbefore+vafter)/2.0
         wt = (t-tbefore)/(tafter-tbefore)
-        return wt*vbefore + (1.0-wt)*vafter
+        return (1.0-wt)*vbefore + wt*vafter
+
+    # Resample named columns onto time grid.  Returns list of arrays
+    def resampleColumns(self, kws, grid, mode = "linear"):
+        return resample(self.getColumn("time"), [self.getColumn(kw) for kw in kws], grid, mode)
         
     def valueSequence(self, values, tstart, tduration, tdelta):
-        sequence = []
-        times = self.getTimes()
-        t = tstart
-        r = 0
-        while t <= tstart + tduration:
-            if t <= 0:
-                sequence.append(values[0])
-            elif t >= times[-1]:
-                sequence.append(values[-1])
-            else:
-                while times[r] < t:
-                    r += 1
-                sequence.append(self.interpolateValue(t, times[r-1], times[r], values[r-1], values[r]))
-            t += tdelta
-        return sequence
+        count = int(np.floor(tduration / tdelta + 1e-9)) + 1
+        grid = frameTimes(tstart, count, tdelta)
+        return resample(self.getColumn("time"), [values], grid)[0].tolist()
 
         
         
@@ -395,14 +568,28 @@ def fit(e):
 
 def process(root):
     e = Evaluator(root)
-    h = e.highlights()
+    with profiler.stage("detect"):
+        h = e.highlights()
     e.showHighlights(h)
             
+def usage(name):
+    print("Usage: %s [-h] ROOT" % name)
+    print(" -h       Print this message")
+    profiler.usage()
+
 def run(name, args):
     root = None
-    if len(args) == 1 and args[0] == '-h' or len(args) != 1:
-        print("Usage: %s [-h] ROOT" % name)
+    optList, args = getopt.getopt(args, "h", profiler.longOptions)
+    for (opt, val) in optList:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt in profiler.optionNames:
+            profiler.setOption(opt, val)
+    if len(args) != 1:
+        usage(name)
         return
+    profiler.begin()
     root = args[0]
     fields = root.split(".")
     if len(fields) > 1 and fields[-1] == 'csv':
@@ -3,18 +3,38 @@
 # Annotate rocket video with telemetry data
 
 import cv2
-import scipy.io
 import numpy as np
 import ffmpeg
 import os
 import sys
 import getopt
 import glob
+import json
+import shlex
+import fractions
+import tempfile
+import multiprocessing
 
 import analyze
+import profiler
+import soundtrack
+import sync
 
 def usage(name):
-    print("Usage: %s [-h] [-k] [-v VERB] -i IVFILE.AVI -d DFILE.csv [-o OVFILE.mp4]" % name)
+    print("Usage: %s [-h] [-k] [-v VERB] [-m MODE] [-j JOBS] [-w PRE:POST] [-y] [-x WIDGETS] -i IVFILE.AVI -d DFILE.csv [-o OVFILE.mp4]" % name)
+    print("       %s [-h] [-k] [-v VERB] [-m MODE] [-j JOBS] [-w PRE:POST] [-y] [-x WIDGETS] -b BATCH [-o OUTDIR]" % name)
+    print(" -m MODE  Processing mode: stream (frames piped through memory), frames (frames stored as files),")
+    print("          or filter (overlays drawn by ffmpeg filters) (default = stream)")
+    print(" -j JOBS  Number of segments to process in parallel in stream mode (default = number of CPUs)")
+    print(" -w PRE:POST Only keep video from PRE seconds before launch until POST seconds after landing")
+    print(" --preview   Write small draft clip (default OVFILE = IVFILE-preview.mp4)")
+    print(" --sheet=N   Write contact sheet of N frames (default OVFILE = IVFILE-sheet.png)")
+    print(" -x WIDGETS Comma-separated list of extra overlays: %s" % ", ".join(widgetNames))
+    print(" -y       Align video with data by correlating soundtrack with acceleration")
+    print(" -b BATCH Annotate videos listed in manifest file BATCH (lines VIDEO DATA [OUTPUT]),")
+    print("          or videos in directory BATCH having logs with same root name")
+    print("          With -b, JOBS is number of videos processed at once (default = based on CPUs and memory)")
+    profiler.usage()
 
 def getRoot(fname):
     fields = fname.split(".")
@@ -29,85 +49,6 @@ def getExtension(fname):
     return ""
     
 
-class Sound:
-    # Process audio data
-    # Use to detect launch starting point
-
-    # Name of audio file
-    audioName = None
-    # Verbosity level
-    verbLevel = 1
-    # Keep intermediate files
-    keep = False
-
-    # General parameters
-    # audio sample rate
-    rate = 8000
-    # RMS level for launch
-    threshold = 20000.0
-    # Required duration (seconds)
-    duration = 1.0
-    # Sample interval
-    tdelta = 0.01
-    
-    def __init__(self, aname, verbLevel = 1, keep = False):
-        self.audioName = aname
-        self.verbLevel = verbLevel
-        self.keep = keep
-
-    def readWav(self):
-        try:
-            self.rate, val = scipy.io.wavfile.read(self.audioName)
-        except Exception as ex:
-            print("Couldn't read WAV file '%s' (%s)" % (self.audioName, str(ex)))
-            return None
-        return val
-
-    # Construct array of RMS values for array
-    # Each for a sample of duration tdelta
-    def rmsValues(self, val):
-        rms = []
-        scount = int(self.tdelta * self.rate)
-        pos = 0
-        while pos + scount <= len(val):
-            r = np.sqrt(np.sum(np.square(val[pos:pos+scount], dtype=float))/float(scount))
-            rms.append(r)
-            pos += scount
-        return rms
-
-    def findLaunchTime(self, rms):
-        need = self.duration / self.tdelta
-        indices = [i for i in range(len(rms)) if rms[i] > self.threshold]
-        firstI = indices[0]
-        lastI = indices[0]
-        for i in indices[1:]:
-            if i == lastI+1:
-                lastI = i
-            else:
-                firstI = i
-                lastI = i
-            if lastI-firstI+1 >= need:
-                return firstI * self.tdelta
-        return None
-
-    # Run entire chain on audio file
-    def launchTime(self):
-        val = self.readWav()
-        if val is None:
-            return -1.0
-        if self.verbLevel >= 2:
-            print("Read %d samples from %s" % (len(val), self.audioName))
-        rms = self.rmsValues(val)
-        if self.verbLevel >= 2:
-            print("Got %d RMS values" % (len(rms)))
-        t = self.findLaunchTime(rms)
-        if t is None:
-            return -1.0
-        if self.verbLevel >= 1:
-            print("Got launch time %.3f" % t)
-        return t
-    
-        
 # Annotate image
 class Image:
     imageName = None
@@ -121,20 +62,39 @@ class Image:
     altitudeBottomPos = 0
     accelerationLeftPos = 0.10
     accelerationBottomPos = 0
+    velocityLeftPos = 0.20
+    velocityBottomPos = 0
+    # Altitude trace panel (fractions of image width and height)
+    traceLeftPos = 0.70
+    traceTopPos = 0.04
+    traceWidth = 0.28
+    traceHeight = 0.25
 
     barHeight = 0.5
     barWidth = 0.075
     upColor = (0,0,127)
     peakColor = (127,0,0)
+    downColor = (127,127,0)
     labelColor = (0,150,150)
+    traceColor = (0,0,200)
+    eventColor = (255,255,255)
     leftPad = 3
     bottomPad = 8
+    fontScale = 0.5
+    lineThickness = 2
+    # Size relative to full-resolution video.  Scales pads, font, and lines
+    scale = 1.0
 
-    def __init__(self, imageName, verbLevel = 1):
+    # Cached tick marks and labels.  Geometry and scale --> GaugeSprite
+    sprites = {}
+
+    # Either read image from file imageName or annotate array image (height x width x 3, BGR) in place
+    def __init__(self, imageName, verbLevel = 1, image = None, scale = 1.0):
         self.imageName = imageName
         self.verbLevel = verbLevel
+        self.scale = scale
         try:
-            self.image = cv2.imread(imageName)
+            self.image = cv2.imread(imageName) if image is None else image
             self.width = np.shape(self.image)[0]
             self.height = np.shape(self.image)[0]
         except Exception as ex:
@@ -143,74 +103,144 @@ class Image:
             self.image = None
 
     def showAltitude(self, altitude, limitAltitude, peakAltitude = None, deltaAltitude=10.0):
+        self.showBar(altitude, limitAltitude, peakAltitude, deltaAltitude, self.altitudeLeftPos, self.altitudeBottomPos, "m")
+
+    def showAcceleration(self, acceleration, limitAcceleration, peakAcceleration = None, deltaAcceleration=1.0):
+        self.showBar(acceleration, limitAcceleration, peakAcceleration, deltaAcceleration, self.accelerationLeftPos, self.accelerationBottomPos, "g")
+
+    # Draw bar with background and current and peak values as array slices,
+    # and then blend in cached sprite with tick marks and labels
+    def showBar(self, value, limit, peak, delta, leftPos, bottomPos, unit):
         if self.image is None:
             return
-        altitude = max(0, min(altitude, limitAltitude))
-        if peakAltitude is not None:
-            peakAltitude = max(0, min(peakAltitude, limitAltitude))
-        left = int(self.width*self.altitudeLeftPos)
-        right = int(self.width*(self.altitudeLeftPos+self.barWidth))
+        value = max(0, min(value, limit))
+        if peak is not None:
+            peak = max(0, min(peak, limit))
+        left, right, upper, lower = self.barBounds(leftPos, bottomPos)
+        sprite = self.gaugeSprite(left, right, upper, lower, limit, delta, bottomPos, unit)
+        roi = self.image[sprite.top:sprite.bottom, sprite.left:sprite.right]
+        # Rectangle corners are inclusive
+        bleft = left-sprite.left
+        bright = min(right+1, sprite.right)-sprite.left
+        bottom = lower-sprite.top+1
         # Background
-        upper = int(self.height*(1.0-self.altitudeBottomPos-self.barHeight))
-        lower = int(self.height*(1.0-self.altitudeBottomPos))
-        cv2.rectangle(self.image, (left,upper), (right,lower), (255,255,255), -1)
-        # current altitude
-        aheight = altitude/limitAltitude * self.barHeight
-        aupper = int(self.height*(1.0-self.altitudeBottomPos-aheight))
-        if aheight > 0:
-            cv2.rectangle(self.image, (left,aupper), (right,lower), self.upColor, -1)
-        # peak altitude
-        if peakAltitude is not None and peakAltitude > altitude:
-            pheight = peakAltitude/limitAltitude * self.barHeight
-            pupper = int(self.height*(1.0-self.altitudeBottomPos-pheight))
-            cv2.rectangle(self.image, (left,pupper), (right,aupper), self.peakColor, -1)
-        # Tick marks and labels
-        alt = 0.0
-        while alt <= limitAltitude:
-            height = alt/limitAltitude * self.barHeight
-            h = int(self.height*(1.0-self.altitudeBottomPos-height))
-            cv2.line(self.image, (left,h), (right,h), (0,0,0), 2)
-            if alt < limitAltitude:
-                astring = "%dm" % int(alt)
-                pstring = "%dm" % limitAltitude
-                astring = " " * (len(pstring)-len(astring)) + astring
-                cv2.putText(self.image, astring, (left+self.leftPad, h-self.bottomPad), cv2.FONT_HERSHEY_SIMPLEX, 0.5, self.labelColor, 1, cv2.LINE_AA)
-            alt += deltaAltitude
+        sprite.fill(roi, upper-sprite.top, bottom, bleft, bright, (255,255,255))
+        # Current value
+        vheight = value/limit * self.barHeight
+        vupper = int(self.height*(1.0-bottomPos-vheight))
+        if vheight > 0:
+            sprite.fill(roi, vupper-sprite.top, bottom, bleft, bright, self.upColor)
+        # Peak value
+        if peak is not None and peak > value:
+            pheight = peak/limit * self.barHeight
+            pupper = int(self.height*(1.0-bottomPos-pheight))
+            sprite.fill(roi, pupper-sprite.top, vupper-sprite.top+1, bleft, bright, self.peakColor)
+        sprite.blend(roi)
 
-    def showAcceleration(self, acceleration, limitAcceleration, peakAcceleration = None, deltaAcceleration=1.0):
+    # Bar centered at zero, growing up for positive velocity and down for negative
+    def showVelocity(self, velocity, limitVelocity, deltaVelocity=10.0):
         if self.image is None:
             return
-        acceleration = max(0, min(acceleration, limitAcceleration))
-        if peakAcceleration is not None:
-            peakAcceleration = max(0, min(peakAcceleration, limitAcceleration))
-        left = int(self.width*self.accelerationLeftPos)
-        right = int(self.width*(self.accelerationLeftPos+self.barWidth))
-        # Background
-        upper = int(self.height*(1.0-self.accelerationBottomPos-self.barHeight))
-        lower = int(self.height*(1.0-self.accelerationBottomPos))
-        cv2.rectangle(self.image, (left,upper), (right,lower), (255,255,255), -1)
-        # current acceleration
-        aheight = max(0.0, acceleration/limitAcceleration * self.barHeight)
-        aupper = int(self.height*(1.0-self.accelerationBottomPos-aheight))
-        if aheight > 0:
-            cv2.rectangle(self.image, (left,aupper), (right,lower), self.upColor, -1)
-        # peak acceleration
-        if peakAcceleration is not None and peakAcceleration > acceleration:
-            pheight = max(0.0, peakAcceleration/limitAcceleration * self.barHeight)
-            pupper = int(self.height*(1.0-self.accelerationBottomPos-pheight))
-            cv2.rectangle(self.image, (left,pupper), (right,aupper), self.peakColor, -1)
-        # Tick marks and labels
-        acc = 0.0
-        while acc <= limitAcceleration:
-            height = acc/limitAcceleration * self.barHeight
-            h = int(self.height*(1.0-self.accelerationBottomPos-height))
-            cv2.line(self.image, (left,h), (right,h), (0,0,0), 2)
-            if acc < limitAcceleration:
-                astring = "%dg" % int(acc)
-                pstring = "%dg" % limitAcceleration
-                astring = " " * (len(pstring)-len(astring)) + astring
-                cv2.putText(self.image, astring, (left+self.leftPad, h-self.bottomPad), cv2.FONT_HERSHEY_SIMPLEX, 0.5, self.labelColor, 1, cv2.LINE_AA)
-            acc += deltaAcceleration
+        velocity = max(-limitVelocity, min(velocity, limitVelocity))
+        bottomPos = self.velocityBottomPos
+        left, right, upper, lower = self.barBounds(self.velocityLeftPos, bottomPos)
+        sprite = self.gaugeSprite(left, right, upper, lower, limitVelocity, deltaVelocity, bottomPos, "m/s", -limitVelocity)
+        roi = self.image[sprite.top:sprite.bottom, sprite.left:sprite.right]
+        bleft = left-sprite.left
+        bright = min(right+1, sprite.right)-sprite.left
+        sprite.fill(roi, upper-sprite.top, lower-sprite.top+1, bleft, bright, (255,255,255))
+        zero = int(self.height*(1.0-bottomPos-0.5*self.barHeight))
+        vpos = int(self.height*(1.0-bottomPos-(velocity+limitVelocity)/(2*limitVelocity)*self.barHeight))
+        if vpos != zero:
+            sprite.fill(roi, min(vpos, zero)-sprite.top, max(vpos, zero)-sprite.top+1, bleft, bright,
+                        self.upColor if velocity > 0 else self.downColor)
+        sprite.blend(roi)
+
+    # Lines of text for events that have occurred, below trace panel
+    def showEvents(self, texts):
+        if self.image is None:
+            return
+        x = int(np.shape(self.image)[1]*self.traceLeftPos)
+        y = int(np.shape(self.image)[0]*(self.traceTopPos+self.traceHeight))
+        step = int(round(22 * self.scale))
+        for text in texts:
+            y += step
+            cv2.putText(self.image, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, self.fontScale * self.scale, (0,0,0), 3, cv2.LINE_AA)
+            cv2.putText(self.image, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, self.fontScale * self.scale, self.eventColor, 1, cv2.LINE_AA)
+
+    # Left, top, right, and bottom pixel positions of trace panel
+    def traceBounds(self):
+        width = np.shape(self.image)[1]
+        height = np.shape(self.image)[0]
+        left = int(width*self.traceLeftPos)
+        top = int(height*self.traceTopPos)
+        return left, top, left + int(width*self.traceWidth), top + int(height*self.traceHeight)
+
+    # Empty trace panel, with axis labels
+    def traceCanvas(self, width, height, duration, limitAltitude):
+        canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+        cv2.rectangle(canvas, (0,0), (width-1,height-1), (0,0,0), 1)
+        font = self.fontScale * self.scale * 0.8
+        cv2.putText(canvas, "%dm" % limitAltitude, (3, int(12*self.scale)+3), cv2.FONT_HERSHEY_SIMPLEX, font, self.labelColor, 1, cv2.LINE_AA)
+        cv2.putText(canvas, "%.0fs" % duration, (width - int(40*self.scale), height-4), cv2.FONT_HERSHEY_SIMPLEX, font, self.labelColor, 1, cv2.LINE_AA)
+        return canvas
+
+    # Left, right, upper, and lower pixel positions of bar
+    def barBounds(self, leftPos, bottomPos):
+        left = int(self.width*leftPos)
+        right = int(self.width*(leftPos+self.barWidth))
+        upper = int(self.height*(1.0-bottomPos-self.barHeight))
+        lower = int(self.height*(1.0-bottomPos))
+        return left, right, upper, lower
+
+    # Upper pixel positions of bars showing array of values
+    def barTops(self, values, limit, bottomPos):
+        heights = np.clip(values, 0, limit) / limit * self.barHeight
+        return (self.height*(1.0-bottomPos-heights)).astype(int)
+
+    # Images with tick marks and labels drawn on black and on white backgrounds.
+    # Each tick specification is (left, right, limit, delta, bottomPos, unit)
+    def tickLayers(self, ticks):
+        black = np.zeros(np.shape(self.image), dtype=np.uint8)
+        white = np.full(np.shape(self.image), 255, dtype=np.uint8)
+        for spec in ticks:
+            self.drawTicks(black, *spec)
+            self.drawTicks(white, *spec)
+        return black, white
+
+    # Image (BGRA) with tick marks and labels for both bars on transparent background
+    def gaugeOverlay(self, limitAltitude, deltaAltitude, limitAcceleration, deltaAcceleration):
+        aleft, aright, aupper, alower = self.barBounds(self.altitudeLeftPos, self.altitudeBottomPos)
+        gleft, gright, gupper, glower = self.barBounds(self.accelerationLeftPos, self.accelerationBottomPos)
+        black, white = self.tickLayers([(aleft, aright, limitAltitude, deltaAltitude, self.altitudeBottomPos, "m"),
+                                        (gleft, gright, limitAcceleration, deltaAcceleration, self.accelerationBottomPos, "g")])
+        alpha = 255 - (white.astype(np.uint16) - black).max(axis=2)
+        colors = np.minimum(255, black.astype(np.uint16) * 255 // np.maximum(alpha, 1)[:,:,np.newaxis])
+        return np.dstack((colors, alpha)).astype(np.uint8)
+
+    # Tick marks and labels for bar.  Rendered once for each geometry and scale
+    def gaugeSprite(self, left, right, upper, lower, limit, delta, bottomPos, unit, lowest = 0.0):
+        key = (np.shape(self.image), self.scale, left, right, upper, lower, limit, delta, bottomPos, unit, lowest)
+        if key not in Image.sprites:
+            Image.sprites[key] = GaugeSprite(self, left, right, upper, lower, limit, delta, bottomPos, unit, lowest)
+        return Image.sprites[key]
+
+    # Draw tick marks and labels for bar onto image.  Bar covers values from lowest to limit
+    def drawTicks(self, image, left, right, limit, delta, bottomPos, unit, lowest = 0.0):
+        thickness = max(1, int(round(self.lineThickness * self.scale)))
+        pad = int(round(self.leftPad * self.scale))
+        raised = int(round(self.bottomPad * self.scale))
+        length = max(len("%d%s" % (limit, unit)), len("%d%s" % (lowest, unit)))
+        val = lowest
+        while val <= limit:
+            height = (val-lowest)/(limit-lowest) * self.barHeight
+            h = int(self.height*(1.0-bottomPos-height))
+            cv2.line(image, (left,h), (right,h), (0,0,0), thickness)
+            if val < limit:
+                vstring = "%d%s" % (int(round(val)), unit)
+                vstring = " " * (length-len(vstring)) + vstring
+                cv2.putText(image, vstring, (left+pad, h-raised), cv2.FONT_HERSHEY_SIMPLEX, self.fontScale * self.scale, self.labelColor, 1, cv2.LINE_AA)
+            val += delta
 
     def write(self, name = None):
         if self.image is None:
@@ -222,14 +252,271 @@ class Image:
                 print("Failed to write image %s" % name)
         
         
+# Tick marks and labels for bar, as colors and opacities for region of image containing bar.
+# Found by drawing onto black and white backgrounds, so that antialiased text blends as when drawn directly.
+# Values are scaled by 256, so that blending needs only integer operations
+class GaugeSprite:
+    # Region of image
+    top = 0
+    bottom = 0
+    left = 0
+    right = 0
+    # Color times opacity (plus rounding), and 1 - opacity, for each pixel of region
+    colors = None
+    transparency = None
+    # Workspace for blending
+    buffer = None
+    # Color --> row of pixels spanning bar
+    fills = {}
+
+    def __init__(self, im, left, right, upper, lower, limit, delta, bottomPos, unit, lowest = 0.0):
+        black, white = im.tickLayers([(left, right, limit, delta, bottomPos, unit, lowest)])
+        clear = (white.astype(np.uint16) - black).max(axis=2)
+        # Region covers ticks, labels, and bar
+        ys, xs = np.nonzero(clear < 255)
+        ys = np.append(ys, [upper, lower])
+        xs = np.append(xs, [left, right])
+        self.top = max(0, ys.min())
+        self.bottom = min(np.shape(im.image)[0], ys.max() + 1)
+        self.left = max(0, xs.min())
+        self.right = min(np.shape(im.image)[1], xs.max() + 1)
+        region = (slice(self.top, self.bottom), slice(self.left, self.right))
+        transparency = (clear[region] * 256 + 127) // 255
+        self.transparency = np.repeat(transparency[:,:,np.newaxis], 3, axis=2)
+        self.colors = np.minimum(black[region].astype(np.uint16) * 256, (256 - self.transparency) * 255) + 128
+        self.buffer = np.empty(np.shape(self.colors), dtype=np.uint16)
+        self.fills = {}
+
+    def fill(self, roi, upper, lower, left, right, color):
+        if color not in self.fills:
+            self.fills[color] = np.tile(np.array(color, dtype=np.uint8), (right-left, 1))
+        roi[upper:lower, left:right] = self.fills[color]
+
+    # Blend tick marks and labels into region of image
+    def blend(self, roi):
+        np.multiply(roi, self.transparency, out=self.buffer)
+        np.add(self.buffer, self.colors, out=self.buffer)
+        np.right_shift(self.buffer, 8, out=self.buffer)
+        np.copyto(roi, self.buffer, casting='unsafe')
+
+# Optional overlays
+widgetNames = ["trace", "velocity", "events"]
+# Events shown by events widget, with their labels
+eventLabels = [("thr-end", "Burnout"), ("apogee", "Apogee"), ("deploy", "Deploy")]
+
+# Audio codecs that can be copied into MP4 file without conversion
+mp4AudioCodecs = ["aac", "mp3", "ac3", "eac3", "alac", "opus"]
+
+# Bar scales, and telemetry values and running peaks for sequence of frames
+class FrameLabels:
+    limitAltitude = 100
+    deltaAltitude = 10
+    limitAcceleration = 10
+    deltaAcceleration = 1
+    altitudes = None
+    accelerations = None
+    peakAltitudes = None
+    peakAccelerations = None
+    # Optional widgets
+    velocities = None
+    limitVelocity = 10
+    deltaVelocity = 2
+    trace = None
+    # List of (frame index, text) for events
+    events = []
+
+    def __init__(self, altitudes, accelerations, peakAltitudes = None, peakAccelerations = None):
+        self.altitudes = altitudes
+        self.accelerations = accelerations
+        # Running peaks, starting from zero
+        self.peakAltitudes = np.maximum(0.0, np.maximum.accumulate(altitudes)) if peakAltitudes is None else peakAltitudes
+        self.peakAccelerations = np.maximum(0.0, np.maximum.accumulate(accelerations)) if peakAccelerations is None else peakAccelerations
+
+    def setLimits(self, maxAltitude, maxAcceleration):
+        self.limitAltitude = 100
+        while self.limitAltitude < maxAltitude:
+            self.limitAltitude += 100
+        self.deltaAltitude = self.limitAltitude / 10
+        self.limitAcceleration = 10
+        while self.limitAcceleration < maxAcceleration:
+            self.limitAcceleration += 10
+        self.deltaAcceleration = self.limitAcceleration / 10
+
+    def setVelocities(self, velocities, maxSpeed):
+        self.velocities = velocities
+        self.limitVelocity = 10
+        while self.limitVelocity < maxSpeed:
+            self.limitVelocity += 10
+        self.deltaVelocity = self.limitVelocity / 5
+
+    # Labels for frames start to end-1.  Keeps peaks, trace, and events from before start
+    def slice(self, start, end):
+        result = FrameLabels(self.altitudes[start:end], self.accelerations[start:end],
+                             self.peakAltitudes[start:end], self.peakAccelerations[start:end])
+        result.setLimits(self.limitAltitude, self.limitAcceleration)
+        if self.velocities is not None:
+            result.setVelocities(self.velocities[start:end], self.limitVelocity)
+        if self.trace is not None:
+            result.trace = self.trace.slice(start)
+        result.events = [(index - start, text) for index, text in self.events]
+        return result
+
+    # Draw bars for frame i
+    def label(self, im, i):
+        im.showAltitude(self.altitudes[i], self.limitAltitude, self.peakAltitudes[i], self.deltaAltitude)
+        im.showAcceleration(self.accelerations[i], self.limitAcceleration, self.peakAccelerations[i], self.deltaAcceleration)
+        if self.velocities is not None:
+            im.showVelocity(self.velocities[i], self.limitVelocity, self.deltaVelocity)
+        if self.trace is not None:
+            self.trace.draw(im, i)
+        if len(self.events) > 0:
+            im.showEvents([text for index, text in self.events if index <= i])
+
+# Altitude vs. time, growing as flight progresses.
+# Trace is accumulated on persistent canvas, so each frame adds only newest segment
+class TraceWidget:
+    # Data time and altitude at each frame of whole sequence, and index in them of frame 0
+    times = None
+    altitudes = None
+    offset = 0
+    # Ranges of axes
+    tstart = 0.0
+    tend = 1.0
+    limitAltitude = 100
+    # Panel with trace drawn through frame drawn, and pixel positions of points
+    canvas = None
+    drawn = -1
+    xs = None
+    ys = None
+
+    def __init__(self, times, altitudes, tstart, tend, limitAltitude):
+        self.times = times
+        self.altitudes = altitudes
+        self.tstart = tstart
+        self.tend = tend if tend > tstart else tstart + 1.0
+        self.limitAltitude = limitAltitude
+        self.offset = 0
+        self.canvas = None
+        self.drawn = -1
+
+    # Trace starting at frame start.  Canvas is rebuilt, including earlier part of trace, when first drawn
+    def slice(self, start):
+        result = TraceWidget(self.times, self.altitudes, self.tstart, self.tend, self.limitAltitude)
+        result.offset = self.offset + start
+        return result
+
+    def reset(self, im, width, height):
+        self.canvas = im.traceCanvas(width, height, self.tend - self.tstart, self.limitAltitude)
+        self.drawn = -1
+        fx = np.clip((self.times - self.tstart) / (self.tend - self.tstart), 0.0, 1.0)
+        fy = np.clip(self.altitudes / self.limitAltitude, 0.0, 1.0)
+        self.xs = (fx * (width-3)).astype(np.int32) + 1
+        self.ys = ((1.0 - fy) * (height-3)).astype(np.int32) + 1
+
+    def draw(self, im, i):
+        if im.image is None:
+            return
+        left, top, right, bottom = im.traceBounds()
+        j = self.offset + i
+        if self.canvas is None or np.shape(self.canvas)[:2] != (bottom-top, right-left) or j < self.drawn:
+            self.reset(im, right-left, bottom-top)
+        thickness = max(1, int(round(2 * im.scale)))
+        if j > self.drawn:
+            # Only points added since last frame drawn (all earlier points, on first frame)
+            first = max(0, self.drawn)
+            points = np.column_stack((self.xs[first:j+1], self.ys[first:j+1]))
+            cv2.polylines(self.canvas, [points], False, im.traceColor, thickness, cv2.LINE_AA)
+            self.drawn = j
+        roi = im.image[top:bottom, left:right]
+        np.copyto(roi, self.canvas)
+        cv2.circle(roi, (int(self.xs[j]), int(self.ys[j])), thickness + 2, im.peakColor, -1)
+
+# Read next frame from pipe into array.  Return False if end of stream reached
+def readFrame(pipe, frame):
+    view = memoryview(frame).cast('B')
+    pos = 0
+    while pos < len(view):
+        count = pipe.readinto(view[pos:])
+        if not count:
+            return False
+        pos += count
+    return True
+
+# Read frames from decoder, label them in memory, and write them to encoder.  Return number of frames
+def pipeFrames(decoder, encoder, labels, count, width, height, verbLevel = 1, scale = 1.0):
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    im = Image(None, verbLevel, frame, scale)
+    done = 0
+    for i in range(count):
+        with profiler.stage("decode"):
+            if not readFrame(decoder.stdout, frame):
+                break
+        with profiler.stage("render"):
+            labels.label(im, i)
+        with profiler.stage("encode"):
+            encoder.stdin.write(frame.data)
+        done += 1
+    return done
+
+# Start decoder for count frames of video, beginning at frame start
+def startDecoder(videoName, start, count, fps, logLevel):
+    input = ffmpeg.input(videoName, ss=float(start)/fps) if start > 0 else ffmpeg.input(videoName)
+    return (input.video
+            .output('pipe:', format='rawvideo', pix_fmt='bgr24', vframes=count)
+            .global_args('-loglevel', logLevel)
+            .run_async(pipe_stdout=True))
+
+# Finish pipes.  Return True if encoder succeeded
+def finishPipes(decoder, encoder):
+    decoder.stdout.close()
+    decoder.wait()
+    try:
+        encoder.stdin.close()
+    except BrokenPipeError:
+        pass
+    with profiler.stage("encode"):
+        encoder.wait()
+    return encoder.returncode == 0
+
+# Annotate segment of video as separate silent video file.  Run in worker process.
+# Returns number of frames written, or -1 if failed
+def annotateSegment(args):
+    videoName, segName, start, labels, width, height, fps, threads, logLevel = args
+    count = len(labels.altitudes)
+    decoder = startDecoder(videoName, start, count, fps, logLevel)
+    video = ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24', s='%dx%d' % (width, height), framerate=fps)
+    encoder = (video.output(segName, r=fps, format='mp4', pix_fmt='yuv420p', threads=threads)
+               .global_args('-loglevel', logLevel)
+               .overwrite_output()
+               .run_async(pipe_stdin=True))
+    done = 0
+    try:
+        done = pipeFrames(decoder, encoder, labels, count, width, height)
+    except BrokenPipeError:
+        pass
+    finally:
+        ok = finishPipes(decoder, encoder)
+    return done if ok else -1
+
 class Video:
 
     videoName = None
-    audioName = None
-    frameDir = "frames"
+    # Unique directory for intermediate files, created when needed
+    workDir = None
+    frameDir = None
+    # Either "stream" or "frames"
+    mode = "stream"
     # Parameters
     fps = 30
     frameCount = 0
+    width = 0
+    height = 0
+    # Codec, sample rate, and channel count of audio stream in video file
+    audioCodec = None
+    audioRate = 8000
+    audioChannels = 1
+    # Bar scales and telemetry values at each frame
+    labels = None
     videoLaunchTime = 0
     videoDuration = 0.0
     dataLaunchTime = 0
@@ -238,26 +525,55 @@ class Video:
     verbLevel = 1
     keep = False
     tmpNames = []
+    # Number of segments processed in parallel in stream mode
+    jobs = 1
+    # Frames processed: firstFrame up to (not including) lastFrame
+    firstFrame = 0
+    lastFrame = 0
+    # Optional widgets, from widgetNames
+    widgets = []
+    # Percentile of speeds during flight used as limit of velocity gauge
+    velocityPercentile = 99
+    # Size, relative to original, and frame rate of preview
+    previewScale = 0.25
+    previewRate = 10
 
-        
-    def __init__(self, vname, dname, verbLevel=1, keep = False):
+    # probe is result of ffmpeg.probe for video, when already known
+    def __init__(self, vname, dname, verbLevel=1, keep = False, mode = "stream", jobs = 1, probe = None):
         self.videoName = vname
         self.verbLevel = verbLevel
         self.keep = keep
+        self.mode = mode
+        self.jobs = jobs
         self.tmpNames = []
-        vroot = getRoot(vname)
-        self.frameDir = vroot + "-frames"
+        self.workDir = None
+        self.frameDir = None
         # Get info about video
-        vprobe = ffmpeg.probe(vname)['streams'][0]
-        self.fps = int(vprobe['r_frame_rate'].split('/')[0])
+        if probe is None:
+            with profiler.stage("probe"):
+                probe = ffmpeg.probe(vname)
+        streams = probe['streams']
+        vprobe = streams[0]
+        # Rate is a ratio, such as 30000/1001
+        self.fps = fractions.Fraction(vprobe['r_frame_rate'])
         self.frameCount = int(vprobe['nb_frames'])
+        self.width = int(vprobe['width'])
+        self.height = int(vprobe['height'])
+        astreams = [st for st in streams if st.get('codec_type') == 'audio']
+        if len(astreams) == 0:
+            print("Video file '%s' has no audio" % vname)
+            raise Exception("Program Failure")
+        self.audioCodec = astreams[0].get('codec_name')
+        self.audioRate = int(astreams[0]['sample_rate'])
+        self.audioChannels = int(astreams[0].get('channels', 1))
         self.videoDuration = float(self.frameCount)/self.fps
+        self.firstFrame = 0
+        self.lastFrame = self.frameCount
         # Get launch time for video
-        if not self.buildWav():
-            raise Exception("Program Failure")
-        sound = Sound(self.audioName, self.verbLevel, self.keep)
-        self.videoLaunchTime = sound.launchTime()
-        self.report(1, "Video file %s:  frames = %d, fps = %d, launch = %.2f, duration = %.2f" % (self.videoName, self.frameCount, self.fps, self.videoLaunchTime, self.videoDuration))
+        with profiler.stage("detect"):
+            sound = soundtrack.Sound(None, self.verbLevel, self.keep, vname, self.audioRate, self.audioChannels)
+            self.videoLaunchTime = sound.launchTime()
+        self.report(1, "Video file %s:  frames = %d, fps = %.3f, launch = %.2f, duration = %.2f" % (self.videoName, self.frameCount, float(self.fps), self.videoLaunchTime, self.videoDuration))
         droot = getRoot(dname)
         self.evaluator = analyze.Evaluator(droot)
         r = self.evaluator.findLaunch()
@@ -266,22 +582,64 @@ class Video:
         self.report(1, "Data file %s: Launch Time %.2f, duration = %.2f" % (dname, self.dataLaunchTime, self.dataDuration))
         
 
+    # Align video with data by correlating loudness of soundtrack with acceleration.
+    # Search is limited to offsets near that from launch detection, when available,
+    # and only audio that can overlap the data is read
+    def synchronize(self):
+        guess = None
+        sound = soundtrack.Sound(None, 0, self.keep, self.videoName, self.audioRate, self.audioChannels)
+        with profiler.stage("sync"):
+            dataStart, data = sync.dataSignal(self.evaluator)
+            if self.videoLaunchTime >= 0 and sync.Sync.searchWindow > 0:
+                guess = self.dataLaunchTime - self.videoLaunchTime
+                sound.startTime = max(0.0, dataStart - guess - sync.Sync.searchWindow)
+                sound.maxDuration = self.dataDuration - dataStart + 2 * sync.Sync.searchWindow
+            s = sync.Sync(sound.envelope(), sound.startTime, data, dataStart, sound.tdelta)
+            offset, confidence = s.find(guess)
+        if offset is None:
+            self.report(1, "Couldn't align audio with data")
+            return False
+        self.report(1, "Offset from correlation: %.3f (confidence %.2f)" % (offset, confidence))
+        if confidence < sync.Sync.minConfidence:
+            self.report(1, "Confidence too low.  Using launch detection")
+            return False
+        self.videoLaunchTime = self.dataLaunchTime - offset
+        self.report(2, "Video launch time now %.3f" % self.videoLaunchTime)
+        return True
+
+    # Limit processing to frames from pre seconds before launch until post seconds after landing
+    def setWindow(self, pre, post):
+        if self.videoLaunchTime < 0:
+            self.report(1, "No launch found in video.  Processing all frames")
+            return
+        rland = self.evaluator.findLand()
+        tland = self.dataDuration if rland < 0 else self.evaluator.getFloatField(rland, "time")
+        vstart = self.videoLaunchTime - pre
+        vend = self.videoLaunchTime + (tland - self.dataLaunchTime) + post
+        self.firstFrame = max(0, min(self.frameCount, int(np.floor(vstart * self.fps))))
+        self.lastFrame = max(self.firstFrame, min(self.frameCount, int(np.ceil(vend * self.fps))))
+        self.report(1, "Processing frames %d-%d (%.2f-%.2f seconds)" % (self.firstFrame, self.lastFrame-1,
+                                                                       float(self.firstFrame)/self.fps, float(self.lastFrame)/self.fps))
+
+    def windowCount(self):
+        return self.lastFrame - self.firstFrame
+
+    # Open original video, starting at first frame of window.
+    # Seeking on input jumps to preceding keyframe and decodes from there
+    def windowInput(self):
+        if self.firstFrame == 0 and self.lastFrame == self.frameCount:
+            return ffmpeg.input(self.videoName)
+        return ffmpeg.input(self.videoName, ss=float(self.firstFrame)/self.fps, t=float(self.windowCount())/self.fps)
+
     def quiet(self):
         return self.verbLevel <= 3
 
-    # Get soundtrack from video file and save as .WAV file
-    def buildWav(self):
-        self.audioName = getRoot(self.videoName) + ".WAV"
-        self.tmpNames.append(self.audioName)
-        if os.path.exists(self.audioName):
-            os.remove(self.audioName)
-        try:
-            ffmpeg.input(self.videoName).audio.output(self.audioName).run(quiet=self.quiet())
-            self.report(3, "Extracted audio file %s" % self.audioName)
-        except Exception as ex:
-            print("Couldn't get audio from video file '%s' (%s)" % (self.videoName, str(ex)))
-            return False
-        return True
+    # Intermediate files go in directory next to input video, with name unique to this run
+    def makeWorkDir(self):
+        if self.workDir is None:
+            self.workDir = tempfile.mkdtemp(prefix=os.path.basename(getRoot(self.videoName)) + "-",
+                                            dir=os.path.dirname(os.path.abspath(self.videoName)))
+        return self.workDir
 
     def imageName(self, index = None):
         if index is None:
@@ -291,46 +649,302 @@ class Video:
 
     def generateFrames(self):
         self.deleteFrames()
+        self.frameDir = os.path.join(self.makeWorkDir(), "frames")
         os.mkdir(self.frameDir)
         # Get frames
-        ffmpeg.input(self.videoName).output(self.imageName()).run(quiet=self.quiet())
-        self.report(2, "Stored %d images in %s" % (self.frameCount, self.frameDir))
+        self.windowInput().output(self.imageName(), vframes=self.windowCount()).run(quiet=self.quiet())
+        self.report(2, "Stored %d images in %s" % (self.windowCount(), self.frameDir))
 
-    def labelFrames(self):
-        rawAltitudes = self.evaluator.getAltitudes()
-        rawAccelerations = self.evaluator.getAccelerations()
-        maxAltitude = max(rawAltitudes)
-        limitAltitude = 100
-        while limitAltitude < maxAltitude:
-            limitAltitude += 100
-        deltaAltitude = limitAltitude / 10
-        maxAcceleration = max(rawAccelerations)
-        limitAcceleration = 10
-        while limitAcceleration < maxAcceleration:
-            limitAcceleration += 10
-        deltaAcceleration = limitAcceleration / 10
+    # Compute bar scales and telemetry values for each frame
+    def prepareLabels(self):
         # Video starting point WRT data
         tdelta = 1.0/self.fps
         tstart = self.dataLaunchTime - self.videoLaunchTime
-        timedAltitudes = self.evaluator.valueSequence(rawAltitudes, tstart, self.videoDuration, tdelta)
-        soFarAltitude = 0.0
-        timedAccelerations = self.evaluator.valueSequence(rawAccelerations, tstart, self.videoDuration, tdelta)
-        soFarAcceleration = 0.0
-        for i in range(self.frameCount):
+        grid = analyze.frameTimes(tstart + self.firstFrame * tdelta, self.windowCount(), tdelta)
+        timedAltitudes, timedAccelerations = self.evaluator.resampleColumns(["altitude", "acceleration"], grid)
+        self.labels = FrameLabels(timedAltitudes, timedAccelerations)
+        self.labels.setLimits(max(self.evaluator.getAltitudes()), max(self.evaluator.getAccelerations()))
+        self.addWidgets(self.labels, grid)
+
+    def labelFrames(self):
+        self.prepareLabels()
+        for i in range(self.windowCount()):
             name = self.imageName(i)
             im = Image(name, self.verbLevel)
-            altitude = timedAltitudes[i]
-            soFarAltitude = max(soFarAltitude, altitude)
-            im.showAltitude(altitude, limitAltitude, soFarAltitude, deltaAltitude)
-            acceleration = timedAccelerations[i]
-            soFarAcceleration = max(soFarAcceleration, acceleration)
-            im.showAcceleration(acceleration, limitAcceleration, soFarAcceleration, deltaAcceleration)
+            self.labels.label(im, i)
             im.write()
-            self.report(3, "Annotated image %s.  altitude = %.2f, acceleration = %.2f" % (name, altitude, acceleration))
-        self.report(1, "Annotated %d images" % self.frameCount)
+            self.report(3, "Annotated image %s.  altitude = %.2f, acceleration = %.2f" % (name, self.labels.altitudes[i], self.labels.accelerations[i]))
+        self.report(1, "Annotated %d images" % self.windowCount())
+
+    def setWidgets(self, names):
+        self.widgets = names
+
+    # Add data for optional widgets to labels.  grid has data time of each frame
+    def addWidgets(self, labels, grid):
+        rland = self.evaluator.findLand()
+        if "velocity" in self.widgets:
+            # Scale from speeds during flight, ignoring spikes
+            velocities = self.evaluator.getColumn("kalman-velocity")
+            rlaunch = self.evaluator.findLaunch()
+            flight = velocities[max(0, rlaunch):] if rland <= rlaunch else velocities[max(0, rlaunch):rland+1]
+            labels.setVelocities(self.evaluator.resampleColumns(["kalman-velocity"], grid)[0],
+                                 np.percentile(np.abs(flight), self.velocityPercentile))
+        tland = self.dataDuration if rland < 0 else self.evaluator.getFloatField(rland, "time")
+        if "trace" in self.widgets:
+            labels.trace = TraceWidget(np.asarray(grid), np.maximum(0.0, labels.altitudes), self.dataLaunchTime, tland, labels.limitAltitude)
+        if "events" in self.widgets:
+            h = self.evaluator.highlights()
+            labels.events = []
+            for event, text in eventLabels:
+                if event in h:
+                    index = int(np.searchsorted(grid, h[event]['time']))
+                    labels.events.append((index, "%s  %.1fs  %.0fm" % (text, h[event]['time'] - self.dataLaunchTime, h[event]['alt'] - self.evaluator.astart)))
+
+    # Labels for frames at video times, with peaks from all data up to each time
+    def labelsAt(self, times):
+        grid = np.asarray(times) + self.dataLaunchTime - self.videoLaunchTime
+        dtimes = self.evaluator.getColumn("time")
+        altitudes = self.evaluator.getColumn("altitude")
+        accelerations = self.evaluator.getColumn("acceleration")
+        columns = [altitudes, accelerations, np.maximum.accumulate(altitudes), np.maximum.accumulate(accelerations)]
+        alts, accs, peakAlts, peakAccs = analyze.resample(dtimes, columns, grid)
+        labels = FrameLabels(alts, accs, np.maximum(0.0, peakAlts), np.maximum(0.0, peakAccs))
+        labels.setLimits(max(self.evaluator.getAltitudes()), max(self.evaluator.getAccelerations()))
+        self.addWidgets(labels, grid)
+        return labels
+
+    # Width and height of preview frames.  Encoder requires even sizes
+    def previewSize(self):
+        return (max(2, int(self.width * self.previewScale) // 2 * 2),
+                max(2, int(self.height * self.previewScale) // 2 * 2))
+
+    # Write silent clip of window at preview size and frame rate
+    def previewVideo(self, outName):
+        width, height = self.previewSize()
+        count = int(self.windowCount() * self.previewRate / self.fps)
+        times = float(self.firstFrame) / self.fps + np.arange(count) / float(self.previewRate)
+        labels = self.labelsAt(times)
+        decoder = (self.windowInput().video
+                   .filter('fps', fps=self.previewRate)
+                   .filter('scale', width, height)
+                   .output('pipe:', format='rawvideo', pix_fmt='bgr24', vframes=count)
+                   .global_args('-loglevel', self.logLevel())
+                   .run_async(pipe_stdout=True))
+        video = ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24', s='%dx%d' % (width, height), framerate=self.previewRate)
+        encoder = (video.output(outName, format='mp4', pix_fmt='yuv420p', preset='ultrafast')
+                   .global_args('-loglevel', self.logLevel())
+                   .overwrite_output()
+                   .run_async(pipe_stdin=True))
+        done = 0
+        try:
+            done = pipeFrames(decoder, encoder, labels, count, width, height, self.verbLevel, float(height) / self.height)
+        except BrokenPipeError:
+            print("Video encoder for '%s' failed" % outName)
+        finally:
+            ok = finishPipes(decoder, encoder)
+        if not ok:
+            print("Couldn't generate preview file '%s'" % outName)
+            return False
+        self.report(1, "Generated %dx%d preview file %s with %d frames" % (width, height, outName, done))
+        return True
+
+    # Write image with grid of count frames at preview size, evenly spaced over window.
+    # Each frame is decoded separately, seeking to its time
+    def contactSheet(self, outName, count):
+        width, height = self.previewSize()
+        span = float(self.windowCount()) / self.fps
+        times = float(self.firstFrame) / self.fps + (np.arange(count) + 0.5) * span / count
+        labels = self.labelsAt(times)
+        cols = int(np.ceil(np.sqrt(count)))
+        rows = int(np.ceil(float(count) / cols))
+        sheet = np.zeros((rows * height, cols * width, 3), dtype=np.uint8)
+        for i, t in enumerate(times):
+            try:
+                with profiler.stage("decode"):
+                    data, err = (ffmpeg.input(self.videoName, ss=t).video
+                                 .filter('scale', width, height)
+                                 .output('pipe:', format='rawvideo', pix_fmt='bgr24', vframes=1)
+                                 .global_args('-loglevel', self.logLevel())
+                                 .run(capture_stdout=True))
+            except Exception as ex:
+                print("Couldn't decode frame at %.2f seconds (%s)" % (t, str(ex)))
+                continue
+            if len(data) < width * height * 3:
+                continue
+            r, c = divmod(i, cols)
+            frame = sheet[r*height:(r+1)*height, c*width:(c+1)*width]
+            frame[:] = np.frombuffer(data, dtype=np.uint8, count=width*height*3).reshape(height, width, 3)
+            with profiler.stage("render"):
+                labels.label(Image(None, self.verbLevel, frame, float(height) / self.height), i)
+                cv2.putText(frame, "%.2fs" % t, (4, 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255), 1, cv2.LINE_AA)
+        if not cv2.imwrite(outName, sheet):
+            print("Couldn't write contact sheet '%s'" % outName)
+            return False
+        self.report(1, "Generated contact sheet %s with %d frames" % (outName, count))
+        return True
+
+    def logLevel(self):
+        return "error" if self.quiet() else "info"
+
+    def audioArgs(self):
+        return { 'acodec' : 'copy' if self.audioCodec in mp4AudioCodecs else 'aac' }
+
+    # Decode frames through pipe, annotate them in memory, and pipe them to encoder.
+    # Audio stream is copied from original video, or converted when it can't be stored in MP4 file
+    def streamVideo(self, outName):
+        self.prepareLabels()
+        if self.jobs > 1 and self.windowCount() >= 2 * self.jobs:
+            return self.parallelVideo(outName)
+        decoder = startDecoder(self.videoName, self.firstFrame, self.windowCount(), self.fps, self.logLevel())
+        video = ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24', s='%dx%d' % (self.width, self.height), framerate=self.fps)
+        streams = [video]
+        args = {}
+        if self.audioCodec is not None:
+            streams.append(self.windowInput().audio)
+            args = self.audioArgs()
+        encoder = (ffmpeg.output(*streams, outName, r=self.fps, format='mp4', pix_fmt='yuv420p', **args)
+                   .global_args('-loglevel', self.logLevel())
+                   .overwrite_output()
+                   .run_async(pipe_stdin=True))
+        count = 0
+        try:
+            count = pipeFrames(decoder, encoder, self.labels, self.windowCount(), self.width, self.height, self.verbLevel)
+        except BrokenPipeError:
+            print("Video encoder for '%s' failed" % outName)
+        finally:
+            ok = finishPipes(decoder, encoder)
+        if not ok:
+            print("Couldn't generate video file '%s'" % outName)
+            return False
+        self.report(1, "Annotated %d frames" % count)
+        self.report(1, "Generated video file %s" % outName)
+        return True
+
+    # Commands changing box drawn by drawbox filter named target, at frames where its position changes.
+    # Returns (initial y, initial h, list of (frame, command))
+    def boxCommands(self, target, tops, bottoms, shown):
+        # Hidden box moved below frame.  (Height 0 would fill entire frame)
+        ys = np.where(shown, tops, self.height)
+        hs = np.where(shown, bottoms - tops + 1, 1)
+        changed = np.flatnonzero((ys[1:] != ys[:-1]) | (hs[1:] != hs[:-1])) + 1
+        commands = [(i, "%s y %d, %s h %d" % (target, ys[i], target, hs[i])) for i in changed]
+        return int(ys[0]), int(hs[0]), commands
+
+    # Annotate with single ffmpeg run.  Bars are drawbox filters, moved by commands from sendcmd filter,
+    # and tick marks and labels are overlay image.  No Python code runs for each frame
+    def filterVideo(self, outName):
+        if len(self.widgets) > 0:
+            self.report(1, "Widgets not available in filter mode")
+        self.prepareLabels()
+        labels = self.labels
+        count = self.windowCount()
+        workDir = self.makeWorkDir()
+        im = Image(None, self.verbLevel, np.zeros((self.height, self.width, 3), dtype=np.uint8))
+        overlayName = os.path.join(workDir, "gauges.png")
+        commandName = os.path.join(workDir, "commands.txt")
+        self.tmpNames += [overlayName, commandName]
+        with profiler.stage("render"):
+            if not cv2.imwrite(overlayName, im.gaugeOverlay(labels.limitAltitude, labels.deltaAltitude, labels.limitAcceleration, labels.deltaAcceleration)):
+                print("Couldn't write overlay image '%s'" % overlayName)
+                return False
+            gauges = [("altitude", labels.altitudes, labels.peakAltitudes, labels.limitAltitude, im.altitudeLeftPos, im.altitudeBottomPos),
+                      ("acceleration", labels.accelerations, labels.peakAccelerations, labels.limitAcceleration, im.accelerationLeftPos, im.accelerationBottomPos)]
+            boxes = []
+            commands = []
+            for name, values, peaks, limit, leftPos, bottomPos in gauges:
+                left, right, upper, lower = im.barBounds(leftPos, bottomPos)
+                values = np.clip(values, 0, limit)
+                peaks = np.clip(peaks, 0, limit)
+                vtops = im.barTops(values, limit, bottomPos)
+                ptops = im.barTops(peaks, limit, bottomPos)
+                boxes.append((None, left, right, upper, lower - upper + 1, (255,255,255)))
+                # Rectangle corners are inclusive
+                y, h, vcommands = self.boxCommands("drawbox@" + name + "Value", vtops, lower, values > 0)
+                boxes.append((name + "Value", left, right, y, h, im.upColor))
+                y, h, pcommands = self.boxCommands("drawbox@" + name + "Peak", ptops, vtops, peaks > values)
+                boxes.append((name + "Peak", left, right, y, h, im.peakColor))
+                commands += vcommands + pcommands
+            # Command at time i-1/2 frames applies from frame i onward
+            frames = {}
+            for i, cmd in commands:
+                frames.setdefault(i, []).append(cmd)
+            try:
+                with open(commandName, "w") as cfile:
+                    for i in sorted(frames.keys()):
+                        cfile.write("%.6f %s;\n" % ((i - 0.5) / self.fps, ", ".join(frames[i])))
+            except Exception as ex:
+                print("Couldn't write command file '%s' (%s)" % (commandName, str(ex)))
+                return False
+        self.report(2, "Wrote %d commands for %d frames" % (len(commands), count))
+        video = self.windowInput().video.filter('sendcmd', filename=commandName)
+        for name, left, right, y, h, color in boxes:
+            video = video.filter('drawbox' if name is None else 'drawbox@' + name, x=left, y=y, w=right - left + 1, h=h,
+                                 color='0x%02x%02x%02x' % (color[2], color[1], color[0]), t='fill')
+        video = ffmpeg.overlay(video, ffmpeg.input(overlayName).video)
+        streams = [video]
+        args = {}
+        if self.audioCodec is not None:
+            streams.append(self.windowInput().audio)
+            args = self.audioArgs()
+        try:
+            with profiler.stage("encode"):
+                (ffmpeg.output(*streams, outName, r=self.fps, format='mp4', pix_fmt='yuv420p', vframes=count, **args)
+                 .global_args('-loglevel', self.logLevel())
+                 .overwrite_output()
+                 .run())
+        except Exception as ex:
+            print("Couldn't generate video file '%s' (%s)" % (outName, str(ex)))
+            return False
+        self.report(1, "Annotated %d frames with filters" % count)
+        self.report(1, "Generated video file %s" % outName)
+        return True
+
+    # Split video into segments and annotate them in parallel.
+    # Join segments without re-encoding, adding audio from original video
+    def parallelVideo(self, outName):
+        segDir = self.makeWorkDir()
+        bounds = np.linspace(0, self.windowCount(), self.jobs+1).astype(int)
+        threads = max(1, os.cpu_count() // self.jobs)
+        jobList = []
+        for j in range(self.jobs):
+            segName = os.path.join(segDir, "segment-%03d.mp4" % j)
+            self.tmpNames.append(segName)
+            labels = self.labels.slice(bounds[j], bounds[j+1])
+            jobList.append((self.videoName, segName, self.firstFrame + int(bounds[j]), labels, self.width, self.height, self.fps, threads, self.logLevel()))
+        self.report(2, "Annotating %d segments in parallel" % self.jobs)
+        with profiler.stage("render"):
+            with multiprocessing.Pool(self.jobs) as pool:
+                counts = pool.map(annotateSegment, jobList)
+        ok = min(counts) >= 0
+        if ok:
+            listName = os.path.join(segDir, "segments.txt")
+            self.tmpNames.append(listName)
+            with open(listName, "w") as listFile:
+                for job in jobList:
+                    listFile.write("file '%s'\n" % os.path.basename(job[1]))
+            streams = [ffmpeg.input(listName, format='concat', safe=0).video]
+            args = {}
+            if self.audioCodec is not None:
+                streams.append(self.windowInput().audio)
+                args = self.audioArgs()
+            try:
+                with profiler.stage("encode"):
+                    (ffmpeg.output(*streams, outName, vcodec='copy', format='mp4', **args)
+                     .global_args('-loglevel', self.logLevel())
+                     .overwrite_output()
+                     .run())
+            except Exception as ex:
+                print("Couldn't join segments into video file '%s' (%s)" % (outName, str(ex)))
+                ok = False
+        else:
+            print("Couldn't annotate all segments of video file '%s'" % self.videoName)
+        if ok:
+            self.report(1, "Annotated %d frames in %d segments" % (sum(counts), self.jobs))
+            self.report(1, "Generated video file %s" % outName)
+        return ok
 
     def deleteFrames(self):
-        if os.path.exists(self.frameDir):
+        if self.frameDir is not None and os.path.exists(self.frameDir):
             flist = glob.glob(self.frameDir + "/*.png")
             for fname in flist:
                 os.remove(fname)
@@ -343,15 +957,13 @@ class Video:
                 
     def generateVideo(self, outName):
         # Merge images into silent video
-        tname = getRoot(self.videoName) + "-tmp.mp4"
-        if os.path.exists(tname):
-            os.remove(tname)
+        tname = os.path.join(self.makeWorkDir(), "silent.mp4")
         self.tmpNames.append(tname)
         self.report(2, "Merging images into video file %s" % tname)
         ffmpeg.input(self.imageName(), framerate=self.fps).output(tname, r=self.fps, format='mp4', pix_fmt='yuv420p').run(quiet=self.quiet())
-        self.report(2, "Merging sound file %s with video file %s to create file %s" % (self.audioName, tname, outName))
+        self.report(2, "Merging sound from %s with video file %s to create file %s" % (self.videoName, tname, outName))
         video = ffmpeg.input(tname).video
-        audio = ffmpeg.input(self.audioName).audio
+        audio = self.windowInput().audio
         if os.path.exists(outName):
             os.remove(outName)
         ffmpeg.output(video, audio, outName).run(quiet=self.quiet())
@@ -359,6 +971,8 @@ class Video:
 
     def clean(self):
         if self.keep:
+            if self.workDir is not None:
+                self.report(2, "Kept intermediate files in %s" % self.workDir)
             return
         self.deleteFrames()
         for name in self.tmpNames:
@@ -367,18 +981,234 @@ class Video:
                 self.report(3, "Deleted file %s" % name)
             except Exception as ex:
                 self.report(3, "Couldn't delete file %s (%s)" % (name, str(ex)))
+        if self.workDir is not None:
+            try:
+                os.rmdir(self.workDir)
+            except Exception as ex:
+                self.report(2, "Couldn't delete directory %s (%s)" % (self.workDir, str(ex)))
 
     def report(self, level, msg):
         if self.verbLevel >= level:
             print(msg)
     
+    # Return True if successful
     def run(self, outName):
-        self.generateFrames()
-        self.labelFrames()
-        self.generateVideo(outName)
+        if self.mode in ["stream", "filter"]:
+            ok = self.streamVideo(outName) if self.mode == "stream" else self.filterVideo(outName)
+            self.clean()
+            return ok
+        with profiler.stage("decode"):
+            self.generateFrames()
+        with profiler.stage("render"):
+            self.labelFrames()
+        with profiler.stage("encode"):
+            self.generateVideo(outName)
         self.clean()
+        return True
+
+# Annotate many videos, such as all of those from launch day.
+# Videos are listed in manifest file, with lines of form VIDEO DATA [OUTPUT],
+# or found in directory, paired with logs having same root name.
+# State file records inputs of each finished output, so that interrupted batch can be resumed,
+# and outputs are only regenerated when their inputs or settings change.
+
+videoExtensions = [".avi", ".mp4", ".mov", ".mts"]
+stateFileName = "annotate-state.json"
+# Frames of memory (decoder, encoder lookahead, pipes) assumed per job when limiting concurrency
+jobFrames = 100
 
+def outputName(vname, outDir = None):
+    name = getRoot(vname) + "-new.mp4"
+    return name if outDir is None else os.path.join(outDir, os.path.basename(name))
 
+# Size and modification time of file
+def fileSignature(fname):
+    st = os.stat(fname)
+    return [st.st_size, st.st_mtime_ns]
+
+# Annotate one video of batch.  Run in worker process.  Returns (output name, success)
+def annotateEntry(args):
+    vname, dname, outName, probe, settings = args
+    try:
+        v = Video(vname, dname, settings["verbLevel"], settings["keep"], settings["mode"], settings["jobs"], probe)
+        v.setWidgets(settings["widgets"])
+        if settings["sync"]:
+            v.synchronize()
+        if settings["window"] is not None:
+            v.setWindow(settings["window"][0], settings["window"][1])
+        ok = v.run(outName)
+    except Exception as ex:
+        print("Couldn't annotate video file '%s' (%s)" % (vname, str(ex)))
+        ok = False
+    return outName, ok
+
+class Batch:
+    # List of (video name, data name, output name)
+    entries = []
+    # Video name --> probe results
+    probes = {}
+    # Output name --> inputs and settings used to generate it
+    state = {}
+    stateName = None
+    verbLevel = 1
+    # Number of videos annotated at once.  0 = choose from CPU count and memory
+    jobs = 0
+    # Options affecting output
+    settings = {}
+
+    def __init__(self, source, outDir = None, verbLevel = 1, keep = False, mode = "stream", jobs = 0, window = None, synchronize = False, widgets = []):
+        self.verbLevel = verbLevel
+        self.jobs = jobs
+        # Window stored as list, to compare with state read back from JSON
+        self.settings = { "mode" : mode, "window" : None if window is None else list(window), "sync" : synchronize, "widgets" : widgets, "keep" : keep, "verbLevel" : verbLevel, "jobs" : 1 }
+        if outDir is not None:
+            os.makedirs(outDir, exist_ok = True)
+        if os.path.isdir(source):
+            self.entries = self.scanDirectory(source, outDir)
+            baseDir = source
+        else:
+            self.entries = self.readManifest(source, outDir)
+            baseDir = os.path.dirname(os.path.abspath(source))
+        self.stateName = os.path.join(outDir if outDir is not None else baseDir, stateFileName)
+        self.probes = {}
+        self.state = self.loadState()
+
+    def readManifest(self, mname, outDir):
+        entries = []
+        mdir = os.path.dirname(os.path.abspath(mname))
+        try:
+            with open(mname, "r") as mfile:
+                lines = mfile.readlines()
+        except Exception as ex:
+            print("Couldn't read manifest file '%s' (%s)" % (mname, str(ex)))
+            return entries
+        for lnum, line in enumerate(lines):
+            fields = shlex.split(line, comments=True)
+            if len(fields) == 0:
+                continue
+            if len(fields) not in [2, 3]:
+                print("Manifest file '%s', line %d: Expected VIDEO DATA [OUTPUT]" % (mname, lnum+1))
+                continue
+            names = [os.path.join(mdir, f) for f in fields]
+            outName = names[2] if len(names) > 2 else outputName(names[0], outDir)
+            entries.append((names[0], names[1], outName))
+        return entries
+
+    def scanDirectory(self, dname, outDir):
+        entries = []
+        for fname in sorted(os.listdir(dname)):
+            root = getRoot(fname)
+            if ("." + getExtension(fname)).lower() not in videoExtensions or root.endswith("-new"):
+                continue
+            vname = os.path.join(dname, fname)
+            csvName = os.path.join(dname, root + ".csv")
+            if not os.path.exists(csvName):
+                self.report(1, "No data file for video file %s" % vname)
+                continue
+            entries.append((vname, csvName, outputName(vname, outDir)))
+        return entries
+
+    def loadState(self):
+        try:
+            with open(self.stateName, "r") as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return {}
+        except Exception as ex:
+            print("Couldn't read state file '%s' (%s)" % (self.stateName, str(ex)))
+            return {}
+
+    # Write state to temporary file and rename, so that interruption never leaves partial file
+    def saveState(self):
+        tname = self.stateName + ".tmp"
+        try:
+            with open(tname, "w") as outfile:
+                json.dump(self.state, outfile, indent=1)
+            os.replace(tname, self.stateName)
+        except Exception as ex:
+            print("Couldn't write state file '%s' (%s)" % (self.stateName, str(ex)))
+
+    # Inputs and settings that determine output
+    def signature(self, vname, dname):
+        settings = { k : v for k, v in self.settings.items() if k in ["mode", "window", "sync", "widgets"] }
+        return { "video" : fileSignature(vname), "data" : analyze.contentHash(dname), "settings" : settings }
+
+    def upToDate(self, vname, dname, outName):
+        entry = self.state.get(os.path.abspath(outName))
+        if entry is None or not os.path.exists(outName):
+            return False
+        return entry["inputs"] == self.signature(vname, dname) and entry["output"] == fileSignature(outName)
+
+    # Probe all videos up front, so that bad inputs are found before any work is done
+    def probeAll(self, entries):
+        good = []
+        for vname, dname, outName in entries:
+            try:
+                with profiler.stage("probe"):
+                    self.probes[vname] = ffmpeg.probe(vname)
+            except Exception as ex:
+                print("Couldn't probe video file '%s' (%s)" % (vname, str(ex)))
+                continue
+            if not os.path.exists(dname):
+                print("Error: File '%s' does not exist" % dname)
+                continue
+            good.append((vname, dname, outName))
+        return good
+
+    # Number of videos to annotate at once, limited by CPU count and available memory
+    def jobLimit(self, entries):
+        limit = os.cpu_count() or 1
+        try:
+            memory = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            memory = None
+        if memory is not None:
+            frameBytes = max(int(self.probes[v]['streams'][0]['width']) * int(self.probes[v]['streams'][0]['height']) * 3 for v, d, o in entries)
+            limit = min(limit, max(1, memory // (jobFrames * frameBytes)))
+        return limit
+
+    def run(self):
+        entries = self.probeAll(self.entries)
+        todo = []
+        for vname, dname, outName in entries:
+            if self.upToDate(vname, dname, outName):
+                self.report(1, "Skipping %s (up to date)" % outName)
+            else:
+                todo.append((vname, dname, outName))
+        if len(todo) == 0:
+            self.report(1, "All %d videos up to date" % len(entries))
+            return True
+        jobs = min(self.jobs if self.jobs > 0 else self.jobLimit(todo), len(todo))
+        self.report(1, "Annotating %d videos, %d at a time" % (len(todo), jobs))
+        inputs = { outName : (vname, dname) for vname, dname, outName in todo }
+        failures = 0
+        if jobs == 1:
+            # Can split each video into segments instead
+            settings = dict(self.settings, jobs = os.cpu_count())
+            results = (annotateEntry((v, d, o, self.probes[v], settings)) for v, d, o in todo)
+            failures = self.record(results, inputs)
+        else:
+            args = [(v, d, o, self.probes[v], self.settings) for v, d, o in todo]
+            with multiprocessing.Pool(jobs) as pool:
+                failures = self.record(pool.imap_unordered(annotateEntry, args), inputs)
+        self.report(1, "Annotated %d videos.  %d failed" % (len(todo) - failures, failures))
+        return failures == 0
+
+    # Save state as each video finishes.  Return number of failures
+    def record(self, results, inputs):
+        failures = 0
+        for outName, ok in results:
+            if not ok:
+                failures += 1
+                continue
+            vname, dname = inputs[outName]
+            self.state[os.path.abspath(outName)] = { "inputs" : self.signature(vname, dname), "output" : fileSignature(outName) }
+            self.saveState()
+        return failures
+
+    def report(self, level, msg):
+        if self.verbLevel >= level:
+            print(msg)
 
 def run(name, args):
     verbLevel = 1
@@ -386,25 +1216,73 @@ def run(name, args):
     inDataName = None
     outVideoName = None
     keep = False
-    optList, args = getopt.getopt(args, "hkv:i:d:o:")
+    mode = "stream"
+    jobs = None
+    window = None
+    batchName = None
+    synchronize = False
+    widgets = []
+    preview = False
+    sheetCount = 0
+    optList, args = getopt.getopt(args, "hkyv:m:j:w:x:b:i:d:o:", profiler.longOptions + ["preview", "sheet="])
     for (opt, val) in optList:
         if opt == '-h':
             usage(name)
             return
         if opt == '-k':
             keep = True
+        elif opt == '-y':
+            synchronize = True
         elif opt == '-v':
             verbLevel = int(val)
+        elif opt == '-m':
+            if val not in ["stream", "frames", "filter"]:
+                print("Unknown mode '%s'" % val)
+                usage(name)
+                return
+            mode = val
+        elif opt == '-j':
+            jobs = int(val)
+        elif opt == '-w':
+            fields = val.split(":")
+            if len(fields) != 2:
+                print("Invalid window '%s'" % val)
+                usage(name)
+                return
+            window = (float(fields[0]), float(fields[1]))
+        elif opt == '-x':
+            widgets = [w for w in val.split(",") if w != ""]
+            for w in widgets:
+                if w not in widgetNames:
+                    print("Unknown widget '%s'" % w)
+                    usage(name)
+                    return
+        elif opt == '--preview':
+            preview = True
+        elif opt == '--sheet':
+            sheetCount = int(val)
+        elif opt == '-b':
+            batchName = val
         elif opt == '-i':
             inVideoName = val
         elif opt == '-d':
             inDataName = val
         elif opt == '-o':
             outVideoName = val
+        elif opt in profiler.optionNames:
+            profiler.setOption(opt, val)
         else:
             print("Uknown option '%s'" % opt)
             usage(name)
             return
+    if batchName is not None:
+        if not os.path.exists(batchName):
+            print("Error: File '%s' does not exist" % batchName)
+            return
+        profiler.begin()
+        b = Batch(batchName, outVideoName, verbLevel, keep, mode, 0 if jobs is None else jobs, window, synchronize, widgets)
+        b.run()
+        return
     if inVideoName is None:
         print("Require input video file")
         usage(name)
@@ -420,9 +1298,21 @@ def run(name, args):
         print("Error: File '%s' does not exist" % inDataName)
         return
     if outVideoName is None:
-        outVideoName = getRoot(inVideoName) + "-new.mp4"
-    v = Video(inVideoName, inDataName, verbLevel, keep)
-    v.run(outVideoName)
+        suffix = "-sheet.png" if sheetCount > 0 else "-preview.mp4" if preview else "-new.mp4"
+        outVideoName = getRoot(inVideoName) + suffix
+    profiler.begin()
+    v = Video(inVideoName, inDataName, verbLevel, keep, mode, os.cpu_count() if jobs is None else jobs)
+    v.setWidgets(widgets)
+    if synchronize:
+        v.synchronize()
+    if window is not None:
+        v.setWindow(window[0], window[1])
+    if sheetCount > 0:
+        v.contactSheet(outVideoName, sheetCount)
+    elif preview:
+        v.previewVideo(outVideoName)
+    else:
+        v.run(outVideoName)
 
 if __name__ == "__main__":
     run(sys.argv[0], sys.argv[1:])
@@ -0,0 +1,237 @@
+#!/usr/local/bin/python3
+
+# Benchmark analysis and report pipeline.
+# Times the main processing steps on real logs and on synthetic logs
+# generated by resampling a real flight at higher rates.
+# Results are appended to a JSON history file and compared with the previous run.
+
+import sys
+import os
+import io
+import glob
+import json
+import time
+import getopt
+import contextlib
+import datetime
+import tempfile
+import subprocess
+import numpy as np
+
+import analyze
+import report_generator
+
+def usage(name):
+    print("Usage: %s [-h] [-n] [-r REPEAT] [-s SCALES] [-a SECS] [-H HISTORY] [-t THRESH] [F1.csv F2.csv ...]" % name)
+    print(" -h         Print this message")
+    print(" -n         Don't record results in history")
+    print(" -r REPEAT  Number of times to run each step (best time reported) (default = %d)" % defaultRepeat)
+    print(" -s SCALES  Comma-separated scale factors for synthetic logs (default = %s)" % defaultScales)
+    print(" -a SECS    Comma-separated durations of synthetic audio (default = %s)" % defaultAudio)
+    print(" -H HISTORY History file (default = %s)" % defaultHistory)
+    print(" -t THRESH  Report regression when time grows by more than fraction THRESH (default = %.2f)" % defaultThreshold)
+    print(" Default logs are logs/*.csv")
+
+defaultRepeat = 3
+defaultScales = "10,100,1000"
+defaultAudio = "60,600"
+defaultHistory = "benchmark-history.json"
+defaultThreshold = 0.25
+# Frame rate for valueSequence benchmark
+frameRate = 240
+# Sample rate for audio benchmark
+audioRate = 48000
+# Changes smaller than this (seconds) are not reported as regressions
+minDelta = 0.002
+# Seconds kept before launch and after landing in base flight for synthetic logs
+padTime = 5.0
+
+# Run function repeatedly.  Return best time in seconds
+def timeit(fun, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fun()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def rootName(name):
+    fields = name.split(".")
+    if len(fields) > 1 and fields[-1] == 'csv':
+        fields = fields[:-1]
+    return ".".join(fields)
+
+# Write log with scale times as many samples as flight portion of base log.
+def syntheticLog(base, scale, root):
+    e = analyze.Evaluator(base)
+    rlaunch = e.findLaunch()
+    rland = e.findLand()
+    times = e.getColumn("time")
+    keep = (times >= times[rlaunch] - padTime) & (times <= times[rland] + padTime)
+    times = times[keep]
+    fields = list(e.entries[0].keys())
+    count = len(times) * scale
+    ntimes = np.linspace(times[0], times[-1], count)
+    rng = np.random.default_rng(scale)
+    columns = []
+    for f in fields:
+        if f == "time":
+            columns.append(ntimes)
+        elif f == "sid":
+            columns.append(np.arange(count))
+        else:
+            v = np.interp(ntimes, times, e.getColumn(f)[keep])
+            columns.append(v + rng.normal(0.0, 0.01, count))
+    formats = ["%d" if f in ["sid", "RSSI"] else "%.3f" if f == "time" else "%.2f" for f in fields]
+    data = np.column_stack(columns)
+    with open(root + ".csv", "w") as outfile:
+        outfile.write(",".join(fields) + "\n")
+        np.savetxt(outfile, data, fmt=formats, delimiter=",")
+    return root
+
+class Benchmark:
+    repeat = defaultRepeat
+    results = {}
+
+    def __init__(self, repeat = defaultRepeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def record(self, name, fun):
+        try:
+            t = timeit(fun, self.repeat)
+        except Exception as ex:
+            print("%-50s FAILED (%s)" % (name, str(ex)))
+            return
+        self.results[name] = t
+        print("%-50s %10.4f s" % (name, t))
+
+    def runLog(self, root, label):
+        self.record("Evaluator.__init__:" + label, lambda : analyze.Evaluator(root))
+        e = analyze.Evaluator(root)
+        # Fresh evaluator each time, so that cached columns don't hide costs
+        self.record("highlights:" + label, lambda : analyze.Evaluator(root).highlights())
+        self.record("plotData:" + label, lambda : e.plotData(io.StringIO()))
+        duration = e.getFinalTime() - e.getFloatField(0, "time")
+        values = e.getAltitudes()
+        self.record("valueSequence:" + label, lambda : e.valueSequence(values, e.getFloatField(0, "time"), duration, 1.0/frameRate))
+
+    def runReport(self, roots, label):
+        def generate():
+            report_generator.flights = []
+            report_generator.colorNames = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                report_generator.generate("Benchmark", roots, io.StringIO())
+        self.record("report_generator.generate:" + label, generate)
+
+    def runAudio(self, seconds):
+        try:
+            import soundtrack
+        except Exception as ex:
+            print("Skipping audio benchmarks (%s)" % str(ex))
+            return
+        rng = np.random.default_rng(0)
+        for secs in seconds:
+            val = rng.integers(-30000, 30000, size=(int(secs * audioRate), 2), dtype=np.int16)
+            sound = soundtrack.Sound(None, verbLevel = 0)
+            sound.rate = audioRate
+            self.record("Sound.rmsValues:%gs" % secs, lambda : sound.rmsValues(val))
+
+def loadHistory(name):
+    try:
+        with open(name, "r") as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return []
+    except Exception as ex:
+        print("Couldn't read history file '%s' (%s)" % (name, str(ex)))
+        return []
+
+def saveHistory(name, history):
+    try:
+        with open(name, "w") as outfile:
+            json.dump(history, outfile, indent=1)
+    except Exception as ex:
+        print("Couldn't write history file '%s' (%s)" % (name, str(ex)))
+
+def gitRevision():
+    try:
+        p = subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL,
+                           cwd = os.path.dirname(os.path.abspath(__file__)))
+        return p.stdout.decode().strip()
+    except Exception:
+        return ""
+
+# Compare results with previous run.  Return number of regressions
+def compare(results, previous, threshold):
+    regressions = 0
+    print("Comparison with run of %s (%s)" % (previous["date"], previous["revision"]))
+    for name in sorted(results.keys()):
+        if name not in previous["results"]:
+            continue
+        old = previous["results"][name]
+        new = results[name]
+        ratio = new / old if old > 0 else 1.0
+        status = ""
+        if ratio > 1.0 + threshold and new - old > minDelta:
+            status = "REGRESSION"
+            regressions += 1
+        elif ratio < 1.0 - threshold and old - new > minDelta:
+            status = "improved"
+        print("%-50s %10.4f -> %10.4f s  x%.2f  %s" % (name, old, new, ratio, status))
+    return regressions
+
+def run(name, args):
+    repeat = defaultRepeat
+    scales = defaultScales
+    audio = defaultAudio
+    historyName = defaultHistory
+    threshold = defaultThreshold
+    record = True
+    optList, args = getopt.getopt(args, "hnr:s:a:H:t:")
+    for (opt, val) in optList:
+        if opt == '-h':
+            usage(name)
+            return 0
+        elif opt == '-n':
+            record = False
+        elif opt == '-r':
+            repeat = int(val)
+        elif opt == '-s':
+            scales = val
+        elif opt == '-a':
+            audio = val
+        elif opt == '-H':
+            historyName = val
+        elif opt == '-t':
+            threshold = float(val)
+    if len(args) == 0:
+        args = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "*.csv")))
+    roots = [rootName(a) for a in args]
+    if len(roots) == 0:
+        print("No logs found")
+        return 0
+    b = Benchmark(repeat)
+    for root in roots:
+        b.runLog(root, os.path.basename(root))
+    b.runReport(roots, "%d-logs" % len(roots))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for scale in [int(s) for s in scales.split(",") if s != ""]:
+            sroot = syntheticLog(roots[0], scale, os.path.join(tmpdir, "synthetic-%dx" % scale))
+            b.runLog(sroot, "%dx" % scale)
+            b.runReport([sroot], "%dx" % scale)
+    b.runAudio([float(s) for s in audio.split(",") if s != ""])
+    history = loadHistory(historyName)
+    regressions = 0
+    if len(history) > 0:
+        regressions = compare(b.results, history[-1], threshold)
+    if record:
+        history.append({ "date" : datetime.datetime.now().isoformat(timespec='seconds'),
+                         "revision" : gitRevision(), "repeat" : repeat, "results" : b.results })
+        saveHistory(historyName, history)
+    return regressions
+
+if __name__ == "__main__":
+    regressions = run(sys.argv[0], sys.argv[1:])
+    sys.exit(1 if regressions > 0 else 0)
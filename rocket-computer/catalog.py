@@ -0,0 +1,227 @@
+#!/usr/local/bin/python3
+
+# Maintain catalog of flight logs with cached highlights.
+# Stored as SQLite database.  Flights keyed by hash of log contents,
+# so refreshing the catalog only processes new or changed files,
+# along with flights analyzed by an earlier version of the analysis.
+
+import sys
+import os
+import re
+import glob
+import json
+import getopt
+import sqlite3
+
+import analyze
+
+def usage(name):
+    print("Usage: %s [-h] [-n] [-d DB] [-k ROCKET] [-m MOTOR] [-t DATE] [-s KEY] [DIR|FILE.csv ...]" % name)
+    print(" -h       Print this message")
+    print(" -n       Don't refresh catalog from files")
+    print(" -d DB    Catalog database (default is %s in first directory)" % defaultName)
+    print(" -k ROCKET Select flights with rocket name")
+    print(" -m MOTOR Select flights with motor")
+    print(" -t DATE  Select flights with date prefix (e.g., 2024-08)")
+    print(" -s KEY   Sort by KEY: %s" % ", ".join(sortKeys))
+
+defaultName = "catalog.db"
+
+# Keys that can be used for sorting.  Numeric ones are sorted from largest to smallest
+sortKeys = ["date", "rocket", "motor", "apogee", "vmax", "duration", "rows"]
+numericKeys = ["apogee", "vmax", "duration", "rows"]
+
+# Flight names have form DATE-ROCKET-MOTOR[-NOTE], e.g., 2024-02-25-Ukraine-B6+A8
+namePattern = re.compile(r"^(\d{4}-\d{2}-\d{2})-(.+?)-([A-Ga-g]\d+(?:\+[A-Ga-g]\d+)*)(?:-(.*))?$")
+datePattern = re.compile(r"^(\d{4}-\d{2}-\d{2})(?:-(.*))?$")
+
+# Extract (date, rocket, motor, note) from name of log file.  Missing parts are None
+def parseFlightName(name):
+    root = os.path.basename(name)
+    fields = root.split(".")
+    if len(fields) > 1 and fields[-1] == 'csv':
+        root = ".".join(fields[:-1])
+    m = namePattern.match(root)
+    if m is not None:
+        return (m.group(1), m.group(2), m.group(3).upper(), m.group(4))
+    m = datePattern.match(root)
+    if m is not None:
+        return (m.group(1), m.group(2), None, None)
+    return (None, root, None, None)
+
+class Catalog:
+    dbName = None
+    db = None
+    verbLevel = 1
+
+    def __init__(self, dbName, verbLevel = 1):
+        self.dbName = dbName
+        self.verbLevel = verbLevel
+        self.db = sqlite3.connect(dbName)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, hash TEXT, size INTEGER, mtime REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS flights (hash TEXT PRIMARY KEY, root TEXT, date TEXT, rocket TEXT COLLATE NOCASE, "
+                        + "motor TEXT COLLATE NOCASE, note TEXT, rows INTEGER, apogee REAL, vmax REAL, duration REAL, highlights TEXT, version INTEGER)")
+        # Catalogs created before analysis versions were recorded
+        if "version" not in [row['name'] for row in self.db.execute("PRAGMA table_info(flights)")]:
+            self.db.execute("ALTER TABLE flights ADD COLUMN version INTEGER")
+        self.db.execute("CREATE INDEX IF NOT EXISTS flightMotor ON flights (motor)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS flightRocket ON flights (rocket)")
+        self.db.commit()
+
+    def report(self, level, msg):
+        if self.verbLevel >= level:
+            print(msg)
+
+    def close(self):
+        self.db.close()
+
+    # Find all logs in list of directories and files
+    def findLogs(self, paths):
+        result = []
+        for path in paths:
+            if os.path.isdir(path):
+                result += sorted(glob.glob(os.path.join(path, "*.csv")))
+            else:
+                result.append(path)
+        return [os.path.abspath(p) for p in result]
+
+    # Analyze log and add entry to flights table
+    def addFlight(self, path, hash):
+        root = path[:-4] if path.endswith(".csv") else path
+        date, rocket, motor, note = parseFlightName(root)
+        e = analyze.Evaluator(root)
+        if e.root is None:
+            return False
+        apogee = vmax = duration = None
+        h = None
+        try:
+            h = e.highlights()
+            apogee = h['apogee']['alt'] - e.astart
+            vmax = h['v-max']['velocity']
+            duration = h['land']['time'] - e.tstart
+        except Exception as ex:
+            self.report(1, "Couldn't find highlights for flight %s (%s)" % (root, str(ex)))
+        self.db.execute("INSERT OR REPLACE INTO flights VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (hash, os.path.basename(root), date, rocket, motor, note, e.count(),
+                         apogee, vmax, duration, None if h is None else json.dumps(h), analyze.analysisVersion))
+        self.report(2, "Processed flight %s" % root)
+        return True
+
+    # Bring catalog up to date with log files.  Return number of flights analyzed
+    def refresh(self, paths):
+        count = 0
+        logs = self.findLogs(paths)
+        known = {row['path'] : row for row in self.db.execute("SELECT * FROM files")}
+        for path in logs:
+            try:
+                stat = os.stat(path)
+            except Exception as ex:
+                self.report(1, "Couldn't access file '%s' (%s)" % (path, str(ex)))
+                continue
+            row = known.get(path)
+            # Only rehash when file has been modified
+            if row is not None and row['size'] == stat.st_size and row['mtime'] == stat.st_mtime:
+                hash = row['hash']
+            else:
+                hash = analyze.contentHash(path)
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, hash, stat.st_size, stat.st_mtime))
+            # Reanalyze when highlights come from different version of analysis
+            if self.db.execute("SELECT hash FROM flights WHERE hash = ? AND version = ?", (hash, analyze.analysisVersion)).fetchone() is None:
+                if self.addFlight(path, hash):
+                    count += 1
+        # Drop files that have disappeared within the scanned directories, and flights with no files
+        dirs = set([os.path.abspath(p) for p in paths if os.path.isdir(p)])
+        for path in known:
+            if os.path.dirname(path) in dirs and not os.path.exists(path):
+                self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.db.execute("DELETE FROM flights WHERE hash NOT IN (SELECT hash FROM files)")
+        self.db.commit()
+        self.report(1, "Analyzed %d new, changed, or outdated flights" % count)
+        return count
+
+    # Find flights matching constraints.  Return list of dictionaries
+    def query(self, rocket = None, motor = None, date = None, sortKey = "date"):
+        conditions = []
+        params = []
+        if rocket is not None:
+            conditions.append("flights.rocket = ?")
+            params.append(rocket)
+        if motor is not None:
+            conditions.append("flights.motor = ?")
+            params.append(motor)
+        if date is not None:
+            conditions.append("flights.date LIKE ?")
+            params.append(date + "%")
+        if sortKey not in sortKeys:
+            sortKey = "date"
+        order = "flights.%s %s" % (sortKey, "DESC" if sortKey in numericKeys else "ASC")
+        sql = "SELECT flights.*, MIN(files.path) AS path FROM flights JOIN files ON flights.hash = files.hash"
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " GROUP BY flights.hash ORDER BY %s, flights.root" % order
+        result = []
+        for row in self.db.execute(sql, params):
+            entry = dict(row)
+            entry['highlights'] = None if row['highlights'] is None else json.loads(row['highlights'])
+            result.append(entry)
+        return result
+
+    # Get cached highlights for log file.  Return None if not in catalog
+    def getHighlights(self, path):
+        row = self.db.execute("SELECT flights.highlights FROM flights JOIN files ON flights.hash = files.hash WHERE files.path = ?",
+                              (os.path.abspath(path),)).fetchone()
+        if row is None or row['highlights'] is None:
+            return None
+        return json.loads(row['highlights'])
+
+def showFlights(entries):
+    print("\t".join(["flight", "date", "rocket", "motor", "rows", "apogee", "vmax", "duration"]))
+    for entry in entries:
+        fields = [entry['root'], str(entry['date']), str(entry['rocket']), str(entry['motor']), "%d" % entry['rows']]
+        for key in ["apogee", "vmax", "duration"]:
+            fields.append("---" if entry[key] is None else "%.2f" % entry[key])
+        print("\t".join(fields))
+
+def run(name, args):
+    dbName = None
+    refresh = True
+    rocket = None
+    motor = None
+    date = None
+    sortKey = "date"
+    optList, args = getopt.getopt(args, "hnd:k:m:t:s:")
+    for (opt, val) in optList:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-n':
+            refresh = False
+        elif opt == '-d':
+            dbName = val
+        elif opt == '-k':
+            rocket = val
+        elif opt == '-m':
+            motor = val.upper()
+        elif opt == '-t':
+            date = val
+        elif opt == '-s':
+            if val not in sortKeys:
+                print("Unknown sort key '%s'" % val)
+                usage(name)
+                return
+            sortKey = val
+    if dbName is None:
+        if len(args) > 0 and os.path.isdir(args[0]):
+            dbName = os.path.join(args[0], defaultName)
+        else:
+            dbName = defaultName
+    cat = Catalog(dbName)
+    if refresh and len(args) > 0:
+        cat.refresh(args)
+    showFlights(cat.query(rocket, motor, date, sortKey))
+    cat.close()
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
+    sys.exit(0)
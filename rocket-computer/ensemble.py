@@ -0,0 +1,157 @@
+#!/usr/local/bin/python3
+
+# Compute statistics over groups of flights.
+# Flights are aligned at launch and resampled onto common grid of times relative to launch.
+# Groups are formed by rocket or by motor, as parsed from log file names.
+
+import sys
+import getopt
+import warnings
+import numpy as np
+
+import analyze
+import catalog
+
+def usage(name):
+    print("Usage: %s [-h] [-g KEY] [-r RATE] [-a AFTER] F1.csv F2.csv ..." % name)
+    print(" -h       Print this message")
+    print(" -g KEY   Group flights by KEY: %s" % ", ".join(groupKeys))
+    print(" -r RATE  Sample rate (Hz) of common time grid (default = %.1f)" % Ensemble.rate)
+    print(" -a AFTER Seconds after launch to include (default = %.1f)" % Ensemble.tafter)
+
+groupKeys = ["motor", "rocket"]
+
+# Columns to align
+curveFields = ["altitude", "acceleration"]
+# Events whose distributions are reported
+eventNames = ["thr-end", "apogee", "deploy", "land"]
+# Percentiles reported for curves
+percentiles = [10, 50, 90]
+
+class Ensemble:
+    groupKey = "motor"
+    rate = 20.0
+    tbefore = 1.0
+    tafter = 30.0
+    # Times relative to launch
+    times = None
+    # Group name --> list of flight names
+    groups = {}
+    # Group name --> field --> list of per-flight arrays on common grid (NaN where no data)
+    curves = {}
+    # Group name --> event --> list of (time since launch, altitude) pairs
+    events = {}
+
+    def __init__(self, groupKey = "motor", rate = 20.0, tafter = 30.0):
+        self.groupKey = groupKey
+        self.rate = rate
+        self.tafter = tafter
+        self.times = -self.tbefore + np.arange(int(round((self.tbefore + self.tafter) * self.rate)) + 1) / self.rate
+        self.groups = {}
+        self.curves = {}
+        self.events = {}
+
+    def groupName(self, root):
+        date, rocket, motor, note = catalog.parseFlightName(root)
+        name = motor if self.groupKey == "motor" else rocket
+        return "unknown" if name is None else name
+
+    def addFlight(self, root):
+        e = analyze.Evaluator(root)
+        if e.root is None:
+            return False
+        try:
+            h = e.highlights()
+            tland = h['land']['time']
+        except Exception as ex:
+            print("Couldn't find events for flight %s (%s)" % (root, str(ex)))
+            return False
+        group = self.groupName(root)
+        if group not in self.groups:
+            self.groups[group] = []
+            self.curves[group] = {kw : [] for kw in curveFields}
+            self.events[group] = {event : [] for event in eventNames}
+        self.groups[group].append(root)
+        grid = self.times + e.tstart
+        values = e.resampleColumns(curveFields, grid)
+        values[0] = values[0] - e.astart
+        outside = (grid < e.getFloatField(0, "time")) | (grid > tland)
+        for kw, v in zip(curveFields, values):
+            v[outside] = np.nan
+            self.curves[group][kw].append(v)
+        for event in eventNames:
+            if event in h:
+                self.events[group][event].append(e.getCoordinate(event, h))
+        return True
+
+    # Dictionary of statistics for group.
+    # For each curve field, entries "FIELD-mean" and "FIELD-pNN" give arrays over time grid.
+    # "count" gives number of flights contributing at each time.
+    def curveStats(self, group):
+        result = {}
+        with warnings.catch_warnings():
+            # Times with no flights yield NaN
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            for kw in curveFields:
+                data = np.vstack(self.curves[group][kw])
+                result[kw + "-mean"] = np.nanmean(data, axis=0)
+                pvals = np.nanpercentile(data, percentiles, axis=0)
+                for p, v in zip(percentiles, pvals):
+                    result["%s-p%d" % (kw, p)] = v
+                result["count"] = np.sum(~np.isnan(data), axis=0)
+        return result
+
+    # Dictionary giving, for each event, arrays of times and altitudes over flights in group
+    def eventStats(self, group):
+        result = {}
+        for event in eventNames:
+            coords = np.array(self.events[group][event]).reshape(-1, 2)
+            result[event] = (coords[:,0], coords[:,1])
+        return result
+
+    def showSummary(self):
+        print("\t".join(["group", "flights", "event", "t-mean", "t-std", "a-mean", "a-std", "a-min", "a-max"]))
+        for group in sorted(self.groups.keys()):
+            es = self.eventStats(group)
+            for event in eventNames:
+                times, alts = es[event]
+                if len(times) == 0:
+                    continue
+                fields = [group, "%d" % len(self.groups[group]), event,
+                          "%.3f" % np.mean(times), "%.3f" % np.std(times),
+                          "%.2f" % np.mean(alts), "%.2f" % np.std(alts), "%.2f" % np.min(alts), "%.2f" % np.max(alts)]
+                print("\t".join(fields))
+
+def stripExtension(name):
+    fields = name.split(".")
+    if len(fields) > 1 and fields[-1] == 'csv':
+        fields = fields[:-1]
+    return ".".join(fields)
+
+def run(name, args):
+    groupKey = "motor"
+    rate = Ensemble.rate
+    tafter = Ensemble.tafter
+    optList, args = getopt.getopt(args, "hg:r:a:")
+    for (opt, val) in optList:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-g':
+            if val not in groupKeys:
+                print("Unknown group key '%s'" % val)
+                usage(name)
+                return
+            groupKey = val
+        elif opt == '-r':
+            rate = float(val)
+        elif opt == '-a':
+            tafter = float(val)
+    ens = Ensemble(groupKey, rate, tafter)
+    for arg in args:
+        ens.addFlight(stripExtension(arg))
+    ens.showSummary()
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
+    sys.exit(0)
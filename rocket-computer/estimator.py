@@ -0,0 +1,210 @@
+#!/usr/local/bin/python3
+
+# Estimate altitude, vertical velocity, and accelerometer bias
+# by fusing X-axis acceleration with barometric altitude.
+# Kalman filter with state [altitude, velocity, bias].
+# Acceleration (corrected for orientation and gravity) drives the prediction,
+# and barometric altitude provides the measurement.
+
+import sys
+import numpy as np
+
+gravity = 9.80665
+
+# Default noise parameters
+# Standard deviation of barometric altitude (m)
+altitudeNoise = 0.5
+# Standard deviation of acceleration (m/s^2)
+accelerationNoise = 1.0
+# Random walk of accelerometer bias (m/s^2 per sqrt(s))
+biasNoise = 0.05
+
+# Filter restarts after interval longer than this (seconds), or jump in sequence numbers larger than this
+segmentGap = 1.0
+segmentJump = 100
+
+# Find gaps between successive samples: intervals longer than maxGap seconds, or where
+# the sequence number jumps by more than maxJump or resets.
+# Returns boolean array, true for each sample (other than the last) that is followed by gap
+def findGaps(times, sequence = None, maxGap = segmentGap, maxJump = segmentJump):
+    gapAfter = np.diff(times) > maxGap
+    if sequence is not None:
+        jumps = np.diff(sequence)
+        # Sequence resets indicate start of new stream
+        gapAfter |= (jumps < 1) | (jumps > maxJump)
+    return gapAfter
+
+# Orientation of X axis: +1 if it reads +1g at rest on the pad, -1 if it reads -1g
+# Use samples before launch, since rocket can land in any orientation
+def findOrientation(accelerationXs, launchThreshold = 1.5):
+    above = np.flatnonzero(np.abs(accelerationXs) > launchThreshold)
+    pad = accelerationXs[:above[0]] if len(above) > 0 and above[0] > 0 else accelerationXs
+    return -1.0 if np.median(pad) < 0 else 1.0
+
+# Convert X acceleration (in g's) to vertical acceleration (m/s^2) excluding gravity
+def verticalAcceleration(accelerationX, orientation):
+    return (orientation * accelerationX - 1.0) * gravity
+
+def transition(dt):
+    return np.array([[1.0, dt, -0.5*dt*dt], [0.0, 1.0, -dt], [0.0, 0.0, 1.0]])
+
+def control(dt):
+    return np.array([0.5*dt*dt, dt, 0.0])
+
+def processNoise(dt, aNoise, bNoise):
+    g = control(dt)
+    q = np.outer(g, g) * aNoise * aNoise
+    q[2,2] += bNoise * bNoise * dt
+    return q
+
+# Per-sample estimator, for use on live data
+class StateEstimator:
+    orientation = None
+    aNoise = accelerationNoise
+    bNoise = biasNoise
+    rNoise = altitudeNoise
+    # State and covariance
+    x = None
+    P = None
+    lastTime = None
+    lastAcceleration = 0.0
+
+    def __init__(self, orientation = None, aNoise = accelerationNoise, bNoise = biasNoise, rNoise = altitudeNoise):
+        self.orientation = orientation
+        self.aNoise = aNoise
+        self.bNoise = bNoise
+        self.rNoise = rNoise
+        self.x = None
+        self.P = None
+        self.lastTime = None
+        self.lastAcceleration = 0.0
+
+    # Incorporate new sample.  Return tuple (altitude, velocity, bias)
+    # Restarts after gap longer than segmentGap, as estimateStates does, keeping bias
+    def update(self, t, altitude, accelerationX):
+        if self.orientation is None:
+            self.orientation = -1.0 if accelerationX < 0 else 1.0
+        accel = verticalAcceleration(accelerationX, self.orientation)
+        if self.x is None:
+            self.x = np.array([altitude, 0.0, 0.0])
+            self.P = np.diag([self.rNoise * self.rNoise, 1.0, 1.0])
+        elif t - self.lastTime > segmentGap:
+            self.x = np.array([altitude, 0.0, self.x[2]])
+            self.P = np.diag([self.rNoise * self.rNoise, 1.0, self.P[2,2]])
+        else:
+            dt = max(0.0, t - self.lastTime)
+            F = transition(dt)
+            self.x = F @ self.x + control(dt) * self.lastAcceleration
+            self.P = F @ self.P @ F.T + processNoise(dt, self.aNoise, self.bNoise)
+            # Measurement update with H = [1, 0, 0]
+            s = self.P[0,0] + self.rNoise * self.rNoise
+            k = self.P[:,0] / s
+            self.x = self.x + k * (altitude - self.x[0])
+            self.P = self.P - np.outer(k, self.P[0,:])
+        self.lastTime = t
+        self.lastAcceleration = accel
+        return (self.x[0], self.x[1], self.x[2])
+
+# Compute steady-state Kalman gain for fixed sample interval
+def steadyGain(dt, aNoise = accelerationNoise, bNoise = biasNoise, rNoise = altitudeNoise, maxIterations = 10000):
+    F = transition(dt)
+    Q = processNoise(dt, aNoise, bNoise)
+    P = np.eye(3)
+    k = np.zeros(3)
+    for i in range(maxIterations):
+        P = F @ P @ F.T + Q
+        nk = P[:,0] / (P[0,0] + rNoise * rNoise)
+        P = P - np.outer(nk, P[0,:])
+        if np.max(np.abs(nk - k)) < 1e-12:
+            return nk
+        k = nk
+    return k
+
+# Run estimator over entire log at once.
+# Samples are assumed to be taken at uniform intervals on the flight computer, with the interval
+# being the median spacing of the times.  The log is split into segments at long gaps in time and at
+# large jumps or resets of the sequence numbers, and the filter restarts at each segment.  Within a
+# segment, each sample is placed on the grid of sample intervals by its time, and missing samples are
+# filled by interpolation.  Bias carries over from the end of the previous segment.
+# The filter has a constant steady-state gain, making it a linear time-invariant system
+# that can be applied with lfilter.
+# Returns array with one row [altitude, velocity, bias] per sample
+def estimateStates(times, altitudes, accelerationXs, sequence = None, orientation = None,
+                   aNoise = accelerationNoise, bNoise = biasNoise, rNoise = altitudeNoise):
+    # Importing scipy.signal is slow, so defer until needed
+    import scipy.signal
+    times = np.asarray(times, dtype=float)
+    altitudes = np.asarray(altitudes, dtype=float)
+    accelerationXs = np.asarray(accelerationXs, dtype=float)
+    n = len(times)
+    if n == 0:
+        return np.zeros((0, 3))
+    spacing = np.diff(times)
+    if n < 2 or not np.any(spacing > 0):
+        return np.column_stack((altitudes, np.zeros(n), np.zeros(n)))
+    dt = float(np.median(spacing[spacing > 0]))
+    if orientation is None:
+        orientation = findOrientation(accelerationXs)
+    accels = verticalAcceleration(accelerationXs, orientation)
+    # x[k] = A x[k-1] + Bc [u[k-1], z[k]]
+    k = steadyGain(dt, aNoise, bNoise, rNoise)
+    F = transition(dt)
+    IKH = np.eye(3) - np.outer(k, [1.0, 0.0, 0.0])
+    A = IKH @ F
+    Bc = np.column_stack((IKH @ control(dt), k))
+    filters = [scipy.signal.ss2tf(A, Bc, A, Bc, input=j) for j in range(2)]
+    gapAfter = findGaps(times, sequence, max(segmentGap, 2*dt))
+    bounds = np.concatenate(([0], np.flatnonzero(gapAfter) + 1, [n]))
+    states = np.zeros((n, 3))
+    bias = 0.0
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        # Position of each sample on grid of sample intervals.  Fill in missing samples
+        index = np.maximum.accumulate(np.rint((times[start:end] - times[start]) / dt).astype(int))
+        full = np.arange(index[-1]+1)
+        base = altitudes[start]
+        z = np.interp(full, index, altitudes[start:end] - base)
+        # Filter starts from zero state, so offset altitude and acceleration by initial values
+        u = np.interp(full, index, accels[start:end]) - bias
+        inputs = [np.concatenate(([0.0], u[:-1])), z]
+        segment = np.zeros((len(full), 3))
+        for (num, den), input in zip(filters, inputs):
+            for i in range(3):
+                segment[:,i] += scipy.signal.lfilter(num[i], den, input)
+        segment[:,0] += base
+        segment[:,2] += bias
+        states[start:end] = segment[index]
+        bias = states[end-1,2]
+    return states
+
+def summarize(root):
+    import analyze
+    e = analyze.Evaluator(root)
+    if e.root is None:
+        return
+    rapogee = e.findApogee()
+    kaltitudes = e.getColumn("kalman-altitude")
+    kvelocities = e.getColumn("kalman-velocity")
+    rkapogee = int(np.argmax(kaltitudes))
+    rlaunch = e.findLaunch()
+    rvmax = rlaunch + int(np.argmax(kvelocities[rlaunch:rkapogee+1])) if 0 <= rlaunch <= rkapogee else rkapogee
+    fields = [root,
+              "%.2f" % (e.getFloatField(rapogee, "altitude") - e.astart),
+              "%.2f" % (kaltitudes[rkapogee] - e.astart),
+              "%.3f" % e.getFloatField(rkapogee, "time"),
+              "%.2f" % kvelocities[rvmax]]
+    print("\t".join(fields))
+
+def run(name, args):
+    if len(args) == 0 or args[0] == '-h':
+        print("Usage: %s [-h] F1.csv F2.csv ..." % name)
+        return
+    print("\t".join(["flight", "apogee", "k-apogee", "k-time", "k-vmax"]))
+    for arg in args:
+        fields = arg.split(".")
+        if len(fields) > 1 and fields[-1] == 'csv':
+            arg = ".".join(fields[:-1])
+        summarize(arg)
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
+    sys.exit(0)
@@ -7,6 +7,8 @@ import sys
 import getopt
 
 import recorder
+import estimator
+import profiler
 
 def usage(prog):
     print("Usage: %s [-h] [-L] [-v VERB] [-p PORT] [-b BAUD] [-t TRIES] [-s SID] [-k BSIZE] [-y YMAX]" % prog)
@@ -17,6 +19,7 @@ def usage(prog):
     print("  -b BAUD Set serial interface baud rate")
     print("  -t TRY  Specify number of tries in opening serial port")
     print("  -k BUF  Buffer with up to BUF samples")
+    profiler.usage()
 
 # Useful widgets
 class TextTracker:
@@ -171,7 +174,9 @@ class Station:
     timeTracker = None
     accelerationTracker = None
     altitudeTracker = None
+    velocityTracker = None
     altitudeGrapher = None
+    estimator = None
     terminating = False
     minTime = None
 
@@ -206,24 +211,32 @@ class Station:
         self.accelerationTracker = TextTracker(self.trackerFrame, "Acceleration")
         self.accelerationXTracker = TextTracker(self.trackerFrame, "Upward Acceleration")
         self.altitudeTracker = TextTracker(self.trackerFrame, "Altitude")
+        self.velocityTracker = TextTracker(self.trackerFrame, "Velocity")
+        self.estimator = estimator.StateEstimator()
         self.terminating = False
         self.tk.update()
   
     def update(self):
         if self.terminating:
             return False
-        tup = self.sampler.getNextSampleTuple()
+        with profiler.stage("receive"):
+            tup = self.sampler.getNextSampleTuple()
         if tup is None:
             return True
-        r = self.formatter.formatSample(tup)
+        with profiler.stage("parse"):
+            r = self.formatter.formatSample(tup)
         if r is None:
             return True
-        self.timeTracker.update(r.timeStamp)
-        self.accelerationTracker.update(r.acceleration())
-        self.accelerationXTracker.update(r.accelerationX)
-        self.altitudeTracker.update(r.altitude)
-        self.altitudeGrapher.addPoint(r.timeStamp, r.altitude)
-        self.tk.update()
+        with profiler.stage("estimate"):
+            alt, velo, bias = self.estimator.update(r.timeStamp, r.altitude, r.accelerationX)
+        with profiler.stage("render"):
+            self.timeTracker.update(r.timeStamp)
+            self.accelerationTracker.update(r.acceleration())
+            self.accelerationXTracker.update(r.accelerationX)
+            self.altitudeTracker.update(r.altitude)
+            self.velocityTracker.update(velo)
+            self.altitudeGrapher.addPoint(r.timeStamp, r.altitude)
+            self.tk.update()
         return True
         
     def run(self, maxCount = None):
@@ -243,6 +256,8 @@ class Station:
         self.timeTracker.reset()
         self.accelerationTracker.reset()
         self.altitudeTracker.reset()
+        self.velocityTracker.reset()
+        self.estimator = estimator.StateEstimator()
         self.altitudeGrapher.reset()
 
 
@@ -256,7 +271,7 @@ def run(name, args):
     bufSize = 12
     yMax = 100.0
 
-    optList, args = getopt.getopt(args, "hLv:p:b:t:s:k:y:")
+    optList, args = getopt.getopt(args, "hLv:p:b:t:s:k:y:", profiler.longOptions)
     for (opt, val) in optList:
         if opt == '-h':
             usage(name)
@@ -281,6 +296,9 @@ def run(name, args):
             yMax = float(val)
         elif opt == '-L':
             logName = None
+        elif opt in profiler.optionNames:
+            profiler.setOption(opt, val)
+    profiler.begin()
 
     if port is None:
         plist = recorder.findPorts()
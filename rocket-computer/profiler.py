@@ -0,0 +1,145 @@
+# Optional profiling support for programs.
+# Programs accept options --profile=FILE and --profile-memory.
+# When enabled, records cProfile statistics, wall-clock time for each named stage,
+# and (optionally) the top memory allocators, and writes them to FILE when the program exits.
+# Raw cProfile data is written to FILE.prof.
+# When profiling is not enabled, marking a stage costs only a function call.
+
+import sys
+import time
+import atexit
+import cProfile
+import pstats
+import tracemalloc
+
+# Options to add to getopt long option list
+longOptions = ["profile=", "profile-memory"]
+optionNames = ["--profile", "--profile-memory"]
+
+def usage():
+    print(" --profile=FILE   Write profiling information to FILE")
+    print(" --profile-memory Include top memory allocators in profile")
+
+# Number of entries to show in reports
+functionCount = 40
+allocatorCount = 20
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+nullStage = NullStage()
+
+class Stage:
+    profiler = None
+    name = None
+    start = 0.0
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.addTime(self.name, time.perf_counter() - self.start)
+        return False
+
+class Profiler:
+    fileName = None
+    memory = False
+    profile = None
+    startTime = 0.0
+    # Stage name --> [total seconds, count]
+    stages = {}
+    finished = False
+
+    def __init__(self, fileName, memory = False):
+        self.fileName = fileName
+        self.memory = memory
+        self.stages = {}
+        self.finished = False
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start()
+        self.startTime = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        atexit.register(self.finish)
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def addTime(self, name, secs):
+        if name not in self.stages:
+            self.stages[name] = [0.0, 0]
+        self.stages[name][0] += secs
+        self.stages[name][1] += 1
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.profile.disable()
+        total = time.perf_counter() - self.startTime
+        try:
+            outfile = open(self.fileName, "w")
+        except Exception as ex:
+            print("Couldn't open profile file '%s' (%s)" % (self.fileName, str(ex)))
+            return
+        outfile.write("Total time %.3f s\n\n" % total)
+        outfile.write("Stage              Seconds    Count  Percent\n")
+        for name, (secs, count) in sorted(self.stages.items(), key = lambda item : -item[1][0]):
+            outfile.write("%-15s %10.3f %8d  %6.1f%%\n" % (name, secs, count, 100.0 * secs / total if total > 0 else 0.0))
+        outfile.write("\n")
+        stats = pstats.Stats(self.profile, stream=outfile)
+        stats.sort_stats("cumulative").print_stats(functionCount)
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            outfile.write("Top memory allocators\n")
+            for s in snapshot.statistics("lineno")[:allocatorCount]:
+                outfile.write("%s\n" % str(s))
+            current, peak = tracemalloc.get_traced_memory()
+            outfile.write("Current = %d bytes.  Peak = %d bytes\n" % (current, peak))
+            tracemalloc.stop()
+        outfile.close()
+        stats.dump_stats(self.fileName + ".prof")
+        # Standard output may be carrying program results
+        sys.stderr.write("Wrote profile to %s\n" % self.fileName)
+
+# Active profiler, if any
+current = None
+# Settings from options
+fileName = None
+memory = False
+
+# Record option.  Return True if it is a profiling option
+def setOption(opt, val):
+    global fileName, memory
+    if opt == "--profile":
+        fileName = val
+    elif opt == "--profile-memory":
+        memory = True
+    else:
+        return False
+    return True
+
+# Start profiling if requested by options
+def begin():
+    global current
+    if fileName is None or current is not None:
+        return
+    current = Profiler(fileName, memory)
+    current.start()
+
+# Context manager for timing stage of program
+def stage(name):
+    if current is None:
+        return nullStage
+    return current.stage(name)
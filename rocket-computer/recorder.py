@@ -16,6 +16,7 @@ import datetime
 import math
 import threading
 
+import profiler
 
 def usage(name):
     print("Usage: %s [-h] [-B] [-S] [-L] [-v VERB] [-p PORT] [-b BAUD] [-t TRIES] [-s SENDER] [-k BSIZE]" % name)
@@ -25,6 +26,7 @@ def usage(name):
     print(" -L       Disable generation of log file")
     print(" -v VERB  Verbosity level")
     print(" -k BSIZE Buffer with up to BSIZE samples")
+    profiler.usage()
 
     
 def trim(s):
@@ -565,7 +567,7 @@ def run(name, args):
     logName = logFileName()
     bufSize = 12
 
-    optList, args = getopt.getopt(args, "hBSLv:p:b:t:s:k:")
+    optList, args = getopt.getopt(args, "hBSLv:p:b:t:s:k:", profiler.longOptions)
     for (opt, val) in optList:
         if opt == '-h':
             usage(name)
@@ -592,6 +594,9 @@ def run(name, args):
             slow = True
         elif opt == '-L':
             logName = None
+        elif opt in profiler.optionNames:
+            profiler.setOption(opt, val)
+    profiler.begin()
 
     if port is None:
         plist = findPorts()
@@ -614,16 +619,19 @@ def run(name, args):
     lastTime = -1.0
     first = True
     while True:
-        tup = sampler.getNextSampleTuple()
+        with profiler.stage("receive"):
+            tup = sampler.getNextSampleTuple()
         if tup is None:
             return
-        r = formatter.formatSample(tup)
+        with profiler.stage("parse"):
+            r = formatter.formatSample(tup)
         if r is None:
             continue
         t = r.timeStamp
         if not slow or t > lastTime + 1.0:
             lastTime = math.floor(t)
-            r.show(sys.stdout, basic = basic)
+            with profiler.stage("display"):
+                r.show(sys.stdout, basic = basic)
     
 if __name__ == "__main__":
     run(sys.argv[0], sys.argv[1:])
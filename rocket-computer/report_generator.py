@@ -3,16 +3,58 @@
 # Generate Latex file containing results from set of rocket launches
 
 def usage(name):
-    print("Usage %s: [-h] [-t TITLE] [-o OUTFILE] R1 R2 ..." % name)
+    print("Usage %s: [-h] [-I] [-m MODE] [-t TITLE] [-g KEY] [-b BUDGET] [-C CACHEDIR] [-p PROCS] [-o OUTFILE] R1 R2 ..." % name)
+    print(" -m MODE  Output mode: %s (default = latex).  Modes other than latex require -o" % ", ".join(modes))
+    print(" -I       Write plot data inline, rather than as tables in directory OUTROOT-data")
+    print(" -g KEY   Add graphs of statistics for flights grouped by KEY: %s" % ", ".join(ensemble.groupKeys))
+    print(" -b BUDGET Plot at most about BUDGET points per flight (0 = all) (default = %d)" % defaultBudget)
+    print(" -C CACHEDIR Cache results for each flight in CACHEDIR (default = %s, '' to disable)" % defaultCacheDir)
+    print(" -p PROCS Number of processes for analyzing flights (default = number of CPUs)")
+    profiler.usage()
 
 import sys
+import os
+import re
+import io
+import json
 import getopt
+import hashlib
+import multiprocessing
+import numpy as np
 
 import analyze
+import ensemble
+import profiler
 
-# Generate list of evaluators
-evals = []
-highlights = []
+# Maximum number of points plotted for each flight
+defaultBudget = 500
+# Events whose points are always plotted
+keepEvents = ["second", "thr-end", "apogee", "deploy"]
+
+# Events marked on altitude graph
+markEvents = ["second", "thr-end", "deploy"]
+# Directory for caching per-flight results
+defaultCacheDir = "report-cache"
+# Change when format of cached results changes.  Changes to analysis are tracked by analyze.analysisVersion
+cacheVersion = 3
+# Output modes.  Mode html is rendered by report_html, and pdf, svg, png by report_native
+modes = ["latex", "pdf", "svg", "png", "html"]
+
+# Generate list of flight results, each a dictionary with entries:
+# "root", "section" (Latex highlights table), "rows" (highlights table entries),
+# "points" (times and altitudes of altitude curve),
+# and "events" (dictionary mapping event names to graph coordinates)
+flights = []
+
+# Plot data can be written to tables, rather than inline.
+# Graphs are then externalized, so that pdflatex only recompiles those whose data have changed.
+# Directory containing Latex file
+texDir = "."
+# Directories for tables and for externalized graphs, relative to texDir.  None when writing inline
+dataDir = None
+figureDir = None
+# Tables written so far
+tableNames = []
 
 def skipline(count, outfile):
     for i in range(count):
@@ -51,6 +93,9 @@ def beginDocument(title, outfile):
     outfile.write("\\usepackage{tikz}\n")
     outfile.write("\\usepackage{pgfplots}\n")
     outfile.write("\\usepackage{booktabs}\n")
+    if figureDir is not None:
+        outfile.write("\\usetikzlibrary{external}\n")
+        outfile.write("\\tikzexternalize[prefix=%s/]\n" % figureDir)
     outfile.write("\\authorrunning{}\n")
     outfile.write("\\titlerunning{}\n")
     skipline(1, outfile)
@@ -72,27 +117,97 @@ def generateSection(e, h, outfile):
     outfile.write("\\end{center}\n")
 
 
-def processFlight(root, outfile):
-    global evals, highlights
+# Analyze flight and generate its portions of report.  Return dictionary or None if unsuccessful
+def analyzeFlight(root, budget = defaultBudget):
     e = analyze.Evaluator(root)
     if e.root is None:
-        if outfile != sys.stdout:
-            print("Failed to process flight %s" % root)
-        return
-    evals.append(e)
-    h = e.highlights()
-    highlights.append(h)
-    generateSection(e, h, outfile)
-    skipline(1, outfile)
-    if outfile != sys.stdout:
-        print("Processed flight %s" % root)
-    
-def startGraph(outfile):
+        return None
+    with profiler.stage("detect"):
+        h = e.highlights()
+    with profiler.stage("render"):
+        section = io.StringIO()
+        generateSection(e, h, section)
+        keepRows = [h[event]['row'] for event in keepEvents if event in h]
+        times, altitudes = e.plotPoints(budget, keepRows)
+    rows = [[row[0]] + [None if v is None else float(v) for v in row[1:]] for row in e.highlightRows(h)]
+    events = {}
+    for event in markEvents:
+        if event in h:
+            t, a = e.getCoordinate(event, h)
+            events[event] = (float(t), float(a))
+    return { "root" : root, "section" : section.getvalue(), "rows" : rows, "points" : [times.tolist(), altitudes.tolist()], "events" : events }
+
+# Version of analyzeFlight for process pool
+def analyzeFlightArgs(args):
+    return analyzeFlight(*args)
+
+# Name of cache file for flight.  Depends on log contents as well as on parameters affecting results
+def cacheName(cacheDir, root, budget):
+    try:
+        chash = analyze.contentHash(root + ".csv")
+    except Exception:
+        return None
+    key = "%d:%d:%s:%s:%d" % (cacheVersion, analyze.analysisVersion, chash, root, budget)
+    return os.path.join(cacheDir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+def loadCached(name):
+    try:
+        with open(name, "r") as infile:
+            return json.load(infile)
+    except Exception:
+        return None
+
+def saveCached(name, flight):
+    try:
+        with open(name, "w") as outfile:
+            json.dump(flight, outfile)
+    except Exception as ex:
+        print("Couldn't write cache file '%s' (%s)" % (name, str(ex)))
+
+# Analyze flights, using cached results where available and analyzing others in parallel
+def processFlights(roots, budget = defaultBudget, cacheDir = None, processes = 1, quiet = False):
+    global flights
+    names = [None] * len(roots)
+    results = [None] * len(roots)
+    if cacheDir is not None:
+        if not os.path.isdir(cacheDir):
+            try:
+                os.makedirs(cacheDir)
+            except Exception as ex:
+                print("Couldn't create cache directory '%s' (%s)" % (cacheDir, str(ex)))
+                cacheDir = None
+    if cacheDir is not None:
+        for i, root in enumerate(roots):
+            names[i] = cacheName(cacheDir, root, budget)
+            if names[i] is not None:
+                results[i] = loadCached(names[i])
+    cached = [r is not None for r in results]
+    todo = [i for i in range(len(roots)) if results[i] is None]
+    jobs = [(roots[i], budget) for i in todo]
+    if len(jobs) > 1 and processes != 1:
+        with multiprocessing.Pool(min(processes or os.cpu_count(), len(jobs))) as pool:
+            computed = pool.map(analyzeFlightArgs, jobs)
+    else:
+        computed = [analyzeFlightArgs(job) for job in jobs]
+    for i, flight in zip(todo, computed):
+        results[i] = flight
+        if flight is not None and names[i] is not None:
+            saveCached(names[i], flight)
+    for root, flight, wasCached in zip(roots, results, cached):
+        if flight is None:
+            if not quiet:
+                print("Failed to process flight %s" % root)
+            continue
+        flights.append(flight)
+        if not quiet:
+            print("Processed flight %s%s" % (root, " (cached)" if wasCached else ""))
+
+def startGraph(outfile, ylabel = "Altitude (meters)"):
     skipline(1, outfile)
     outfile.write("\\begin{center}\n")
     outfile.write("\\begin{tikzpicture}\n")
     outfile.write("\\begin{axis}[mark options ={scale=0.75}, height=16cm,width=16cm,grid=both, grid style={black!10},\n")
-    outfile.write("              legend cell align={left}, xlabel={Time (seconds)}, ymin = 0, ylabel={Altitude (meters)}]\n")
+    outfile.write("              legend cell align={left}, xlabel={Time (seconds)}, ymin = 0, ylabel={%s}]\n" % ylabel)
 
 def finishGraph(outfile):
     outfile.write("\\end{axis}\n")
@@ -109,17 +224,18 @@ def buildGraph(outfile):
     
     startGraph(outfile)
     nextColor = 0
-    for (e, h) in zip(evals, highlights):
-        outfile.write("\\addplot [only marks, color=%s]\n" % colorNames[nextColor])
+    for flight in flights:
+        outfile.write("\\addplot [only marks, color=%s]\n" % colorNames[nextColor % len(colorNames)])
         nextColor += 1
-        e.plotData(outfile);
+        plotSeries(flight["root"], flight["points"][0], flight["points"][1], outfile)
         outfile.write("    ;\n")
-        legendString += " %s," % e.root
-        endThrustString += " (%.2f,%.2f)" % e.getCoordinate('thr-end', h)
-        deployString += " (%.2f,%.2f)" % e.getCoordinate('deploy', h)
-        if 'second' in h:
+        legendString += " %s," % flight["root"]
+        events = flight["events"]
+        endThrustString += " (%.2f,%.2f)" % tuple(events['thr-end'])
+        deployString += " (%.2f,%.2f)" % tuple(events['deploy'])
+        if 'second' in events:
             foundSecond = True
-            secondStageString += " (%.2f,%.2f)" % e.getCoordinate('second', h)
+            secondStageString += " (%.2f,%.2f)" % tuple(events['second'])
     if foundSecond:
         secondStageString += "};\n"
         outfile.write(secondStageString)
@@ -132,12 +248,141 @@ def buildGraph(outfile):
     outfile.write(legendString)
     finishGraph(outfile)
 
-def generate(title, roots, outfile):
+# Write curve as coordinates, omitting times with no data
+def plotCurve(times, values, outfile):
+    outfile.write("coordinates {")
+    count = 0
+    for (t, v) in zip(times, values):
+        if np.isnan(v):
+            continue
+        outfile.write(" (%.2f, %.2f)" % (t, v))
+        count += 1
+        if count >= 10:
+            outfile.write("\n      ")
+            count = 0
+    outfile.write("}\n")
+
+# Write curve as table file, omitting times with no data.
+# File name includes hash of contents, so that changed data changes the graph's Latex code.
+# Return name of file relative to texDir
+def writeTable(name, times, values):
+    lines = ["time value\n"]
+    for (t, v) in zip(times, values):
+        if not np.isnan(v):
+            lines.append("%.2f %.2f\n" % (t, v))
+    text = "".join(lines)
+    tname = "%s/%s-%s.dat" % (dataDir, re.sub("[^A-Za-z0-9-]", "-", os.path.basename(name)), hashlib.sha1(text.encode()).hexdigest()[:10])
+    try:
+        with open(os.path.join(texDir, tname), "w") as outfile:
+            outfile.write(text)
+    except Exception as ex:
+        print("Couldn't write table file '%s' (%s)" % (tname, str(ex)))
+    tableNames.append(tname)
+    return tname
+
+# Write curve either inline or as reference to table file
+def plotSeries(name, times, values, outfile):
+    if dataDir is None:
+        plotCurve(times, values, outfile)
+    else:
+        outfile.write("table {%s}\n" % writeTable(name, times, values))
+
+# Set up directories for tables and externalized graphs, based on name of Latex file
+def setupTables(outName):
+    global texDir, dataDir, figureDir
+    texDir = os.path.dirname(outName) or "."
+    base = os.path.basename(outName)
+    fields = base.split(".")
+    if len(fields) > 1:
+        base = ".".join(fields[:-1])
+    for d in [base + "-data", base + "-figures"]:
+        try:
+            os.makedirs(os.path.join(texDir, d), exist_ok=True)
+        except Exception as ex:
+            print("Couldn't create directory '%s' (%s).  Writing plot data inline" % (d, str(ex)))
+            return
+    dataDir = base + "-data"
+    figureDir = base + "-figures"
+
+# Delete tables left from earlier runs
+def removeStaleTables():
+    if dataDir is None:
+        return
+    for name in os.listdir(os.path.join(texDir, dataDir)):
+        if name.endswith(".dat") and "%s/%s" % (dataDir, name) not in tableNames:
+            try:
+                os.remove(os.path.join(texDir, dataDir, name))
+            except Exception:
+                pass
+
+# Graphs showing mean and spread of altitude and acceleration for each group of flights
+def buildEnsembleGraphs(ens, outfile):
+    groups = sorted(ens.groups.keys())
+    stats = [ens.curveStats(group) for group in groups]
+    lo = "p%d" % ensemble.percentiles[0]
+    hi = "p%d" % ensemble.percentiles[-1]
+    for kw, ylabel in [("altitude", "Altitude (meters)"), ("acceleration", "Acceleration (g)")]:
+        skipline(1, outfile)
+        outfile.write("\\begin{center}\n")
+        outfile.write("Mean %s by %s.  Dashed lines show %s and %s percentiles\n" % (kw, ens.groupKey, lo[1:] + "th", hi[1:] + "th"))
+        outfile.write("\\end{center}\n")
+        startGraph(outfile, ylabel)
+        legends = []
+        nextColor = 0
+        for group, s in zip(groups, stats):
+            color = colorNames[nextColor % len(colorNames)]
+            nextColor += 1
+            outfile.write("\\addplot [no marks, thick, color=%s]\n" % color)
+            plotSeries("%s-%s-mean" % (group, kw), ens.times, s[kw + "-mean"], outfile)
+            outfile.write("    ;\n")
+            for p in [lo, hi]:
+                outfile.write("\\addplot [no marks, dashed, color=%s, forget plot]\n" % color)
+                plotSeries("%s-%s-%s" % (group, kw, p), ens.times, s[kw + "-" + p], outfile)
+                outfile.write("    ;\n")
+            legends.append("%s (%d)" % (group, len(ens.groups[group])))
+        outfile.write("\\legend{%s}\n" % ", ".join(legends))
+        finishGraph(outfile)
+
+# Statistics for groups of flights
+def buildEnsemble(groupKey):
+    ens = ensemble.Ensemble(groupKey)
+    for flight in flights:
+        ens.addFlight(flight["root"])
+    return ens
+
+def generate(title, roots, outfile, groupKey = None, budget = defaultBudget, cacheDir = None, processes = 1):
     beginDocument(title, outfile)
-    for r in roots:
-        processFlight(r, outfile)
-    buildGraph(outfile)
+    processFlights(roots, budget, cacheDir, processes, quiet = outfile == sys.stdout)
+    for flight in flights:
+        outfile.write(flight["section"])
+        skipline(1, outfile)
+    with profiler.stage("render"):
+        buildGraph(outfile)
+    if groupKey is not None:
+        ens = buildEnsemble(groupKey)
+        if len(ens.groups) > 0:
+            with profiler.stage("render"):
+                buildEnsembleGraphs(ens, outfile)
     finishDocument(outfile)
+    removeStaleTables()
+
+# Render report as HTML, or with matplotlib, rather than Latex
+def generateNative(title, roots, outName, fmt, groupKey = None, budget = defaultBudget, cacheDir = None, processes = 1):
+    processFlights(roots, budget, cacheDir, processes)
+    if len(flights) == 0:
+        print("No flights to report")
+        return
+    ens = None if groupKey is None else buildEnsemble(groupKey)
+    with profiler.stage("render"):
+        if fmt == "html":
+            import report_html
+            names = report_html.render(title, flights, outName, colorList, ens)
+        else:
+            # Import here, so that other reports don't require matplotlib
+            import report_native
+            names = report_native.render(title, flights, outName, fmt, colorList, ens)
+    for name in names:
+        print("Wrote report file %s" % name)
         
 def stripExtension(name):
     fields = name.split(".")
@@ -149,21 +394,62 @@ def run(name, args):
     title = "Rockets"
     roots = []
     outfile = sys.stdout
-    optList, args = getopt.getopt(args, "ht:o:")
+    groupKey = None
+    budget = defaultBudget
+    cacheDir = defaultCacheDir
+    processes = None
+    inline = False
+    outName = None
+    mode = "latex"
+    optList, args = getopt.getopt(args, "hIm:t:g:b:C:p:o:", profiler.longOptions)
     for (opt, val) in optList:
         if opt == '-h':
             usage(name)
             return
+        elif opt == '-I':
+            inline = True
+        elif opt == '-m':
+            if val not in modes:
+                print("Unknown output mode '%s'" % val)
+                usage(name)
+                return
+            mode = val
         elif opt == '-t':
             title = val
-        elif opt == '-o':
-            try:
-                outfile = open(val, "w")
-            except:
-                print("Couldn't open output file '%s'" % val)
+        elif opt == '-g':
+            if val not in ensemble.groupKeys:
+                print("Unknown group key '%s'" % val)
+                usage(name)
                 return
+            groupKey = val
+        elif opt == '-b':
+            budget = int(val)
+        elif opt == '-C':
+            cacheDir = None if val == "" else val
+        elif opt == '-p':
+            processes = int(val)
+        elif opt == '-o':
+            outName = val
+        elif opt in profiler.optionNames:
+            profiler.setOption(opt, val)
+    profiler.begin()
     roots = [stripExtension(a) for a in args]
-    generate(title, roots, outfile)
+    if mode != "latex":
+        if outName is None:
+            print("Output mode %s requires output file" % mode)
+            usage(name)
+            return
+        generateNative(title, roots, outName, mode, groupKey, budget, cacheDir, processes)
+        return
+    if outName is not None:
+        try:
+            outfile = open(outName, "w")
+        except:
+            print("Couldn't open output file '%s'" % outName)
+            return
+    if outName is not None and not inline:
+        setupTables(outName)
+    generate(title, roots, outfile, groupKey, budget, cacheDir, processes)
     
 if __name__ == "__main__":
     run(sys.argv[0], sys.argv[1:])
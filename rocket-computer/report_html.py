@@ -0,0 +1,258 @@
+#!/usr/local/bin/python3
+
+# Render flight report as single self-contained HTML file.
+# Series are embedded as base64-encoded float32 (time, value) pairs, after decimation by report_generator,
+# and drawn by small inline script supporting zooming (drag or mouse wheel; double click to reset),
+# hovering for values, and showing or hiding flights by clicking on legend entries.
+
+import html
+import json
+import base64
+import numpy as np
+
+import ensemble
+
+# Marker shape and legend label for each event marked on altitude graph, in legend order
+eventStyles = [("second", "pentagon", "Second Stage"),
+               ("thr-end", "square", "End Thrust"),
+               ("deploy", "diamond", "Deploy Parachute")]
+
+columnLabels = ["Event", "Time (seconds)", "Altitude (meters)", "Acceleration (g)", "Velocity (m/s)"]
+
+style = """
+body { font-family: sans-serif; margin: 1em; }
+h1 { text-align: center; }
+table { border-collapse: collapse; margin: 1em 0; font-size: 0.9em; }
+th { border-top: 2px solid black; border-bottom: 1px solid black; padding: 0.2em 0.8em; }
+td { padding: 0.1em 0.8em; text-align: right; }
+td:first-child, th:first-child { text-align: left; }
+tr:last-child td { border-bottom: 2px solid black; }
+.chart { position: relative; width: 100%; max-width: 60em; margin: 1em 0; }
+.chart canvas { width: 100%; height: 30em; touch-action: none; }
+.legend span { display: inline-block; margin-right: 1em; cursor: pointer; font-size: 0.85em; }
+.legend span.off { opacity: 0.3; }
+.tip { position: absolute; background: #fff; border: 1px solid #888; padding: 0.2em 0.4em; font-size: 0.8em; pointer-events: none; display: none; }
+"""
+
+script = """
+function decode(s) {
+  var b = atob(s), a = new Uint8Array(b.length);
+  for (var i = 0; i < b.length; i++) a[i] = b.charCodeAt(i);
+  return new Float32Array(a.buffer);
+}
+function marker(g, shape, x, y, r) {
+  g.beginPath();
+  if (shape == "square") g.rect(x-r, y-r, 2*r, 2*r);
+  else if (shape == "diamond") { g.moveTo(x, y-r*1.3); g.lineTo(x+r, y); g.lineTo(x, y+r*1.3); g.lineTo(x-r, y); }
+  else if (shape == "pentagon") for (var k = 0; k < 5; k++) {
+    var a = -Math.PI/2 + k*2*Math.PI/5; g.lineTo(x + r*Math.cos(a), y + r*Math.sin(a)); }
+  else g.arc(x, y, r, 0, 2*Math.PI);
+  g.closePath(); g.fill();
+}
+function Chart(div, spec) {
+  var canvas = div.querySelector("canvas"), tip = div.querySelector(".tip"), g = canvas.getContext("2d");
+  var series = spec.series.map(function (s) { s.xy = decode(s.data); s.on = true; return s; });
+  var pad = {l: 55, r: 10, t: 10, b: 40};
+  var full = {x0: Infinity, x1: -Infinity, y0: 0, y1: -Infinity};
+  series.forEach(function (s) { for (var i = 0; i < s.xy.length; i += 2) if (!isNaN(s.xy[i+1])) {
+    full.x0 = Math.min(full.x0, s.xy[i]); full.x1 = Math.max(full.x1, s.xy[i]); full.y1 = Math.max(full.y1, s.xy[i+1]); } });
+  full.y1 *= 1.05;
+  var view = Object.assign({}, full), drag = null, w, h;
+  function sx(x) { return pad.l + (x - view.x0) / (view.x1 - view.x0) * (w - pad.l - pad.r); }
+  function sy(y) { return h - pad.b - (y - view.y0) / (view.y1 - view.y0) * (h - pad.t - pad.b); }
+  function ix(px) { return view.x0 + (px - pad.l) / (w - pad.l - pad.r) * (view.x1 - view.x0); }
+  function ticks(lo, hi) {
+    var step = Math.pow(10, Math.floor(Math.log10((hi - lo) / 5))), r = (hi - lo) / step, out = [];
+    if (r > 25) step *= 5; else if (r > 10) step *= 2;
+    for (var v = Math.ceil(lo / step) * step; v <= hi; v += step) out.push(v);
+    return out;
+  }
+  function draw() {
+    var dpr = window.devicePixelRatio || 1;
+    w = canvas.clientWidth; h = canvas.clientHeight;
+    canvas.width = w * dpr; canvas.height = h * dpr;
+    g.setTransform(dpr, 0, 0, dpr, 0, 0);
+    g.clearRect(0, 0, w, h);
+    g.font = "11px sans-serif"; g.strokeStyle = "#ddd"; g.fillStyle = "#000"; g.lineWidth = 1;
+    g.textAlign = "center";
+    ticks(view.x0, view.x1).forEach(function (v) {
+      g.beginPath(); g.moveTo(sx(v), pad.t); g.lineTo(sx(v), h - pad.b); g.stroke(); g.fillText(+v.toFixed(3), sx(v), h - pad.b + 14); });
+    g.textAlign = "right";
+    ticks(view.y0, view.y1).forEach(function (v) {
+      g.beginPath(); g.moveTo(pad.l, sy(v)); g.lineTo(w - pad.r, sy(v)); g.stroke(); g.fillText(+v.toFixed(3), pad.l - 4, sy(v) + 4); });
+    g.textAlign = "center"; g.fillText("Time (seconds)", (pad.l + w - pad.r) / 2, h - 6);
+    g.save(); g.translate(12, (pad.t + h - pad.b) / 2); g.rotate(-Math.PI/2); g.fillText(spec.ylabel, 0, 0); g.restore();
+    g.save(); g.beginPath(); g.rect(pad.l, pad.t, w - pad.l - pad.r, h - pad.t - pad.b); g.clip();
+    series.forEach(function (s) {
+      if (!s.on) return;
+      g.fillStyle = s.color; g.strokeStyle = s.color;
+      if (s.kind == "points" || s.kind == "marker") {
+        for (var i = 0; i < s.xy.length; i += 2) marker(g, s.shape, sx(s.xy[i]), sy(s.xy[i+1]), s.kind == "marker" ? 5 : 2);
+      } else {
+        g.lineWidth = s.kind == "line" ? 2 : 1; g.setLineDash(s.kind == "dashed" ? [5, 4] : []);
+        g.beginPath(); var pen = false;
+        for (var i = 0; i < s.xy.length; i += 2) {
+          if (isNaN(s.xy[i+1])) { pen = false; continue; }
+          if (pen) g.lineTo(sx(s.xy[i]), sy(s.xy[i+1])); else g.moveTo(sx(s.xy[i]), sy(s.xy[i+1]));
+          pen = true;
+        }
+        g.stroke(); g.setLineDash([]);
+      }
+    });
+    if (drag && drag.x1 !== undefined) {
+      g.fillStyle = "rgba(0,0,255,0.1)"; g.fillRect(Math.min(drag.x0, drag.x1), pad.t, Math.abs(drag.x1 - drag.x0), h - pad.t - pad.b);
+    }
+    g.restore();
+  }
+  function pos(ev) { var r = canvas.getBoundingClientRect(); return [ev.clientX - r.left, ev.clientY - r.top]; }
+  function hover(p) {
+    var best = null, bd = 100;
+    series.forEach(function (s) {
+      if (!s.on || !s.hover) return;
+      for (var i = 0; i < s.xy.length; i += 2) {
+        var dx = sx(s.xy[i]) - p[0], dy = sy(s.xy[i+1]) - p[1], d = dx*dx + dy*dy;
+        if (d < bd) { bd = d; best = [s, i]; }
+      }
+    });
+    if (best == null) { tip.style.display = "none"; return; }
+    var s = best[0], i = best[1];
+    tip.textContent = s.name + ": t = " + s.xy[i].toFixed(2) + ", " + s.xy[i+1].toFixed(2) + " " + spec.unit;
+    tip.style.left = Math.min(sx(s.xy[i]) + 8, w - 200) + "px"; tip.style.top = Math.max(sy(s.xy[i+1]) - 24, 0) + "px";
+    tip.style.display = "block";
+  }
+  canvas.addEventListener("pointerdown", function (ev) { var p = pos(ev); drag = {x0: p[0]}; canvas.setPointerCapture(ev.pointerId); hover(p); });
+  canvas.addEventListener("pointermove", function (ev) {
+    var p = pos(ev);
+    if (drag) { drag.x1 = p[0]; draw(); } else hover(p);
+  });
+  canvas.addEventListener("pointerup", function (ev) {
+    if (drag && drag.x1 !== undefined && Math.abs(drag.x1 - drag.x0) > 5) {
+      var a = ix(Math.min(drag.x0, drag.x1)), b = ix(Math.max(drag.x0, drag.x1));
+      view.x0 = a; view.x1 = b;
+      var top = 0;
+      series.forEach(function (s) { if (s.on) for (var i = 0; i < s.xy.length; i += 2)
+        if (s.xy[i] >= a && s.xy[i] <= b && s.xy[i+1] > top) top = s.xy[i+1]; });
+      view.y0 = 0; view.y1 = top > 0 ? top * 1.05 : full.y1;
+    }
+    drag = null; draw();
+  });
+  canvas.addEventListener("wheel", function (ev) {
+    ev.preventDefault();
+    var x = ix(pos(ev)[0]), f = ev.deltaY > 0 ? 1.25 : 0.8;
+    view.x0 = Math.max(full.x0, x - (x - view.x0) * f); view.x1 = Math.min(full.x1, x + (view.x1 - x) * f);
+    draw();
+  }, {passive: false});
+  canvas.addEventListener("dblclick", function () { view = Object.assign({}, full); draw(); });
+  var legend = div.querySelector(".legend");
+  series.forEach(function (s) {
+    if (s.legend === false) return;
+    var e = document.createElement("span");
+    e.innerHTML = "<b style='color:" + s.color + "'>&#9679;</b> ";
+    e.appendChild(document.createTextNode(s.name));
+    e.onclick = function () {
+      series.forEach(function (t) { if (t.group == s.group) t.on = !t.on; });
+      e.className = s.on ? "" : "off"; draw();
+    };
+    legend.appendChild(e);
+  });
+  window.addEventListener("resize", draw);
+  draw();
+}
+document.querySelectorAll(".chart").forEach(function (div) { Chart(div, JSON.parse(div.querySelector("script").textContent)); });
+"""
+
+# Encode times and values as base64 string of interleaved little-endian float32 pairs
+def encode(times, values):
+    data = np.column_stack((np.asarray(times, dtype=float), np.asarray(values, dtype=float))).astype("<f4")
+    return base64.b64encode(data.tobytes()).decode("ascii")
+
+def cssColor(color):
+    name, r, g, b = color
+    return "rgb(%d,%d,%d)" % (int(255*r), int(255*g), int(255*b))
+
+class HtmlReport:
+    title = None
+    colors = []
+    # Portions of document body
+    parts = []
+
+    def __init__(self, title, colors):
+        self.title = title
+        self.colors = colors
+        self.parts = []
+
+    def color(self, index):
+        return cssColor(self.colors[index % len(self.colors)])
+
+    def addTables(self, flights):
+        for flight in flights:
+            lines = ["<table>", "<caption style='text-align:left'><b>%s</b></caption>" % html.escape(flight["root"])]
+            lines.append("<tr>" + "".join("<th>%s</th>" % label for label in columnLabels) + "</tr>")
+            for row in flight["rows"]:
+                cells = [html.escape(row[0])] + ["" if v is None else "%.3f" % v for v in row[1:]]
+                lines.append("<tr>" + "".join("<td>%s</td>" % c for c in cells) + "</tr>")
+            lines.append("</table>")
+            self.parts.append("\n".join(lines))
+
+    def addChart(self, spec, caption = None):
+        if caption is not None:
+            self.parts.append("<p>%s</p>" % html.escape(caption))
+        # Escape closing tags within JSON
+        text = json.dumps(spec).replace("</", "<\\/")
+        self.parts.append("<div class='chart'><canvas></canvas><div class='tip'></div><div class='legend'></div>"
+                          "<script type='application/json'>%s</script></div>" % text)
+
+    # Altitudes of all flights, with event markers
+    def addGraph(self, flights):
+        series = []
+        for i, flight in enumerate(flights):
+            times, altitudes = flight["points"]
+            series.append({ "name" : flight["root"], "group" : i, "color" : self.color(i), "kind" : "points",
+                            "hover" : True, "data" : encode(times, altitudes) })
+        for event, shape, label in eventStyles:
+            coords = np.array([flight["events"][event] for flight in flights if event in flight["events"]]).reshape(-1, 2)
+            if len(coords) > 0:
+                series.append({ "name" : label, "group" : event, "color" : "red", "kind" : "marker", "shape" : shape,
+                                "hover" : True, "data" : encode(coords[:,0], coords[:,1]) })
+        self.addChart({ "ylabel" : "Altitude (meters)", "unit" : "m", "series" : series })
+
+    # Mean and spread of altitude and acceleration for each group of flights
+    def addEnsembleGraphs(self, ens):
+        groups = sorted(ens.groups.keys())
+        stats = [ens.curveStats(group) for group in groups]
+        lo = "p%d" % ensemble.percentiles[0]
+        hi = "p%d" % ensemble.percentiles[-1]
+        for kw, ylabel, unit in [("altitude", "Altitude (meters)", "m"), ("acceleration", "Acceleration (g)", "g")]:
+            series = []
+            for i, (group, s) in enumerate(zip(groups, stats)):
+                name = "%s (%d)" % (group, len(ens.groups[group]))
+                series.append({ "name" : name, "group" : i, "color" : self.color(i), "kind" : "line",
+                                "hover" : True, "data" : encode(ens.times, s[kw + "-mean"]) })
+                for p in [lo, hi]:
+                    series.append({ "name" : "%s %s" % (name, p), "group" : i, "color" : self.color(i), "kind" : "dashed",
+                                    "legend" : False, "hover" : False, "data" : encode(ens.times, s[kw + "-" + p]) })
+            caption = "Mean %s by %s.  Dashed lines show %s and %s percentiles" % (kw, ens.groupKey, lo[1:] + "th", hi[1:] + "th")
+            self.addChart({ "ylabel" : ylabel, "unit" : unit, "series" : series }, caption)
+
+    def write(self, outName):
+        try:
+            with open(outName, "w") as outfile:
+                outfile.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset='utf-8'>\n")
+                outfile.write("<meta name='viewport' content='width=device-width, initial-scale=1'>\n")
+                outfile.write("<title>%s</title>\n<style>%s</style>\n</head>\n<body>\n" % (html.escape(self.title), style))
+                outfile.write("<h1>%s</h1>\n" % html.escape(self.title))
+                outfile.write("\n".join(self.parts))
+                outfile.write("\n<script>%s</script>\n</body>\n</html>\n" % script)
+        except Exception as ex:
+            print("Couldn't write report file '%s' (%s)" % (outName, str(ex)))
+            return []
+        return [outName]
+
+# Render report for flights (as generated by report_generator)
+def render(title, flights, outName, colors, ens = None):
+    report = HtmlReport(title, colors)
+    report.addTables(flights)
+    report.addGraph(flights)
+    if ens is not None and len(ens.groups) > 0:
+        report.addEnsembleGraphs(ens)
+    return report.write(outName)
@@ -0,0 +1,135 @@
+#!/usr/local/bin/python3
+
+# Render flight report directly as PDF, SVG, or PNG, without Latex.
+# Shows same highlights tables and graphs as Latex report from report_generator,
+# which uses this module for its output modes other than Latex.
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+import numpy as np
+
+import ensemble
+
+# Page size (inches) and resolution for PNG output
+pageSize = (8.27, 11.69)
+dpi = 150
+tablesPerPage = 4
+
+columnLabels = ["Event", "Time\n(seconds)", "Altitude\n(meters)", "Acceleration\n(g)", "Velocity\n(m/s)"]
+
+# Marker, size, and legend label for each event marked on altitude graph, in legend order
+eventStyles = [("second", "p", 40, "Second Stage"),
+               ("thr-end", "s", 30, "End Thrust"),
+               ("deploy", "D", 50, "Deploy Parachute")]
+
+class NativeReport:
+    title = None
+    # List of (name, r, g, b) for flights
+    colors = []
+    # Figures, one per page
+    pages = []
+
+    def __init__(self, title, colors):
+        self.title = title
+        self.colors = colors
+        self.pages = []
+
+    def color(self, index):
+        name, r, g, b = self.colors[index % len(self.colors)]
+        return (r, g, b)
+
+    # Pages of highlights tables, with title on first page
+    def addTables(self, flights):
+        for start in range(0, max(1, len(flights)), tablesPerPage):
+            fig, axes = plt.subplots(tablesPerPage, 1, figsize=pageSize)
+            if start == 0:
+                fig.suptitle(self.title, fontsize=18, fontweight="bold")
+            for ax, flight in zip(axes, flights[start:start+tablesPerPage] + [None] * tablesPerPage):
+                ax.axis("off")
+                if flight is None:
+                    continue
+                cells = [[row[0]] + ["" if v is None else "%.3f" % v for v in row[1:]] for row in flight["rows"]]
+                table = ax.table(cellText=cells, colLabels=columnLabels, loc="upper center", cellLoc="right", colLoc="right")
+                table.auto_set_font_size(False)
+                table.set_fontsize(8)
+                table.scale(1.0, 1.1)
+                for r in range(len(cells) + 1):
+                    table[(r, 0)].set_text_props(ha="left")
+                for (r, c), cell in table.get_celld().items():
+                    cell.set_edgecolor("white" if r > 0 else "black")
+                    if r == 0:
+                        # Labels have two lines
+                        cell.set_height(2 * cell.get_height())
+                ax.set_title(flight["root"], loc="left", fontweight="bold", fontsize=10)
+            self.pages.append(fig)
+
+    # Altitudes of all flights, with event markers
+    def addGraph(self, flights):
+        fig, ax = plt.subplots(figsize=(pageSize[0], pageSize[0]))
+        for i, flight in enumerate(flights):
+            times, altitudes = flight["points"]
+            ax.scatter(times, altitudes, s=4, color=self.color(i), label=flight["root"])
+        for event, marker, size, label in eventStyles:
+            coords = np.array([flight["events"][event] for flight in flights if event in flight["events"]]).reshape(-1, 2)
+            if len(coords) > 0:
+                ax.scatter(coords[:,0], coords[:,1], s=size, color="red", marker=marker, label=label, zorder=3)
+        self.finishAxes(ax, "Altitude (meters)")
+        self.pages.append(fig)
+
+    # Mean and spread of altitude and acceleration for each group of flights
+    def addEnsembleGraphs(self, ens):
+        groups = sorted(ens.groups.keys())
+        stats = [ens.curveStats(group) for group in groups]
+        lo = "p%d" % ensemble.percentiles[0]
+        hi = "p%d" % ensemble.percentiles[-1]
+        for kw, ylabel in [("altitude", "Altitude (meters)"), ("acceleration", "Acceleration (g)")]:
+            fig, ax = plt.subplots(figsize=(pageSize[0], pageSize[0]))
+            ax.set_title("Mean %s by %s.  Dashed lines show %s and %s percentiles" % (kw, ens.groupKey, lo[1:] + "th", hi[1:] + "th"), fontsize=10)
+            for i, (group, s) in enumerate(zip(groups, stats)):
+                ax.plot(ens.times, s[kw + "-mean"], color=self.color(i), linewidth=2, label="%s (%d)" % (group, len(ens.groups[group])))
+                for p in [lo, hi]:
+                    ax.plot(ens.times, s[kw + "-" + p], color=self.color(i), linestyle="--", linewidth=1)
+            self.finishAxes(ax, ylabel)
+            self.pages.append(fig)
+
+    def finishAxes(self, ax, ylabel):
+        ax.set_xlabel("Time (seconds)")
+        ax.set_ylabel(ylabel)
+        ax.set_ylim(bottom=0)
+        ax.grid(True, color="black", alpha=0.1)
+        ax.legend(loc="upper right", fontsize=8)
+
+    # Write pages.  PDF output has all pages in one file.
+    # For other formats, pages after the first go to files OUTROOT-2.EXT, OUTROOT-3.EXT, ...
+    # Return list of files written
+    def write(self, outName, fmt):
+        names = []
+        try:
+            if fmt == "pdf":
+                with PdfPages(outName) as pdf:
+                    for fig in self.pages:
+                        pdf.savefig(fig)
+                names.append(outName)
+            else:
+                fields = outName.split(".")
+                root = ".".join(fields[:-1]) if len(fields) > 1 else outName
+                for i, fig in enumerate(self.pages):
+                    name = outName if i == 0 else "%s-%d.%s" % (root, i+1, fmt)
+                    fig.savefig(name, format=fmt, dpi=dpi)
+                    names.append(name)
+        except Exception as ex:
+            print("Couldn't write report file '%s' (%s)" % (outName, str(ex)))
+        for fig in self.pages:
+            plt.close(fig)
+        return names
+
+# Render report for flights (as generated by report_generator) in format fmt
+def render(title, flights, outName, fmt, colors, ens = None):
+    report = NativeReport(title, colors)
+    report.addTables(flights)
+    report.addGraph(flights)
+    if ens is not None and len(ens.groups) > 0:
+        report.addEnsembleGraphs(ens)
+    return report.write(outName, fmt)
@@ -0,0 +1,211 @@
+#!/usr/local/bin/python3
+
+# Scan archive of flight logs for unstable or anomalous flights.
+# Computes spectral and statistical features for each flight from its uniformly resampled data,
+# scores each flight by how far its features lie from those of typical flights,
+# and reports which reference flights (e.g., known unstable or crashed flights) it most resembles.
+
+import sys
+import os
+import glob
+import getopt
+import multiprocessing
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import uniform
+import catalog
+
+def usage(name):
+    print("Usage: %s [-h] [-p PROCS] [-t THRESH] [-R REF.csv] ... DIR|FILE.csv ..." % name)
+    print(" -h        Print this message")
+    print(" -p PROCS  Number of processes (default = number of CPUs)")
+    print(" -t THRESH Flag flights with anomaly score above THRESH (default = %.1f)" % defaultThreshold)
+    print(" -R REF    Add reference flight exhibiting problem.  Can be repeated")
+    print("           (e.g., logs/2024-07-20-ukraine-C6-unstable.csv)")
+
+defaultThreshold = 4.0
+
+# Grid rate for resampled data (Hz)
+rate = 20.0
+# FFT window length (samples) and hop
+fftWindow = 32
+fftHop = 8
+# Frequency bands (Hz) for spectral energy
+bands = [(0.5, 2.0), (2.0, 5.0), (5.0, 10.0)]
+# Window (samples) for smoothing altitude
+smoothWindow = 9
+# Threshold (g) for detecting launch
+launchThreshold = 1.5
+
+featureNames = ["lat-ratio", "lat-peak", "wobble", "lat-mid", "lat-high", "alt-resid", "alt-spike",
+                "rel-apogee", "ascent-time", "masked"]
+
+# Indices of start, apogee, and end of flight in uniform arrays.  Return None if no launch found
+def flightWindow(u):
+    accel = u.getColumn("acceleration")
+    above = np.flatnonzero(accel > launchThreshold)
+    if len(above) == 0:
+        return None
+    rlaunch = above[0]
+    alt = u.getColumn("altitude") - u.getColumn("altitude")[rlaunch]
+    # Ignore isolated spikes when finding apogee
+    smooth = movingMedian(alt, smoothWindow)
+    rapogee = rlaunch + int(np.argmax(smooth[rlaunch:]))
+    below = np.flatnonzero(smooth[rapogee:] < 1.0)
+    rland = rapogee + below[0] if len(below) > 0 else len(alt)-1
+    return (rlaunch, rapogee, max(rland, rapogee+1))
+
+def movingMedian(values, window):
+    half = window // 2
+    padded = np.concatenate((np.full(half, values[0]), values, np.full(half, values[-1])))
+    return np.median(sliding_window_view(padded, window), axis=1)
+
+# Fraction of spectral energy of signal in each frequency band, using Hann-windowed FFTs
+def bandFractions(signal):
+    if len(signal) < fftWindow:
+        signal = np.concatenate((signal, np.zeros(fftWindow - len(signal))))
+    frames = sliding_window_view(signal, fftWindow)[::fftHop]
+    frames = (frames - frames.mean(axis=1, keepdims=True)) * np.hanning(fftWindow)
+    power = np.square(np.abs(np.fft.rfft(frames, axis=1))).sum(axis=0)
+    freqs = np.fft.rfftfreq(fftWindow, 1.0/rate)
+    total = max(np.sum(power[freqs >= bands[0][0]]), 1e-12)
+    return [np.sum(power[(freqs >= lo) & (freqs < hi + (1e-9 if hi >= freqs[-1] else 0))]) / total for (lo, hi) in bands]
+
+# Compute feature vector for flight.  Return (root, features) or (root, None) if unsuccessful
+def flightFeatures(root):
+    try:
+        u = uniform.UniformFlight(root, rate)
+        if u.root is None:
+            return (root, None)
+        window = flightWindow(u)
+        if window is None:
+            return (root, None)
+        rlaunch, rapogee, rland = window
+        ax = u.getColumn("acceleration-X")[rlaunch:rland+1]
+        lateral = np.hypot(u.getColumn("acceleration-Y"), u.getColumn("acceleration-Z"))[rlaunch:rland+1]
+        ascent = rapogee - rlaunch + 1
+        alt = u.getColumn("altitude")[rlaunch:rland+1] - u.getColumn("altitude")[rlaunch]
+        resid = alt - movingMedian(alt, smoothWindow)
+        latBands = bandFractions(lateral)
+        apogee = max(np.max(movingMedian(alt, smoothWindow)), 1.0)
+        features = [np.sqrt(np.mean(np.square(lateral[:ascent]))) / max(np.sqrt(np.mean(np.square(ax[:ascent]))), 1e-3),
+                    np.max(lateral[:ascent]),
+                    latBands[0],
+                    latBands[1],
+                    latBands[2],
+                    np.std(resid) / apogee,
+                    np.max(np.abs(resid)) / apogee,
+                    apogee,
+                    ascent / rate,
+                    u.stats["masked"]]
+        return (root, np.array(features))
+    except Exception as ex:
+        print("Couldn't scan flight %s (%s)" % (root, str(ex)))
+        return (root, None)
+
+class Scanner:
+    processes = None
+    threshold = defaultThreshold
+    roots = []
+    references = []
+    # Matrix of features, one row per flight
+    features = None
+    # Robust standardized features
+    scores = None
+
+    def __init__(self, processes = None, threshold = defaultThreshold):
+        self.processes = processes
+        self.threshold = threshold
+        self.roots = []
+        self.references = []
+
+    def scan(self, roots, references):
+        allRoots = list(dict.fromkeys(roots + references))
+        with multiprocessing.Pool(self.processes) as pool:
+            results = pool.map(flightFeatures, allRoots)
+        results = [(root, f) for root, f in results if f is not None]
+        self.roots = [root for root, f in results]
+        self.references = [root for root in references if root in self.roots]
+        if len(results) == 0:
+            return
+        self.features = np.vstack([f for root, f in results])
+        self.normalizeApogees()
+        # Robust z-scores relative to typical flight
+        center = np.median(self.features, axis=0)
+        spread = 1.4826 * np.median(np.abs(self.features - center), axis=0)
+        spread = np.maximum(spread, 1e-3 * np.maximum(np.abs(center), 1e-3))
+        self.scores = (self.features - center) / spread
+
+    # Express apogee relative to median apogee of flights with same motor
+    def normalizeApogees(self):
+        col = featureNames.index("rel-apogee")
+        motors = np.array([str(catalog.parseFlightName(root)[2]) for root in self.roots])
+        for motor in set(motors):
+            rows = motors == motor
+            self.features[rows, col] /= np.median(self.features[rows, col])
+
+    # Generate list of (score, root, nearest reference, top feature, flagged), ordered by decreasing score
+    def ranking(self):
+        if self.scores is None:
+            return []
+        anomaly = np.sqrt(np.mean(np.square(self.scores), axis=1))
+        top = np.argmax(np.abs(self.scores), axis=1)
+        refIndices = [self.roots.index(ref) for ref in self.references]
+        result = []
+        for i, root in enumerate(self.roots):
+            nearest = None
+            # Resembles reference when closer to it than to typical flight
+            ndist = np.sqrt(np.sum(np.square(self.scores[i])))
+            for j in refIndices:
+                if j == i:
+                    continue
+                dist = np.sqrt(np.sum(np.square(self.scores[i] - self.scores[j])))
+                if dist < ndist:
+                    nearest = self.roots[j]
+                    ndist = dist
+            flagged = anomaly[i] > self.threshold or nearest is not None
+            result.append((anomaly[i], root, nearest, featureNames[top[i]], flagged))
+        result.sort(key = lambda r : -r[0])
+        return result
+
+    def showRanking(self):
+        print("\t".join(["rank", "score", "flag", "flight", "top-feature", "resembles"]))
+        for rank, (score, root, nearest, feature, flagged) in enumerate(self.ranking()):
+            fields = ["%d" % (rank+1), "%.2f" % score, "*" if flagged else "", os.path.basename(root), feature,
+                      "" if nearest is None else os.path.basename(nearest)]
+            print("\t".join(fields))
+
+def findRoots(paths):
+    result = []
+    for path in paths:
+        names = sorted(glob.glob(os.path.join(path, "*.csv"))) if os.path.isdir(path) else [path]
+        for name in names:
+            fields = name.split(".")
+            if len(fields) > 1 and fields[-1] == 'csv':
+                name = ".".join(fields[:-1])
+            result.append(name)
+    return result
+
+def run(name, args):
+    processes = None
+    threshold = defaultThreshold
+    references = []
+    optList, args = getopt.getopt(args, "hp:t:R:")
+    for (opt, val) in optList:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-p':
+            processes = int(val)
+        elif opt == '-t':
+            threshold = float(val)
+        elif opt == '-R':
+            references += findRoots([val])
+    s = Scanner(processes, threshold)
+    s.scan(findRoots(args), references)
+    s.showRanking()
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
+    sys.exit(0)
@@ -0,0 +1,335 @@
+#!/usr/local/bin/python3
+
+# Split raw log into sessions.
+# Finds stream restarts (where sequence numbers reset), idle periods on the pad or ground,
+# and individual flights.  Writes index of row ranges, and optionally a trimmed log for each flight.
+# Reads log in fixed-size chunks, so that memory use does not grow with log length.
+
+import sys
+import csv
+import json
+import getopt
+import numpy as np
+
+import analyze
+
+def usage(name):
+    print("Usage: %s [-h] [-w] [-c CHUNK] [-b PRE] [-a POST] F1.csv F2.csv ..." % name)
+    print(" -h       Print this message")
+    print(" -w       Write trimmed log ROOT-flightN.csv for each flight")
+    print(" -c CHUNK Number of rows to process at a time (default = %d)" % Segmenter.chunkSize)
+    print(" -b PRE   Seconds to keep before launch (default = %.1f)" % Segmenter.preRoll)
+    print(" -a POST  Seconds to keep after landing (default = %.1f)" % Segmenter.postRoll)
+
+def indexName(root):
+    return root + "-segments.json"
+
+def flightName(root, index):
+    return "%s-flight%d" % (root, index+1)
+
+class Segmenter:
+    root = None
+    # Parameters
+    chunkSize = 10000
+    preRoll = 5.0
+    postRoll = 5.0
+    # Acceleration (g) indicating launch
+    launchThreshold = 1.5
+    # Height (m) rocket must reach to count as flight
+    minHeight = 5.0
+    # Height (m) above launch altitude considered landed
+    landThreshold = 1.0
+    # Longest flight (seconds) before giving up on finding landing
+    maxFlight = 300.0
+    # Time (seconds) within which rocket must reach minHeight, or else launch is spurious
+    confirmTime = 3.0
+    # Altitudes further than this (m) from launch altitude are treated as glitches
+    maxAltitude = 500.0
+    # Idle when acceleration within this amount (g) of 1.0
+    idleTolerance = 0.15
+    # Shortest idle period (seconds) reported
+    minIdle = 10.0
+
+    # Results.  Each flight, idle period is dictionary giving first & last rows and times
+    flights = []
+    idles = []
+    restarts = []
+    rows = 0
+
+    # State carried between chunks
+    inFlight = False
+    flight = None
+    baseAltitude = 0.0
+    peakAltitude = 0.0
+    idleStart = None
+    idleEnd = None
+    lastSid = None
+    lastTime = None
+    # Flights that may still be extended by post-roll
+    pending = []
+    # Rows and times of recent samples, for finding start of pre-roll
+    recentRows = None
+    recentTimes = None
+
+    def __init__(self, root, chunkSize = None, preRoll = None, postRoll = None):
+        self.root = root
+        if chunkSize is not None:
+            self.chunkSize = chunkSize
+        if preRoll is not None:
+            self.preRoll = preRoll
+        if postRoll is not None:
+            self.postRoll = postRoll
+        self.flights = []
+        self.idles = []
+        self.restarts = []
+        self.rows = 0
+        self.inFlight = False
+        self.flight = None
+        self.idleStart = None
+        self.idleEnd = None
+        self.lastSid = None
+        self.lastTime = None
+        self.pending = []
+        self.recentRows = np.zeros(0, dtype=int)
+        self.recentTimes = np.zeros(0)
+
+    # Generate chunks of log as dictionary of NumPy arrays, along with row number of first entry
+    def chunks(self, fields):
+        try:
+            cfile = open(self.root + ".csv", "r")
+        except:
+            print("Couldn't open file '%s'" % (self.root + ".csv"))
+            return
+        creader = csv.reader(cfile)
+        header = next(creader, None)
+        if header is None:
+            cfile.close()
+            return
+        indices = [header.index(f) if f in header else -1 for f in fields]
+        first = 0
+        block = []
+        for row in creader:
+            block.append(row)
+            if len(block) >= self.chunkSize:
+                yield first, self.convert(block, fields, indices)
+                first += len(block)
+                block = []
+        if len(block) > 0:
+            yield first, self.convert(block, fields, indices)
+        cfile.close()
+
+    def convert(self, block, fields, indices):
+        data = {}
+        for f, i in zip(fields, indices):
+            if i < 0:
+                data[f] = np.zeros(len(block))
+            else:
+                data[f] = np.array([float(row[i]) if i < len(row) and row[i] != "" else np.nan for row in block])
+        return data
+
+    def run(self):
+        for first, data in self.chunks(["sid", "time", "altitude", "acceleration"]):
+            self.processChunk(first, data)
+        self.finish()
+
+    def processChunk(self, first, data):
+        n = len(data["time"])
+        times = data["time"]
+        alts = data["altitude"]
+        accels = data["acceleration"]
+        sids = data["sid"]
+        rows = first + np.arange(n)
+        # Stream restarts
+        prevSids = np.concatenate(([sids[0] if self.lastSid is None else self.lastSid], sids[:-1]))
+        restarted = sids < prevSids
+        self.restarts += rows[restarted].tolist()
+        self.lastSid = sids[-1]
+        self.findIdles(first, times, accels)
+        # Rows and times available for pre-roll
+        recentRows = np.concatenate((self.recentRows, rows))
+        recentTimes = np.concatenate((self.recentTimes, times))
+        pos = 0
+        while pos < n:
+            if not self.inFlight:
+                above = np.flatnonzero(accels[pos:] > self.launchThreshold)
+                if len(above) == 0:
+                    break
+                pos += int(above[0])
+                # Earliest row within pre-roll of launch
+                candidates = np.flatnonzero(recentTimes >= times[pos] - self.preRoll)
+                c = candidates[0] if len(candidates) > 0 else len(self.recentRows) + pos
+                self.startFlight(int(recentRows[c]), recentTimes[c], int(rows[pos]), times[pos], alts[pos])
+                pos += 1
+            else:
+                # Flight ends on landing, stream restart, or timeout
+                heights = alts[pos:] - self.baseAltitude
+                valid = np.abs(heights) <= self.maxAltitude
+                peaks = np.maximum(self.peakAltitude, np.maximum.accumulate(np.where(valid, heights, -np.inf)))
+                landed = (peaks >= self.minHeight) & valid & (heights < self.landThreshold)
+                elapsed = times[pos:] - self.flight["tlaunch"]
+                spurious = (peaks < self.minHeight) & (elapsed > self.confirmTime)
+                stops = np.flatnonzero(landed | spurious | restarted[pos:] | (elapsed > self.maxFlight))
+                if len(stops) == 0:
+                    self.peakAltitude = peaks[-1]
+                    break
+                stop = pos + int(stops[0])
+                self.peakAltitude = peaks[stops[0]]
+                self.endFlight(int(rows[stop]), times[stop], landed[stops[0]])
+                pos = stop + 1
+        self.extendFlights(rows, times)
+        keep = recentTimes >= times[-1] - self.preRoll
+        self.recentRows = recentRows[keep]
+        self.recentTimes = recentTimes[keep]
+        self.rows = first + n
+        self.lastTime = times[-1]
+
+    def startFlight(self, start, tstart, row, t, alt):
+        self.inFlight = True
+        self.baseAltitude = alt
+        self.peakAltitude = 0.0
+        self.flight = { "start" : start, "tstart" : float(tstart), "launch" : row, "tlaunch" : float(t) }
+
+    def endFlight(self, row, t, landed):
+        self.inFlight = False
+        flight = self.flight
+        flight["land"] = row
+        flight["tland"] = float(t)
+        flight["end"] = row
+        flight["tend"] = float(t)
+        flight["apogee"] = float(self.peakAltitude)
+        flight["landed"] = bool(landed)
+        if flight["apogee"] >= self.minHeight:
+            self.flights.append(flight)
+            self.pending.append(flight)
+        self.flight = None
+
+    # Extend recently ended flights to include post-roll
+    def extendFlights(self, rows, times):
+        remaining = []
+        for flight in self.pending:
+            extra = np.flatnonzero((rows > flight["end"]) & (times <= flight["tland"] + self.postRoll))
+            if len(extra) > 0:
+                flight["end"] = int(rows[extra[-1]])
+                flight["tend"] = float(times[extra[-1]])
+            if times[-1] <= flight["tland"] + self.postRoll:
+                remaining.append(flight)
+        self.pending = remaining
+
+    def findIdles(self, first, times, accels):
+        quiet = np.abs(accels - 1.0) < self.idleTolerance
+        # Boundaries of runs of quiet samples
+        edges = np.diff(np.concatenate(([0], quiet.astype(int), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1) - 1
+        if len(starts) == 0 or starts[0] > 0:
+            # Run carried over from previous chunk has ended
+            self.closeIdle()
+        for s, e in zip(starts, ends):
+            if s > 0 or self.idleStart is None:
+                self.idleStart = (first + int(s), float(times[s]))
+            self.idleEnd = (first + int(e), float(times[e]))
+            if e < len(times) - 1:
+                self.closeIdle()
+
+    def closeIdle(self):
+        if self.idleStart is None:
+            return
+        (start, tstart), (end, tend) = self.idleStart, self.idleEnd
+        if tend - tstart >= self.minIdle:
+            self.idles.append({ "start" : start, "tstart" : tstart, "end" : end, "tend" : tend })
+        self.idleStart = None
+
+    def finish(self):
+        if self.inFlight:
+            self.endFlight(self.rows-1, self.lastTime, False)
+        self.closeIdle()
+
+    def index(self):
+        return { "log" : self.root + ".csv", "rows" : self.rows, "restarts" : self.restarts,
+                 "idle" : self.idles, "flights" : self.flights }
+
+    def writeIndex(self):
+        name = indexName(self.root)
+        try:
+            with open(name, "w") as outfile:
+                json.dump(self.index(), outfile, indent=1)
+        except Exception as ex:
+            print("Couldn't write index file '%s' (%s)" % (name, str(ex)))
+            return
+        print("Wrote index file %s" % name)
+
+    # Write flights as separate logs, in one pass over input
+    def writeFlights(self):
+        if len(self.flights) == 0:
+            return
+        try:
+            cfile = open(self.root + ".csv", "r")
+            outfiles = [open(flightName(self.root, i) + ".csv", "w") for i in range(len(self.flights))]
+        except Exception as ex:
+            print("Couldn't write flight files (%s)" % str(ex))
+            return
+        header = cfile.readline()
+        for outfile in outfiles:
+            outfile.write(header)
+        for r, line in enumerate(cfile):
+            for flight, outfile in zip(self.flights, outfiles):
+                if flight["start"] <= r <= flight["end"]:
+                    outfile.write(line)
+        cfile.close()
+        for i, outfile in enumerate(outfiles):
+            outfile.close()
+            print("Wrote flight file %s.csv" % flightName(self.root, i))
+
+    def showSegments(self):
+        print("%s: %d rows, %d restarts, %d idle periods, %d flights" % (self.root, self.rows, len(self.restarts), len(self.idles), len(self.flights)))
+        for idle in self.idles:
+            print("  idle    rows %d-%d  t = %.3f-%.3f" % (idle["start"], idle["end"], idle["tstart"], idle["tend"]))
+        for i, flight in enumerate(self.flights):
+            print("  flight %d rows %d-%d  t = %.3f-%.3f  apogee = %.2f%s" % (i+1, flight["start"], flight["end"], flight["tstart"], flight["tend"],
+                                                                            flight["apogee"], "" if flight["landed"] else " (no landing)"))
+
+# Open evaluator for flight from index, without copying data
+def openFlight(root, index):
+    try:
+        with open(indexName(root), "r") as infile:
+            flights = json.load(infile)["flights"]
+    except Exception as ex:
+        print("Couldn't read index file '%s' (%s)" % (indexName(root), str(ex)))
+        return None
+    if index < 0 or index >= len(flights):
+        print("Log %s has no flight #%d" % (root, index+1))
+        return None
+    return analyze.Evaluator(root, (flights[index]["start"], flights[index]["end"]))
+
+def run(name, args):
+    write = False
+    chunkSize = None
+    preRoll = None
+    postRoll = None
+    optList, args = getopt.getopt(args, "hwc:b:a:")
+    for (opt, val) in optList:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-w':
+            write = True
+        elif opt == '-c':
+            chunkSize = int(val)
+        elif opt == '-b':
+            preRoll = float(val)
+        elif opt == '-a':
+            postRoll = float(val)
+    for arg in args:
+        fields = arg.split(".")
+        if len(fields) > 1 and fields[-1] == 'csv':
+            arg = ".".join(fields[:-1])
+        s = Segmenter(arg, chunkSize, preRoll, postRoll)
+        s.run()
+        s.showSegments()
+        s.writeIndex()
+        if write:
+            s.writeFlights()
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
+    sys.exit(0)
@@ -8,6 +8,7 @@ import getopt
 
 import recorder
 import hsv
+import profiler
 
 def usage(prog):
     print("Usage: %s [-h] [-v VERB] [-n RECT] [-m [x|a]] [-p PORT] [-b BAUD] [-t TRIES] [-s SID] [-k BSIZE]" % prog)
@@ -19,6 +20,7 @@ def usage(prog):
     print("  -b BAUD Set serial interface baud rate")
     print("  -t TRY  Specify number of tries in opening serial port")
     print("  -k BUF  Buffer with up to BUF samples")
+    profiler.usage()
 
 
 devPrefix = "/dev/cu.usbmodem"
@@ -157,10 +159,12 @@ class Beater:
     def update(self):
         if self.terminating:
             return False
-        tup = self.sampler.getNextSampleTuple()
+        with profiler.stage("receive"):
+            tup = self.sampler.getNextSampleTuple()
         if tup is None:
             return True
-        r = self.formatter.formatSample(tup)
+        with profiler.stage("parse"):
+            r = self.formatter.formatSample(tup)
         if r is None:
             return True
         if self.mode == ShowMode.acceleration:
@@ -171,9 +175,10 @@ class Beater:
             value = r.altitude - self.averageAltitude
             vmin = self.altMin
             vmax = self.altMax
-        color = hsv.valueToColor(value, vmin, vmax)
-        self.updateRectangles(color)
-        self.canvas.update()
+        with profiler.stage("render"):
+            color = hsv.valueToColor(value, vmin, vmax)
+            self.updateRectangles(color)
+            self.canvas.update()
         return True
 
     def run(self, maxCount = None):
@@ -214,7 +219,7 @@ def run(name, args):
     bufSize = 1
     
 
-    optList, args = getopt.getopt(args, "hv:p:b:t:s:m:n:k:")
+    optList, args = getopt.getopt(args, "hv:p:b:t:s:m:n:k:", profiler.longOptions)
     for (opt, val) in optList:
         if opt == '-h':
             usage(name)
@@ -243,6 +248,9 @@ def run(name, args):
             if mode is None:
                 print("Mode must be 'a' or 'x'")
                 return
+        elif opt in profiler.optionNames:
+            profiler.setOption(opt, val)
+    profiler.begin()
 
     if port is None:
         plist = recorder.findPorts()
@@ -0,0 +1,174 @@
+#!/usr/local/bin/python3
+
+# Read soundtrack of rocket video and find launch from its loudness.
+# Shared by annotate and sync
+
+import scipy.io
+import numpy as np
+import ffmpeg
+
+class Sound:
+    # Process audio data
+    # Use to detect launch starting point
+    # Audio is read either from WAV file or decoded from video file through pipe,
+    # a chunk at a time, so that memory use does not grow with recording length
+
+    # Name of audio file
+    audioName = None
+    # Name of video file, when decoding audio directly
+    videoName = None
+    # Verbosity level
+    verbLevel = 1
+    # Keep intermediate files
+    keep = False
+
+    # General parameters
+    # audio sample rate
+    rate = 8000
+    # Number of audio channels
+    channels = 1
+    # RMS level for launch
+    threshold = 20000.0
+    # Required duration (seconds)
+    duration = 1.0
+    # Sample interval
+    tdelta = 0.01
+    # Seconds of audio processed at a time
+    chunkDuration = 10.0
+    # Portion of audio to read (seconds).  Duration of None reads to end
+    startTime = 0.0
+    maxDuration = None
+    # Number of samples read
+    sampleCount = 0
+    
+    def __init__(self, aname, verbLevel = 1, keep = False, videoName = None, rate = None, channels = None):
+        self.audioName = aname
+        self.verbLevel = verbLevel
+        self.keep = keep
+        self.videoName = videoName
+        if rate is not None:
+            self.rate = rate
+        if channels is not None:
+            self.channels = channels
+        self.sampleCount = 0
+
+    def readWav(self):
+        try:
+            self.rate, val = scipy.io.wavfile.read(self.audioName, mmap=True)
+        except Exception as ex:
+            print("Couldn't read WAV file '%s' (%s)" % (self.audioName, str(ex)))
+            return None
+        return val
+
+    # Generate chunks of samples, each covering chunkDuration seconds
+    def readChunks(self):
+        if self.videoName is None:
+            val = self.readWav()
+            if val is None:
+                return
+            first = int(self.startTime * self.rate)
+            last = len(val) if self.maxDuration is None else min(len(val), first + int(self.maxDuration * self.rate))
+            count = int(self.chunkDuration * self.rate)
+            for pos in range(first, last, count):
+                self.sampleCount += len(val[pos:min(pos+count, last)])
+                yield val[pos:min(pos+count, last)]
+            return
+        args = {}
+        if self.startTime > 0:
+            args['ss'] = self.startTime
+        if self.maxDuration is not None:
+            args['t'] = self.maxDuration
+        try:
+            process = (ffmpeg.input(self.videoName, **args).audio
+                       .output('pipe:', format='s16le', acodec='pcm_s16le')
+                       .global_args('-loglevel', 'error' if self.verbLevel <= 3 else 'info')
+                       .run_async(pipe_stdout=True))
+        except Exception as ex:
+            print("Couldn't get audio from video file '%s' (%s)" % (self.videoName, str(ex)))
+            return
+        frameSize = 2 * self.channels
+        size = int(self.chunkDuration * self.rate) * frameSize
+        try:
+            while True:
+                data = process.stdout.read(size)
+                if len(data) < frameSize:
+                    break
+                self.sampleCount += len(data) // frameSize
+                yield np.frombuffer(data, dtype='<i2', count=len(data)//2 - (len(data)//2) % self.channels).reshape(-1, self.channels)
+        finally:
+            # Stop decoding when caller is done
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+    # Construct array of RMS values for array
+    # Each for a sample of duration tdelta
+    def rmsValues(self, val):
+        scount = int(self.tdelta * self.rate)
+        n = len(val) // scount
+        windows = np.reshape(val[:n*scount], (n, scount, -1))
+        rms = np.empty(n)
+        # Limit size of temporary arrays
+        block = max(1, int(self.chunkDuration / self.tdelta))
+        for pos in range(0, n, block):
+            w = windows[pos:pos+block].astype(float)
+            rms[pos:pos+block] = np.sqrt(np.sum(np.square(w), axis=(1,2))/float(scount))
+        return rms
+
+    # Find first run of RMS values above threshold lasting for duration.
+    # run is length of run ending just before rms[0].
+    # Return (index of start of run, or None, length of run ending at end of rms)
+    def findRun(self, rms, run = 0):
+        need = int(np.ceil(self.duration / self.tdelta - 1e-9))
+        above = np.asarray(rms) > self.threshold
+        if len(above) == 0:
+            return None, run
+        idx = np.arange(len(above))
+        # Position of most recent value below threshold
+        last = np.maximum.accumulate(np.where(above, -1, idx))
+        lengths = idx - last + np.where(last < 0, run, 0)
+        hits = np.flatnonzero(lengths >= need)
+        if len(hits) > 0:
+            return int(hits[0]) - need + 1, int(lengths[hits[0]])
+        return None, int(lengths[-1])
+
+    def findLaunchTime(self, rms):
+        start, run = self.findRun(rms)
+        return None if start is None else start * self.tdelta
+
+    # Generate arrays of RMS values, one for each chunk of audio
+    def rmsChunks(self):
+        scount = int(self.tdelta * self.rate)
+        leftover = None
+        for val in self.readChunks():
+            if leftover is not None and len(leftover) > 0:
+                val = np.concatenate((leftover, val))
+            rms = self.rmsValues(val)
+            leftover = val[len(rms) * scount:]
+            yield rms
+
+    # RMS values for all of audio, starting at startTime
+    def envelope(self):
+        return np.concatenate([np.zeros(0)] + list(self.rmsChunks()))
+
+    # Run entire chain on audio.  Stops reading once launch found
+    def launchTime(self):
+        windows = 0
+        run = 0
+        t = None
+        for rms in self.rmsChunks():
+            start, run = self.findRun(rms, run)
+            if start is not None:
+                t = self.startTime + (windows + start) * self.tdelta
+                windows += len(rms)
+                break
+            windows += len(rms)
+        if self.verbLevel >= 2:
+            print("Read %d samples from %s" % (self.sampleCount, self.audioName if self.videoName is None else self.videoName))
+            print("Got %d RMS values" % windows)
+        if t is None:
+            return -1.0
+        if self.verbLevel >= 1:
+            print("Got launch time %.3f" % t)
+        return t
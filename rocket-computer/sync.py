@@ -0,0 +1,164 @@
+#!/usr/local/bin/python3
+
+# Find time offset between video and flight data by cross-correlating
+# loudness of soundtrack (RMS envelope) with acceleration.
+# Correlation is computed with FFT, so cost grows as n log n in length of recordings.
+# Offset is data time minus video time, refined to fraction of sample interval.
+
+import sys
+import getopt
+import numpy as np
+import ffmpeg
+
+import analyze
+import soundtrack
+
+def usage(name):
+    print("Usage: %s [-h] [-v VERB] [-s SECS] -i IVFILE.AVI -d DFILE.csv" % name)
+    print(" -h       Print this message")
+    print(" -v VERB  Set verbosity level (default = 1)")
+    print(" -s SECS  Search for offset within SECS of offset from launch detection (default = %.1f)" % Sync.searchWindow)
+    print("          SECS = 0 searches all offsets")
+
+# Scale values to zero mean and unit deviation
+def normalize(values):
+    values = np.asarray(values, dtype=float)
+    values = values - np.mean(values)
+    dev = np.std(values)
+    return values / dev if dev > 0 else values
+
+# Cross-correlation c[k] = sum a[i] * b[i+k], for lags k from -(len(a)-1) to len(b)-1.
+# Returns array with lag k at index k + len(a) - 1
+def crossCorrelate(a, b):
+    n = len(a) + len(b) - 1
+    size = 1 << (n-1).bit_length()
+    # Correlation is convolution with reversed sequence
+    product = np.fft.rfft(a[::-1], size) * np.fft.rfft(b, size)
+    return np.fft.irfft(product, size)[:n]
+
+# Position of vertex of parabola through (-1, ym), (0, y0), (1, yp)
+def parabolicPeak(ym, y0, yp):
+    d = ym - 2.0*y0 + yp
+    return 0.0 if d == 0 else max(-0.5, min(0.5, 0.5 * (ym - yp) / d))
+
+class Sync:
+    # Sample interval (seconds) of both signals
+    tdelta = 0.01
+    # Seconds either side of initial offset to search
+    searchWindow = 5.0
+    # Signals must overlap by this many seconds
+    minOverlap = 2.0
+    # Alignment with lower confidence not used
+    minConfidence = 0.3
+
+    # Audio RMS values, starting at audioStart (video time)
+    audio = None
+    audioStart = 0.0
+    # Accelerations, starting at dataStart (data time)
+    data = None
+    dataStart = 0.0
+
+    # Results
+    offset = None
+    confidence = 0.0
+
+    def __init__(self, audio, audioStart, data, dataStart, tdelta = None):
+        self.audio = np.asarray(audio, dtype=float)
+        self.audioStart = audioStart
+        self.data = np.asarray(data, dtype=float)
+        self.dataStart = dataStart
+        if tdelta is not None:
+            self.tdelta = tdelta
+        self.offset = None
+        self.confidence = 0.0
+
+    # Find offset maximizing correlation.  guess limits search to within searchWindow of it.
+    # Return (offset, confidence), where confidence is correlation coefficient over overlapping portion
+    def find(self, guess = None):
+        na = len(self.audio)
+        nb = len(self.data)
+        if na < 3 or nb < 3:
+            return None, 0.0
+        c = crossCorrelate(normalize(self.audio), normalize(self.data))
+        lags = np.arange(len(c)) - (na - 1)
+        offsets = self.dataStart - self.audioStart + lags * self.tdelta
+        overlap = np.minimum(na, nb - lags) - np.maximum(0, -lags)
+        valid = overlap >= max(3, int(self.minOverlap / self.tdelta))
+        if guess is not None and self.searchWindow > 0:
+            valid &= np.abs(offsets - guess) <= self.searchWindow
+        if not np.any(valid):
+            return None, 0.0
+        # Mean product over overlap, so that partial overlaps are not penalized
+        score = np.where(valid, c / np.maximum(overlap, 1), -np.inf)
+        best = int(np.argmax(score))
+        frac = 0.0
+        if 0 < best < len(c)-1 and valid[best-1] and valid[best+1]:
+            frac = parabolicPeak(score[best-1], score[best], score[best+1])
+        lag = int(lags[best])
+        a = self.audio[max(0, -lag):max(0, -lag) + overlap[best]]
+        b = self.data[max(0, lag):max(0, lag) + overlap[best]]
+        self.confidence = float(np.corrcoef(a, b)[0,1]) if np.std(a) > 0 and np.std(b) > 0 else 0.0
+        self.offset = float(offsets[best] + frac * self.tdelta)
+        return self.offset, self.confidence
+
+# Accelerations of flight resampled at interval tdelta.  Returns (start time, values)
+def dataSignal(evaluator, tdelta = Sync.tdelta):
+    times = evaluator.getColumn("time")
+    count = int(np.floor((times[-1] - times[0]) / tdelta)) + 1
+    grid = analyze.frameTimes(times[0], count, tdelta)
+    return times[0], evaluator.resampleColumns(["acceleration"], grid)[0]
+
+def run(name, args):
+    verbLevel = 1
+    inVideoName = None
+    inDataName = None
+    optList, args = getopt.getopt(args, "hv:s:i:d:")
+    for (opt, val) in optList:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-v':
+            verbLevel = int(val)
+        elif opt == '-s':
+            Sync.searchWindow = float(val)
+        elif opt == '-i':
+            inVideoName = val
+        elif opt == '-d':
+            inDataName = val
+    if inVideoName is None or inDataName is None:
+        print("Require input video and data files")
+        usage(name)
+        return
+    try:
+        streams = ffmpeg.probe(inVideoName)['streams']
+    except Exception as ex:
+        print("Couldn't probe video file '%s' (%s)" % (inVideoName, str(ex)))
+        return
+    astreams = [st for st in streams if st.get('codec_type') == 'audio']
+    if len(astreams) == 0:
+        print("Video file '%s' has no audio" % inVideoName)
+        return
+    rate = int(astreams[0]['sample_rate'])
+    channels = int(astreams[0].get('channels', 1))
+    fields = inDataName.split(".")
+    if len(fields) > 1 and fields[-1] == 'csv':
+        inDataName = ".".join(fields[:-1])
+    evaluator = analyze.Evaluator(inDataName)
+    r = evaluator.findLaunch()
+    guess = None
+    if r >= 0:
+        videoLaunch = soundtrack.Sound(None, verbLevel, False, inVideoName, rate, channels).launchTime()
+        if videoLaunch >= 0:
+            guess = evaluator.getFloatField(r, "time") - videoLaunch
+            print("Offset from launch detection: %.3f" % guess)
+    envelope = soundtrack.Sound(None, 0, False, inVideoName, rate, channels).envelope()
+    dataStart, data = dataSignal(evaluator)
+    offset, confidence = Sync(envelope, 0.0, data, dataStart).find(guess)
+    if offset is None:
+        print("Couldn't align audio with data")
+        return
+    print("Offset from correlation: %.3f (confidence %.2f)" % (offset, confidence))
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
+    sys.exit(0)
@@ -0,0 +1,164 @@
+#!/usr/local/bin/python3
+
+# Resample flight log onto uniform time grid.
+# Logged times are interpolated from when the host received each packet,
+# and samples lost in transmission leave gaps.  This stage produces regular
+# arrays for numeric work, along with a mask marking grid points that fall in gaps.
+# Results are cached in a file next to the log.
+
+import sys
+import os
+import getopt
+import numpy as np
+
+import analyze
+import estimator
+
+def usage(name):
+    print("Usage: %s [-h] [-f] [-r RATE] [-g GAP] F1.csv F2.csv ..." % name)
+    print(" -h       Print this message")
+    print(" -f       Force rebuild, ignoring cached results")
+    print(" -r RATE  Set sample rate (Hz) of grid (default = %.1f)" % defaultRate)
+    print(" -g GAP   Set longest interval (seconds) between samples not considered a gap (default = %.2f)" % defaultGap)
+
+defaultRate = 20.0
+defaultGap = 0.2
+
+# Fields that should hold their previous value rather than be interpolated
+holdFields = ["sid", "SPS", "Reliability", "RSSI"]
+
+# Names of statistics about gaps
+statNames = ["gaps", "missing", "gap-time", "longest", "masked", "reliability"]
+
+def cacheName(root, rate):
+    return "%s-uniform-%gHz.npz" % (root, rate)
+
+class UniformFlight:
+    root = None
+    rate = defaultRate
+    maxGap = defaultGap
+    # Grid times
+    times = None
+    # Mask indicating which grid points lie within gap
+    mask = None
+    # Dictionary of resampled columns, each a NumPy array
+    columns = {}
+    # Dictionary of gap statistics
+    stats = {}
+
+    def __init__(self, root, rate = defaultRate, maxGap = defaultGap, useCache = True):
+        self.root = root
+        self.rate = rate
+        self.maxGap = maxGap
+        self.columns = {}
+        self.stats = {}
+        csvName = root + ".csv"
+        if not os.path.exists(csvName):
+            print("Couldn't open file '%s'" % csvName)
+            self.root = None
+            return
+        hash = analyze.contentHash(csvName)
+        if not (useCache and self.load(hash)):
+            if not self.build():
+                self.root = None
+                return
+            self.save(hash)
+
+    # Load from cache.  Return False if not available or out of date
+    def load(self, hash):
+        try:
+            data = np.load(cacheName(self.root, self.rate))
+        except Exception:
+            return False
+        if str(data['hash']) != hash or float(data['maxGap']) != self.maxGap:
+            return False
+        self.times = data['times']
+        self.mask = data['mask']
+        for kw in data['names']:
+            self.columns[str(kw)] = data['column-' + str(kw)]
+        self.stats = {name : float(v) for name, v in zip(statNames, data['stats'])}
+        return True
+
+    def save(self, hash):
+        arrays = { 'column-' + kw : v for kw, v in self.columns.items() }
+        try:
+            np.savez(cacheName(self.root, self.rate), hash=hash, maxGap=self.maxGap, times=self.times, mask=self.mask,
+                     names=np.array(list(self.columns.keys())), stats=np.array([self.stats[name] for name in statNames]), **arrays)
+        except Exception as ex:
+            print("Couldn't write cache file '%s' (%s)" % (cacheName(self.root, self.rate), str(ex)))
+
+    def build(self):
+        e = analyze.Evaluator(self.root)
+        if e.root is None or e.count() < 2:
+            return False
+        fields = list(e.entries[0].keys())
+        times = e.getColumn("time")
+        self.times = times[0] + np.arange(int(np.floor((times[-1]-times[0]) * self.rate)) + 1) / self.rate
+        linear = [kw for kw in fields if kw != "time" and kw not in holdFields]
+        held = [kw for kw in fields if kw in holdFields]
+        for kw, v in zip(linear, e.resampleColumns(linear, self.times, "linear")):
+            self.columns[kw] = v
+        for kw, v in zip(held, e.resampleColumns(held, self.times, "hold")):
+            self.columns[kw] = v
+        # Find gaps following each sample
+        spacing = np.diff(times)
+        sequence = e.getColumn("sid") if "sid" in fields else None
+        # Any jump in sequence numbers is a gap
+        gapAfter = estimator.findGaps(times, sequence, self.maxGap, 1)
+        missing = 0
+        if sequence is not None:
+            jumps = np.diff(sequence)
+            missing = int(np.sum(jumps[jumps > 1] - 1))
+        gapAfter = np.append(gapAfter, False)
+        before = np.clip(np.searchsorted(times, self.times, side='right') - 1, 0, len(times)-1)
+        self.mask = gapAfter[before] & (self.times > times[before])
+        gapLengths = spacing[gapAfter[:-1]]
+        self.stats = { "gaps" : len(gapLengths),
+                       "missing" : missing,
+                       "gap-time" : float(np.sum(gapLengths)),
+                       "longest" : float(np.max(gapLengths)) if len(gapLengths) > 0 else 0.0,
+                       "masked" : float(np.mean(self.mask)),
+                       "reliability" : float(np.min(e.getColumn("Reliability"))) if "Reliability" in fields else 100.0 }
+        return True
+
+    def count(self):
+        return len(self.times)
+
+    def getColumn(self, kw):
+        if kw == "time":
+            return self.times
+        return self.columns[kw]
+
+    def showStats(self):
+        fields = [self.root, "%d" % self.count(), "%d" % self.stats["gaps"], "%d" % self.stats["missing"],
+                  "%.3f" % self.stats["gap-time"], "%.3f" % self.stats["longest"], "%.2f%%" % (100.0 * self.stats["masked"]),
+                  "%.1f%%" % self.stats["reliability"]]
+        print("\t".join(fields))
+
+def run(name, args):
+    rate = defaultRate
+    maxGap = defaultGap
+    useCache = True
+    optList, args = getopt.getopt(args, "hfr:g:")
+    for (opt, val) in optList:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-f':
+            useCache = False
+        elif opt == '-r':
+            rate = float(val)
+        elif opt == '-g':
+            maxGap = float(val)
+    print("\t".join(["flight", "points", "gaps", "missing", "gap-time", "longest", "masked", "min-rel"]))
+    for arg in args:
+        fields = arg.split(".")
+        if len(fields) > 1 and fields[-1] == 'csv':
+            arg = ".".join(fields[:-1])
+        u = UniformFlight(arg, rate, maxGap, useCache)
+        if u.root is not None:
+            u.showStats()
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
+    sys.exit(0)